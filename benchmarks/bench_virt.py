@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+"""
+Scale benchmarks for the virt managers, without NSO or a hypervisor.
+
+For each topology shape and size this times:
+
+- snapshot: compiling the topology configuration through maagic
+- managers: building the hypervisor, resource, domain and connection managers
+- connection-plan: resolving what every connected interface of every device
+  is attached to (managed network, bridge, direct link or overlay)
+- domain-xml: generating the libvirt domain XML of every VM
+
+Results are written as JSON, one entry per shape and size, with the best
+time of each stage over the repeats.
+
+Usage:
+    python3 benchmarks/bench_virt.py --sizes 10,100,500 --output results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import nso_standin
+
+nso_standin.install()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'packages', 'topology', 'python'))
+
+#pylint: disable=wrong-import-position
+from ncs import maagic, maapi
+from virt.connection import ConnectionManager
+from virt.domain import DomainManager
+from virt.domain_docker import DomainDocker
+from virt.domain_libvirt import DomainLibvirt, DomainXmlBuilder
+from virt.hypervisor import HypervisorManager
+from virt.template import Templates, xml_to_string
+from virt.topology_snapshot import compile_topology
+from virt.virt_factory import ResourceManager
+
+import topology_generator
+
+DEFAULT_SIZES = (10, 50, 100, 500, 1000, 2000)
+# A full mesh has n * (n - 1) / 2 links
+MAX_MESH_DEVICES = 200
+
+DOMAIN_REGISTRY = {
+    topology_generator.VM_DEVICE_TYPE: DomainLibvirt,
+    topology_generator.CONTAINER_DEVICE_TYPE: DomainDocker}
+
+
+def _timed(timings, stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    timings[stage] = min(timings.get(stage, elapsed), elapsed)
+    return result
+
+def _build_managers(snapshot, topology, log):
+    hypervisor_mgr = HypervisorManager(snapshot, log)
+    resource_mgr = ResourceManager(
+            snapshot.get_hypervisor(snapshot.hypervisor), 'admin',
+            maagic.get_root(topology).devices.authgroups.group)
+    domain_mgr = DomainManager(snapshot, DOMAIN_REGISTRY)
+    connection_mgr = ConnectionManager(
+            snapshot, hypervisor_mgr, domain_mgr, resource_mgr)
+    return (resource_mgr, domain_mgr, connection_mgr)
+
+def _connection_plan(snapshot, connection_mgr):
+    plan = []
+    for device in snapshot.devices:
+        for iface_id in connection_mgr.get_device_iface_ids(device.id):
+            plan.append((device.id, iface_id,
+                connection_mgr.get_interface_managed_network_info(
+                    device.id, iface_id),
+                connection_mgr.get_interface_direct_link_info(
+                    device.id, iface_id),
+                connection_mgr.get_interface_any_bridge_info(
+                    device.id, iface_id),
+                connection_mgr.get_interface_geneve_info(device.id, iface_id),
+                connection_mgr.get_network_udp_ports(device.id, iface_id),
+                connection_mgr.get_interface_host_info(device.id, iface_id)))
+    return plan
+
+def _domain_xml(snapshot, domain_mgr, resource_mgr, connection_mgr):
+    templates = Templates()
+    templates.load_template('templates', 'interface.xml')
+    templates.load_template('templates', 'disk.xml')
+    templates.load_template('images', 'generic.xml')
+
+    domain_xml = []
+    for device in snapshot.devices:
+        if domain_mgr.is_container(device.id):
+            continue
+        xml_builder = DomainXmlBuilder(device.id, device.name,
+                resource_mgr, connection_mgr, templates)
+        xml_builder.create_base(2, 4096, 'generic')
+        xml_builder.add_disk('default', None)
+        xml_builder.add_mgmt_iface(DomainLibvirt.MGMT_IFACE_TYPE)
+        xml_builder.add_data_ifaces(DomainLibvirt.INCLUDE_NULL_IFACES,
+                DomainLibvirt.DATA_IFACE_TYPE)
+        domain_xml.append(xml_to_string(xml_builder.domain_xml))
+    return domain_xml
+
+def run_benchmark(shape, num_devices, repeat, log):
+    config = topology_generator.generate_config(shape, num_devices)
+    nso_standin.load_config(config)
+    topology_path = f'/topologies/topology{{{topology_generator.TOPOLOGY_NAME}}}'
+
+    timings = {}
+    for _ in range(repeat):
+        with maapi.single_read_trans('admin', 'python') as trans:
+            topology = maagic.get_node(trans, topology_path)
+            snapshot = _timed(timings, 'snapshot', compile_topology, topology)
+            (resource_mgr, domain_mgr, connection_mgr) = _timed(
+                    timings, 'managers',
+                    _build_managers, snapshot, topology, log)
+            plan = _timed(timings, 'connection-plan',
+                    _connection_plan, snapshot, connection_mgr)
+            domain_xml = _timed(timings, 'domain-xml', _domain_xml,
+                    snapshot, domain_mgr, resource_mgr, connection_mgr)
+
+    return {
+        'shape': shape,
+        'devices': num_devices,
+        'containers': sum(domain_mgr.is_container(device.id)
+                          for device in snapshot.devices),
+        'links': len(snapshot.links),
+        'networks': len(snapshot.networks),
+        'interfaces': len(plan),
+        'domain-xml-bytes': sum(len(xml) for xml in domain_xml),
+        'seconds': {stage: round(elapsed, 6)
+                    for stage, elapsed in timings.items()}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--shapes', default=','.join(topology_generator.SHAPES),
+            help='Comma separated topology shapes (ring, mesh, clos)')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+            help='Comma separated numbers of devices')
+    parser.add_argument('--repeat', type=int, default=3,
+            help='Runs per shape and size, the best time is reported')
+    parser.add_argument('--max-mesh-devices', type=int,
+            default=MAX_MESH_DEVICES,
+            help='Skip full meshes larger than this')
+    parser.add_argument('--output', help='Write results to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    log = logging.getLogger('bench')
+
+    results = []
+    for shape in args.shapes.split(','):
+        for num_devices in map(int, args.sizes.split(',')):
+            if shape == 'mesh' and num_devices > args.max_mesh_devices:
+                continue
+            result = run_benchmark(shape, num_devices, args.repeat, log)
+            print(f'{shape:>5} {num_devices:>5} devices: ' + ', '.join(
+                    f'{stage} {elapsed * 1000:.1f}ms'
+                    for stage, elapsed in result['seconds'].items()),
+                  file=sys.stderr)
+            results.append(result)
+
+    report = json.dumps({
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'results': results}, indent=2)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as output_file:
+            output_file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+"""
+Lightweight stand-ins for the NSO Python API, so the virt package can be
+imported and exercised without NSO.
+
+The maagic stand-in serves a nested dict of configuration (see
+topology_generator.py) through the same attribute, list and keypath access
+that the virt managers use. Transactions read from that tree and discard
+writes. Third party modules that are not installed (libvirt, docker,
+paramiko, ...) are replaced by empty placeholder modules, as the benchmarks
+never connect to a hypervisor.
+"""
+import importlib
+import itertools
+import re
+import sys
+import types
+from contextlib import contextmanager
+
+RUNNING = 2
+OPERATIONAL = 4
+
+OPTIONAL_MODULES = (
+    'libvirt',
+    'docker',
+    'paramiko',
+    'passlib',
+    'passlib.hash',
+    'pycdlib',
+    'fs',
+    'fs.tarfs',
+    'pyvxr',
+    'pyvxr.vxr',
+    'pyvxr.errors',
+    'setproctitle',
+    'telnetlib3',
+    'telnetlib3.telnetlib')
+
+# Value of a presence container which does not exist
+ABSENT = object()
+
+_config = {'root': None, 'txid': 0}
+_txid_counter = itertools.count(1)
+
+
+class KeyedList():
+    """Configuration data for a YANG list, with the names of its key leaves"""
+    def __init__(self, keys, entries):
+        self.keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        self.entries = list(entries)
+        self.index = {_format_keys(entry[key] for key in self.keys): entry
+                      for entry in self.entries}
+
+
+def _leaf_name(name):
+    return name.replace('_', '-')
+
+def _format_keys(values):
+    return ' '.join(str(value) for value in values)
+
+
+class Container():
+    def __init__(self, root, path, data):
+        self._root = root
+        self._path = path
+        self._data = data
+        self._cs_node = None
+
+    def _child(self, name):
+        value = self._data.get(name, None) if self._data is not None else None
+        path = f'{self._path}/{name}'
+        if isinstance(value, KeyedList):
+            return List(self._root, path, value)
+        if isinstance(value, dict) or value is ABSENT:
+            return Container(self._root, path,
+                    value if value is not ABSENT else None)
+        return value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._child(_leaf_name(name))
+
+    def __getitem__(self, name):
+        return self._child(name)
+
+    def exists(self):
+        return self._data is not None
+
+
+class List():
+    def __init__(self, root, path, data):
+        self._root = root
+        self._path = path
+        self._data = data
+
+    def _entry(self, key_str, entry):
+        return Container(self._root, f'{self._path}{{{key_str}}}', entry)
+
+    def __iter__(self):
+        for entry in self._data.entries:
+            yield self._entry(
+                    _format_keys(entry[key] for key in self._data.keys), entry)
+
+    def __len__(self):
+        return len(self._data.entries)
+
+    def _key_str(self, key):
+        return _format_keys(key) if isinstance(key, tuple) else str(key)
+
+    def __contains__(self, key):
+        return self._key_str(key) in self._data.index
+
+    def __getitem__(self, key):
+        key_str = self._key_str(key)
+        return self._entry(key_str, self._data.index[key_str])
+
+
+class Value():
+    def __init__(self, value):
+        self._value = value
+
+    def val2str(self, _cs_node):
+        return str(self._value)
+
+
+class Trans():
+    def __init__(self, root):
+        self.root = root
+
+    def get_elem(self, path):
+        return Value(get_node(self, path))
+
+    def set_elem(self, value, path):
+        pass
+
+    def safe_delete(self, path):
+        pass
+
+    def apply(self):
+        pass
+
+
+_PATH_SEGMENT = re.compile(r'([^/{]+)(?:\{([^}]*)\})?')
+
+def _split_path(path):
+    return [match.groups() for match in _PATH_SEGMENT.finditer(path)]
+
+def _join_path(segments):
+    return ''.join(f'/{name}' + (f'{{{key}}}' if key is not None else '')
+                   for (name, key) in segments)
+
+
+# maagic
+
+def get_root(node_or_trans):
+    return node_or_trans.root if isinstance(
+            node_or_trans, Trans) else node_or_trans._root
+
+def get_trans(_node):
+    return Trans(_config['root'])
+
+def get_node(node_or_trans, path):
+    node = get_root(node_or_trans)
+    for (name, key) in _split_path(path):
+        node = node[name]
+        if key is not None:
+            node = node[key]
+    return node
+
+def cd(node, path):
+    segments = _split_path(node._path)
+    for name in path.split('/'):
+        if name == '..':
+            segments.pop()
+        elif name:
+            segments.extend(_split_path(name))
+    return get_node(node, _join_path(segments))
+
+
+# maapi
+
+@contextmanager
+def single_read_trans(_user, _context, db=RUNNING): #pylint: disable=unused-argument
+    yield Trans(_config['root'])
+
+@contextmanager
+def single_write_trans(_user, _context, db=RUNNING): #pylint: disable=unused-argument
+    yield Trans(_config['root'])
+
+
+def load_config(config):
+    """Serve a new configuration tree, with a new transaction id"""
+    _config['root'] = Container(None, '', config)
+    _config['root']._root = _config['root']
+    _config['txid'] = next(_txid_counter)
+    return _config['root']
+
+
+class _PlaceholderModule(types.ModuleType):
+    """Module whose attributes are placeholder classes (or 0 for constants)"""
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return 0 if name.isupper() else type(name, (), {})
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+def _action_decorator(function):
+    return function
+
+def install():
+    """
+    Install the NSO stand-ins, and placeholders for any missing third party
+    module, into sys.modules. Must be called before importing virt.
+    """
+    maagic = _module('ncs.maagic', get_root=get_root, get_trans=get_trans,
+            get_node=get_node, cd=cd)
+    maapi = _module('ncs.maapi', single_read_trans=single_read_trans,
+            single_write_trans=single_write_trans)
+    dp = _module('ncs.dp', Action=type('Action', (), {
+            'action': staticmethod(_action_decorator)}))
+    template = _module('ncs.template',
+            Template=type('Template', (), {}),
+            Variables=type('Variables', (), {}))
+    _module('ncs', maagic=maagic, maapi=maapi, dp=dp, template=template,
+            RUNNING=RUNNING, OPERATIONAL=OPERATIONAL)
+
+    cdb = _module('_ncs.cdb', DATA_SOCKET=2,
+            connect=lambda *args: None,
+            close=lambda sock: sock.close(),
+            get_txid=lambda sock: _config['txid'])
+    _module('_ncs', cdb=cdb, PORT=4569,
+            cs_node_cd=lambda cs_node, path: None,
+            decrypt=lambda value: value,
+            xpath_pp_kpath=str)
+
+    for name in OPTIONAL_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            sys.modules[name] = _PlaceholderModule(name)
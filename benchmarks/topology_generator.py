@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+"""
+Synthetic topology configuration for the benchmarks.
+
+Generates the configuration tree served by the maagic stand-in: one topology
+with its devices, links and networks, plus the hypervisors and device
+definitions it uses. Devices alternate between two hypervisors, and a
+proportion of them are containers, so the benchmarks cover UDP, GENEVE,
+veth and managed network connections.
+
+Note the topology model limits device ids to 255. Larger topologies are
+still generated, to measure how the managers scale.
+"""
+from nso_standin import ABSENT, KeyedList
+
+TOPOLOGY_NAME = 'bench'
+HYPERVISORS = ('hv-1', 'hv-2')
+
+VM_DEVICE_TYPE = 'Bench-VM'
+CONTAINER_DEVICE_TYPE = 'Bench-Container'
+
+SHAPES = ('ring', 'mesh', 'clos')
+MAX_SPINES = 16
+
+
+def _hypervisor(index, name):
+    return {
+        'name': name,
+        'host': f'{name}.example.com',
+        'transport': 'ssh',
+        'username': 'admin',
+        'password': None,
+        'tls': ABSENT,
+        'management-network': {
+            'bridge': 'l3v1',
+            'ip-address-start': '198.18.1.60',
+            'gateway-address': '198.18.1.1',
+            'dns-server-address': '198.18.133.1'},
+        'mac-address-start': '02:c1:5c',
+        'external-bridge': 'l2v1',
+        'udp-tunnel-ip-address': f'192.0.2.{index + 1}',
+        'geneve-tunnel-ip-address': f'192.0.2.{index + 1}',
+        'max-parallel-actions': 4,
+        'ssh-idle-timeout': 600}
+
+def _device_definition(name, device_type):
+    return {
+        'name': name,
+        'device-type': device_type,
+        'template': 'generic',
+        'vcpus': 2,
+        'memory': 4096,
+        'storage-pool': 'default',
+        'ned-id': None}
+
+def _device(device_id, is_container):
+    return {
+        'id': device_id,
+        'prefix': 'c' if is_container else 'r',
+        'device-name': f'{"c" if is_container else "r"}{device_id}',
+        'definition': 'container' if is_container else 'vm',
+        'control-plane-id': None,
+        'hypervisor': HYPERVISORS[device_id % len(HYPERVISORS)],
+        'management-interface': {},
+        'provisioning-status': 'undefined'}
+
+def _link(a_end_device, z_end_device, a_end_iface=None, z_end_iface=None):
+    return {
+        'a-end-device': a_end_device['device-name'],
+        'z-end-device': z_end_device['device-name'],
+        'a-end-interface': {'id': a_end_iface},
+        'z-end-interface': {'id': z_end_iface},
+        'external-connection': {}}
+
+def _network(name, interface_id, devices):
+    return {
+        'name': name,
+        'interface-id': interface_id,
+        'ipv4-subnet-start': '10.11.12',
+        'external-bridge': None,
+        'devices': {'device': KeyedList('name', (
+            {'name': device['device-name'], 'interface': {}}
+            for device in devices))}}
+
+def _ring(devices):
+    """Each device uses interface 0 towards the previous device"""
+    return [_link(device, devices[(idx + 1) % len(devices)], 1, 0)
+            for idx, device in enumerate(devices)], []
+
+def _mesh(devices):
+    """Interface ids default to the id of the device on the other end"""
+    return [_link(device, other_device)
+            for idx, device in enumerate(devices)
+            for other_device in devices[idx + 1:]], []
+
+def _clos(devices):
+    """
+    One spine for every twenty devices (between 2 and 16). Every leaf
+    connects to every spine, and all leaves share a network on the next free
+    interface.
+    """
+    num_spines = max(2, min(MAX_SPINES, len(devices) // 20))
+    spines = devices[:num_spines]
+    leaves = devices[num_spines:]
+    links = [_link(leaf, spine, spine_idx, leaf_idx)
+             for leaf_idx, leaf in enumerate(leaves)
+             for spine_idx, spine in enumerate(spines)]
+    return links, [_network('fabric', num_spines, leaves)]
+
+def generate_config(shape, num_devices, container_ratio=0.25):
+    """Returns the configuration tree for a topology of the given shape"""
+    container_every = round(1 / container_ratio) if container_ratio else 0
+    devices = [_device(device_id, bool(
+                   container_every and device_id % container_every == 0))
+               for device_id in range(1, num_devices + 1)]
+
+    (links, networks) = {'ring': _ring, 'mesh': _mesh, 'clos': _clos}[
+            shape](devices)
+
+    topology = {
+        'name': TOPOLOGY_NAME,
+        'devices': {'device': KeyedList('id', devices)},
+        'links': {'link': KeyedList(('a-end-device', 'z-end-device'), links)},
+        'networks': {'network': KeyedList('name', networks)},
+        'libvirt': {'hypervisor': HYPERVISORS[0]},
+        'provisioning-status': 'undefined'}
+
+    return {
+        'topologies': {
+            'topology': KeyedList('name', [topology]),
+            'libvirt': {
+                'hypervisor': KeyedList('name', (
+                    _hypervisor(idx, name)
+                    for idx, name in enumerate(HYPERVISORS))),
+                'device-definition': KeyedList('name', (
+                    _device_definition('vm', VM_DEVICE_TYPE),
+                    _device_definition('container', CONTAINER_DEVICE_TYPE)))}},
+        'devices': {'authgroups': {'group': KeyedList('name', ())}}}
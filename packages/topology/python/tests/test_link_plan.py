@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+"""
+Applying link plans against a stub SSH executor, checking the host network
+state is patched with the changes each plan made.
+
+Run from packages/topology/python with: python3 -m unittest discover tests
+"""
+import logging
+import unittest
+
+from virt.connection import InterfaceEndpoint
+from virt.host_network import CONTAINER_MARKER, HostNetworkState
+from virt.link_plan import LinkPlan
+from virt.ssh import CommandExecutionError
+
+
+class StubExecutor():
+    """Answers the host network state collection, and records batches"""
+
+    def __init__(self, host_ifaces, containers, fail_batches=False):
+        self.host_ifaces = host_ifaces
+        self.containers = containers  # {container_name: (pid, [iface])}
+        self.fail_batches = fail_batches
+        self.batches = []
+
+    def _ip_link_output(self, ifaces):
+        return '\n'.join(f'{index}: {iface}: <UP> mtu 1500'
+                         for (index, iface) in enumerate(ifaces, 1))
+
+    def _result(self, command):
+        if command == 'ip -o link show':
+            return self._ip_link_output(self.host_ifaces)
+        return '\n'.join(f'{CONTAINER_MARKER} {name} {pid}\n' +
+                         self._ip_link_output(ifaces)
+                         for (name, (pid, ifaces)) in self.containers.items()
+                         if name in command or 'docker ps' in command)
+
+    def execute(self, commands, description=None):
+        if any('-batch' in command for command in commands):
+            self.batches.append(commands)
+            if self.fail_batches:
+                raise CommandExecutionError('batch failed')
+            return [{'stdout': '', 'stderr': '', 'exit_code': 0}
+                    for _ in commands]
+        return [{'stdout': self._result(command), 'stderr': '',
+                 'exit_code': 0} for command in commands]
+
+
+class TestLinkPlanApply(unittest.TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('test_link_plan')
+        self.executor = StubExecutor(
+                ['lo', 'br0', 'vtap-2-0'],
+                {'c1': ('101', ['lo']), 'c2': ('102', ['lo'])})
+        self.state = HostNetworkState('hv1', self.executor, self.log)
+        self.plan = LinkPlan('hv1', self.state)
+
+    def _endpoint(self, device_name, interface_name, is_container=True):
+        return InterfaceEndpoint(device_name, interface_name, is_container)
+
+    def test_apply_patches_state(self):
+        self.plan.add_bridge_interface(self._endpoint('c1', 'eth1'), 'br0')
+        self.plan.add_container_to_container_link(
+                self._endpoint('c1', 'eth2'), self._endpoint('c2', 'eth1'))
+        self.plan.add_tap_to_container_link(
+                self._endpoint('c2', 'eth2'),
+                self._endpoint('vm', 'vtap-2-0', False))
+        self.plan.apply(self.executor)
+
+        self.assertEqual(len(self.executor.batches), 1)
+        self.assertTrue(self.state.container_iface_exists('c1', 'eth1'))
+        self.assertTrue(self.state.container_iface_exists('c1', 'eth2'))
+        self.assertTrue(self.state.container_iface_exists('c2', 'eth1'))
+        self.assertTrue(self.state.container_iface_exists('c2', 'eth2'))
+        self.assertTrue(self.state.host_iface_exists('eth1-host'))
+        self.assertFalse(self.state.host_iface_exists('eth1'))
+        self.assertFalse(self.state.host_iface_exists('vtap-2-0'))
+
+        # Planning again finds nothing left to do
+        plan = LinkPlan('hv1', self.state)
+        plan.add_bridge_interface(self._endpoint('c1', 'eth1'), 'br0')
+        self.assertEqual(plan.num_operations(), 0)
+
+    def test_failed_apply_marks_state_stale(self):
+        self.executor.fail_batches = True
+        self.plan.add_bridge_interface(self._endpoint('c1', 'eth1'), 'br0')
+        with self.assertRaises(CommandExecutionError):
+            self.plan.apply(self.executor)
+
+        # The batch was applied on the host before failing
+        self.executor.containers['c1'] = ('101', ['lo', 'eth1'])
+        self.executor.host_ifaces.append('eth1-host')
+        self.assertTrue(self.state.container_iface_exists('c1', 'eth1'))
+        self.assertTrue(self.state.host_iface_exists('eth1-host'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,7 +7,8 @@ from ncs.application import Application
 from ncs.dp import Action
 from _ncs import maapi
 from virt.libvirt_get_objects import LibvirtGetObjects
-from virt.virt_topology import LibvirtAction, LibvirtNetworkAction
+from virt.virt_topology import LibvirtAction, LibvirtNetworkAction, \
+        LibvirtPlumbLinksAction
 from virt.topology_status import CheckTopologyStatus
 from monitor.operational_status import OperationalStateMonitor
 from monitor.console_activity import ConsoleActivityMonitor
@@ -81,6 +82,7 @@ class Main(Application):
         self.register_action('libvirt-get-objects', LibvirtGetObjects)
         self.register_action('libvirt-action', LibvirtAction)
         self.register_action('libvirt-network-action', LibvirtNetworkAction)
+        self.register_action('libvirt-plumb-links', LibvirtPlumbLinksAction)
         self.register_action('check-topology-status', CheckTopologyStatus)
         self.register_action('operational-state-monitor', OperationalStateMonitor)
         self.register_action('console-activity-monitor', ConsoleActivityMonitor)
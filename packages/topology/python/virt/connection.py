@@ -1,13 +1,17 @@
 #!/usr/bin/python3
+import threading
 from dataclasses import dataclass
 from ipaddress import IPv4Address
 from ncs import maagic, maapi, OPERATIONAL
 
 from virt.topology_status import write_node_data
+from virt.status_writer import status_writer
 from virt.virt_base import VirtBase
 
 _ncs = __import__('_ncs')
 
+IFACE_STATE_LEAVES = ('host-interface', 'mac-address', 'ip-address')
+
 
 @dataclass
 class InterfaceEndpoint:
@@ -57,10 +61,20 @@ def generate_ip_address(ip_address_start, device_id):
     return str(IPv4Address(ip_address_start) + int(device_id)) if (
         ip_address_start is not None) else None
 
-def get_host_iface_name(path):
+def load_iface_state(paths):
+    """
+    Read the status leaves of every interface path in a single transaction.
+    Returns a dict of {path: {leaf_name: value}}.
+    """
+    status_writer.flush()
     with maapi.single_read_trans('admin', 'python', db=OPERATIONAL) as trans:
-        interface = maagic.get_node(trans, path)
-        return interface.host_interface
+        iface_state = {}
+        for path in paths:
+            interface = maagic.get_node(trans, path)
+            iface_state[path] = {
+                    leaf: getattr(interface, leaf.replace('-', '_'))
+                    for leaf in IFACE_STATE_LEAVES}
+        return iface_state
 
 
 class ConnectionManager():
@@ -116,7 +130,7 @@ class ConnectionManager():
             - Track nothing
     """
 
-    def __init__(self, topology, hypervisor_mgr, domain_mgr, resource_mgr):
+    def __init__(self, snapshot, hypervisor_mgr, domain_mgr, resource_mgr):
         def _add_interface(key, path, network, bridge,
                            dest=None, udp=False, geneve=False):
             if key in self._connected_ifaces:
@@ -147,15 +161,20 @@ class ConnectionManager():
             self._connected_ifaces[key] = path
 
         self._network_index = {network.name:idx
-                for idx, network in enumerate(topology.networks.network)}
+                for idx, network in enumerate(snapshot.networks)}
 
         self._networks = {network.external_bridge or network.name:
-                f'{force_maagic_leaf_val2str(network, "ipv4-subnet-start")}.0'
-                for network in topology.networks.network}
+                f'{network.ipv4_subnet_start}.0'
+                for network in snapshot.networks}
 
         self._resource_mgr = resource_mgr
         self._domain_mgr = domain_mgr
 
+        # Interface status leaves, loaded on first use and kept up to date by
+        # write_iface_data for the rest of the action
+        self._iface_state = None
+        self._iface_state_lock = threading.Lock()
+
         self._network_ifaces = {}
         self._bridge_ifaces = {}
         self._link_ifaces = {}
@@ -163,16 +182,16 @@ class ConnectionManager():
         self._geneve_ifaces = {}
         self._connected_ifaces = {}
 
-        for link in topology.links.link:
+        for link in snapshot.links:
             device_ids = (self._domain_mgr.get_device_id(link.a_end_device),
                           self._domain_mgr.get_device_id(link.z_end_device))
             hypervisors = (hypervisor_mgr.get_device_hypervisor(device_ids[0]),
                            hypervisor_mgr.get_device_hypervisor(device_ids[1]))
-            iface_ids = (link.a_end_interface.id
-                            if link.a_end_interface.id is not None
+            iface_ids = (link.a_end_interface_id
+                            if link.a_end_interface_id is not None
                             else device_ids[1],
-                         link.z_end_interface.id
-                            if link.z_end_interface.id is not None
+                         link.z_end_interface_id
+                            if link.z_end_interface_id is not None
                             else device_ids[0])
 
             bridges = (None, None)
@@ -183,11 +202,11 @@ class ConnectionManager():
             # bridges if no link-specific bridges are given at all (in this
             # case UDP or GENEVE will be used)
             if (cross_host and
-                    (link.external_connection.a_end_bridge is not None or
-                     link.external_connection.z_end_bridge is not None)):
-                bridges = (link.external_connection.a_end_bridge or
+                    (link.a_end_bridge is not None or
+                     link.z_end_bridge is not None)):
+                bridges = (link.a_end_bridge or
                            hypervisor_mgr.get_external_bridge(hypervisors[0]),
-                           link.external_connection.z_end_bridge or
+                           link.z_end_bridge or
                            hypervisor_mgr.get_external_bridge(hypervisors[1]))
 
             # Next check if the domain specifically requires bridges networking.
@@ -211,22 +230,32 @@ class ConnectionManager():
                 cross_host and not all(bridges))
 
             _add_interface((device_ids[0], iface_ids[0]),
-                    f'{link._path}/a-end-interface', network_id, bridges[0],
+                    f'{link.path}/a-end-interface', network_id, bridges[0],
                     (device_ids[1], iface_ids[1]), use_udp, use_geneve)
             _add_interface((device_ids[1], iface_ids[1]),
-                    f'{link._path}/z-end-interface', network_id, bridges[1],
+                    f'{link.path}/z-end-interface', network_id, bridges[1],
                     (device_ids[0], iface_ids[0]), use_udp, use_geneve)
 
-        for network in topology.networks.network:
-            for device in network.devices.device:
+        for network in snapshot.networks:
+            for device in network.devices:
                 key = (self._domain_mgr.get_device_id(device.name),
-                        device.interface.id or network.interface_id)
-                _add_interface(key, f'{device._path}/interface',
+                        device.interface_id or network.interface_id)
+                _add_interface(key, f'{device.path}/interface',
                         network.name, network.external_bridge)
 
         self._max_iface_id = max(0, *(iface_id for (_, iface_id) in
             self._connected_ifaces))
 
+        # Reverse indexes, so per-device and per-network lookups don't need
+        # to scan every connected interface in the topology
+        self._device_ifaces = {}
+        for (device_id, iface_id) in sorted(self._connected_ifaces):
+            self._device_ifaces.setdefault(device_id, []).append(iface_id)
+
+        self._network_members = {}
+        for (device_id, _), network_id in self._network_ifaces.items():
+            self._network_members.setdefault(network_id, set()).add(device_id)
+
     def get_network(self, network_id):
         return self._networks[network_id]
 
@@ -257,6 +286,23 @@ class ConnectionManager():
         path = self.get_iface_path(device_id, iface_id)
         if path:
             write_node_data(path, data)
+            with self._iface_state_lock:
+                if self._iface_state is not None:
+                    iface_state = self._iface_state.setdefault(path, {})
+                    for leaf, value in data:
+                        if leaf in IFACE_STATE_LEAVES:
+                            iface_state[leaf] = (
+                                    str(value) if value is not None else None)
+
+    def get_iface_state(self, device_id, iface_id, leaf):
+        path = self.get_iface_path(device_id, iface_id)
+        if not path:
+            return None
+        with self._iface_state_lock:
+            if self._iface_state is None:
+                self._iface_state = load_iface_state(
+                        self._connected_ifaces.values())
+            return self._iface_state.get(path, {}).get(leaf)
 
     def get_network_udp_ports(self, device_id, iface_id):
         device_id = self._domain_mgr.resolve_control_plane_id(device_id)
@@ -265,6 +311,37 @@ class ConnectionManager():
     def get_num_device_ifaces(self):
         return self._max_iface_id + 1
 
+    def get_device_iface_ids(self, device_id, first_iface=0):
+        """
+        Returns the sorted ids of the interfaces of a device which are used
+        in a link or network, starting from first_iface
+        """
+        device_id = self._domain_mgr.resolve_control_plane_id(device_id)
+        return [iface_id
+                for iface_id in self._device_ifaces.get(int(device_id), ())
+                if iface_id >= first_iface]
+
+    def get_managed_network_members(self):
+        """
+        Returns a dict of {network_id: set(device_ids)} for every libvirt
+        managed network (link and topology networks)
+        """
+        return {network_id: set(device_ids)
+                for network_id, device_ids in self._network_members.items()}
+
+    def get_direct_link_peers(self):
+        """
+        Returns a set of (device_id, other_device_id) tuples for every direct
+        link (not using a libvirt network, unmanaged bridge or overlay).
+        Each link is returned in both directions.
+        """
+        return {(device_id, other_device_id)
+                for (device_id, iface_id), (other_device_id, _)
+                in self._link_ifaces.items()
+                if (device_id, iface_id) not in self._network_ifaces and
+                   (device_id, iface_id) not in self._bridge_ifaces and
+                   (device_id, iface_id) not in self._geneve_ifaces}
+
     def get_interface_geneve_info(self, device_id, iface_id):
         """
         If this interface uses a GENEVE overlay link, return a GeneveInfo.
@@ -292,7 +369,8 @@ class ConnectionManager():
             return None
         return InterfaceEndpoint(
                 device_name=self._domain_mgr.get_device_name(device_id),
-                interface_name=get_host_iface_name(path),
+                interface_name=self.get_iface_state(
+                    device_id, iface_id, 'host-interface'),
                 is_container=self._domain_mgr.is_container(device_id),
             )
 
@@ -313,8 +391,8 @@ class ConnectionManager():
 
         key_dev = self._domain_mgr.resolve_control_plane_id(device_id)
         devices = [device
-                for (device, _), network in self._network_ifaces.items()
-                if network == network_id and device != key_dev]
+                for device in sorted(self._network_members[network_id])
+                if device != key_dev]
 
         return (network_id, devices)
 
@@ -1,6 +1,5 @@
 from virt.ssh import CommandExecutionError
 from virt.connection import Connection
-from virt.topology_status import get_device_status
 
 
 class ConnectionDocker(Connection):
@@ -27,7 +26,9 @@ class ConnectionDocker(Connection):
             self._plumbers[hypervisor_name] = InterfacePlumber(
                 hypervisor_name,
                 self._hypervisor_mgr.get_docker(
-                    hypervisor_name).get_ssh_executor(), self._log
+                    hypervisor_name).get_ssh_executor(),
+                self._hypervisor_mgr.get_host_network_state(hypervisor_name),
+                self._log
             )
 
         return self._plumbers[hypervisor_name]
@@ -181,8 +182,7 @@ class ConnectionDocker(Connection):
         (check_device_id, check_device_name) = (
                 device_id, this_end.device_name) if is_link_dest else (
                         other_device_id, other_end.device_name)
-        if get_device_status(
-                self._domain_mgr.get_device_path(check_device_id)) not in (
+        if self._domain_mgr.get_device_status(check_device_id) not in (
                 'started', 'ready', 'unmanaged'):
             plumber.log_info(
                 f'Waiting for other device to be active: {check_device_name}')
@@ -302,12 +302,15 @@ class InterfacePlumber:
     Handles low-level network interface plumbing operations for containers.
 
     Generates shell commands (ip link, ip netns, etc.) and executes them
-    via SshExecutor using persistent SSH connections.
+    via SshExecutor using persistent SSH connections. Existence checks and
+    container PIDs are answered from the HostNetworkState of the hypervisor,
+    which is patched after each change made here.
     """
 
-    def __init__(self, hypervisor_name, executor, log):
+    def __init__(self, hypervisor_name, executor, host_network_state, log):
         self._hypervisor_name = hypervisor_name
         self._executor = executor
+        self._state = host_network_state
         self._log = log
 
     def log_info(self, message):
@@ -320,48 +323,32 @@ class InterfacePlumber:
         return self._executor.execute(commands, description)
 
     def _interface_exists_in_container(self, container_name, interface_name):
-        result = self.execute(
-            f'docker exec {container_name} ip link show {interface_name}')
-        return result['exit_code'] == 0
+        return self._state.container_iface_exists(
+                container_name, interface_name)
 
     def _interface_exists_on_host(self, interface_name):
-        result = self.execute(f'ip link show {interface_name}')
-        return result['exit_code'] == 0
+        return self._state.host_iface_exists(interface_name)
 
     def _get_container_pid(self, container_name):
-        result = self.execute(
-            f"docker inspect -f '{{{{.State.Pid}}}}' {container_name}"
-        )
-
-        pid = result['stdout'].strip()
         # Let caller decide how to handle missing PID
-        return pid if pid and pid != '0' else None
+        return self._state.get_container_pid(container_name)
 
     def _get_container_pid_must_exist(self, container_name):
-        # Get container PID and raise CommandExecutionError if not found
-        # preserving the command execution error for better debugging
-        result = self.execute(
-            f"docker inspect -f '{{{{.State.Pid}}}}' {container_name}"
-        )
-        if result['exit_code'] != 0:
-            raise CommandExecutionError(
-                f'Failed to get PID for container {container_name}\n'
-                f'stderr: {result["stderr"]}'
-            )
-
-        pid = result['stdout'].strip()
-        if pid == '0':
+        pid = self._state.get_container_pid(container_name)
+        if pid is None:
             raise CommandExecutionError(
                 f'Failed to get PID for container {container_name}\n'
-                f'PID = 0, is container stopped?'
+                f'Container is not running, is container stopped?'
             )
 
         return pid
 
-    def _ensure_netns_link(self, pid):
-        self.execute([
+    def _netns_link_commands(self, pid):
+        # Prefixed to the plumbing commands, so that each plumbing operation
+        # is sent to the host as a single batch
+        return [
                 'mkdir -p /var/run/netns',
-                f'ln -sf /proc/{pid}/ns/net /var/run/netns/{pid}' ])
+                f'ln -sf /proc/{pid}/ns/net /var/run/netns/{pid}' ]
 
     def create_container_to_container_link(self,
             device_name, iface_name, other_iface_name):
@@ -380,22 +367,22 @@ class InterfacePlumber:
 
         pid = self._get_container_pid_must_exist(device_name)
 
-        self._ensure_netns_link(pid)
+        commands = self._netns_link_commands(pid)
 
         # Check if veth pair already exists on host
         # Only one end creates the pair, so check if it's already been created
         # by the other end of the link.
-        if not self._interface_exists_on_host(iface_name):
-            #Command must success so use command list version
-            commands = [f'ip link add {iface_name} type veth '
-                        f'peer name {other_iface_name}' ]
-            self.execute(commands,
+        create_veth_pair = not self._interface_exists_on_host(iface_name)
+        if create_veth_pair:
+            self.log_info(
                 f'--> Creating veth pair: {iface_name} <--> {other_iface_name}')
+            commands.append(f'ip link add {iface_name} type veth '
+                            f'peer name {other_iface_name}')
 
         # Move interface into container namespace and bring up
         # If the veth pair was just created, the over end will get moved
         # when the other end is processed (next call to this function)
-        commands = [
+        commands += [
             f'ip link set {iface_name} netns {pid}',
             f'ip netns exec {pid} ip link set {iface_name} up' ]
 
@@ -403,6 +390,11 @@ class InterfacePlumber:
             f'--> Moving interface {iface_name} into container '
             f'{device_name} [namespace: {pid}]')
 
+        self._state.remove_host_iface(iface_name)
+        if create_veth_pair:
+            self._state.add_host_iface(other_iface_name)
+        self._state.add_container_iface(device_name, iface_name)
+
         return True
 
     def create_cross_host_container_link(
@@ -426,9 +418,8 @@ class InterfacePlumber:
         self.create_geneve_on_host(geneve_iface_name, vni, remote_ip_address)
 
         pid = self._get_container_pid_must_exist(device_name)
-        self._ensure_netns_link(pid)
 
-        commands = [
+        commands = self._netns_link_commands(pid) + [
             f'ip link add link {geneve_iface_name} '
                         f'name {container_iface_name} type macvtap mode bridge',
             f'ip link set {container_iface_name} netns {pid}',
@@ -438,6 +429,8 @@ class InterfacePlumber:
                 f'--> Connecting container {device_name}:{container_iface_name} '
                 f'to tunnel {geneve_iface_name} via macvtap')
 
+        self._state.add_container_iface(device_name, container_iface_name)
+
         return True
 
     def create_geneve_on_host(self, iface_name, vni, remote_ip_address):
@@ -456,6 +449,8 @@ class InterfacePlumber:
         self.execute(commands,
                 f'--> Creating geneve interface {iface_name} [vni:{vni}] on host')
 
+        self._state.add_host_iface(iface_name)
+
     def destroy_geneve_on_host(self, iface_name):
         self.log_info(f'Checking geneve interface {iface_name}')
 
@@ -466,6 +461,8 @@ class InterfacePlumber:
                 [f'ip link delete {iface_name}'],
                 f'--> Deleting geneve interface {iface_name}')
 
+        self._state.remove_host_iface(iface_name)
+
     def set_allmulticast_on_iface(self, iface_name):
         if not self._interface_exists_on_host(iface_name):
             self.log_warning(f'Error setting allmulticast on {iface_name}. '
@@ -496,10 +493,9 @@ class InterfacePlumber:
             return False
 
         pid = self._get_container_pid_must_exist(device_name)
-        self._ensure_netns_link(pid)
         host_iface = f'{iface_name}-host'
 
-        commands = [
+        commands = self._netns_link_commands(pid) + [
             f'ip link add {iface_name} type veth peer name {host_iface}',
             f'ip link set {iface_name} netns {pid}',
             f'ip link set {host_iface} master {bridge_name}',
@@ -510,6 +506,9 @@ class InterfacePlumber:
                 f'--> Creating veth pair: {device_name}:{iface_name} '
                 f'[namespace: {pid}] <--> {bridge_name}:{host_iface}')
 
+        self._state.add_host_iface(host_iface)
+        self._state.add_container_iface(device_name, iface_name)
+
         return True
 
     def create_tap_to_container_link(
@@ -532,9 +531,8 @@ class InterfacePlumber:
             return False
 
         pid = self._get_container_pid_must_exist(device_name)
-        self._ensure_netns_link(pid)
 
-        commands = [
+        commands = self._netns_link_commands(pid) + [
             f'ip link set {tap_iface} down',
             f'ip link set {tap_iface} netns {pid}',
             f'ip netns exec {pid} ip link set {tap_iface} name {container_iface}',
@@ -544,6 +542,9 @@ class InterfacePlumber:
             f'--> Moving tap {tap_iface} in to container '
             f'{device_name}:{container_iface} [namespace: {pid}]')
 
+        self._state.remove_host_iface(tap_iface)
+        self._state.add_container_iface(device_name, container_iface)
+
         return True
 
     def destroy_tap_to_container_link(
@@ -586,6 +587,9 @@ class InterfacePlumber:
             f'--> Moving TAP {tap_iface} back to host from '
             f'{device_name}:{container_iface} [namespace: {pid}]')
 
+        self._state.remove_container_iface(device_name, container_iface)
+        self._state.add_host_iface(tap_iface)
+
         return True
 
     def destroy_container_to_container_link(self,
@@ -619,6 +623,9 @@ class InterfacePlumber:
                     f'--> Moving veth end: {device_name}:{iface_name} '
                     f'out of container [namespace: {pid}]')
 
+            self._state.remove_container_iface(device_name, iface_name)
+            self._state.add_host_iface(iface_name)
+
             processed = True
 
         #Checked is other end has also been moved out of it's container
@@ -630,6 +637,9 @@ class InterfacePlumber:
                 f'--> Deleting veth pair: '
                 f'{iface_name} <--> {other_iface_name}')
 
+            self._state.remove_host_iface(other_iface_name)
+            self._state.remove_host_iface(iface_name)
+
             processed = True
 
         return processed
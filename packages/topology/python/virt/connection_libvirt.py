@@ -6,8 +6,7 @@ from libvirt import (VIR_NETWORK_UPDATE_COMMAND_MODIFY,
 from virt.connection import Connection, \
         generate_network_id, generate_network_name, generate_bridge_name
 from virt.connection_docker import InterfacePlumber
-from virt.topology_status import \
-        get_device_status, write_node_data, get_hypervisor_output_node
+from virt.topology_status import write_node_data, add_hypervisor_output
 from virt.virt_base import VirtBase
 from virt.template import xml_to_string
 
@@ -27,7 +26,10 @@ class ConnectionLibvirt(Connection):
             self._plumbers[hypervisor_name] = InterfacePlumber(
                     hypervisor_name,
                     self._hypervisor_mgr.get_libvirt(
-                        hypervisor_name).get_ssh_executor(), self._log
+                        hypervisor_name).get_ssh_executor(),
+                    self._hypervisor_mgr.get_host_network_state(
+                        hypervisor_name),
+                    self._log
             )
 
         return self._plumbers[hypervisor_name]
@@ -47,8 +49,7 @@ class ConnectionLibvirt(Connection):
                 }
 
         if action in allow_states:
-            if any(get_device_status(
-                   self._domain_mgr.get_device_path(device_id))
+            if any(self._domain_mgr.get_device_status(device_id)
                    not in allow_states[action]
                    for device_id in device_ids):
                 return False
@@ -159,15 +160,18 @@ class LibvirtNetwork(VirtBase): #pylint: disable=too-few-public-methods
                        f'efining network {network_name}')
         self._log.debug(network_xml_str)
         libvirt.conn.networkDefineXML(network_xml_str)
-        get_hypervisor_output_node(self._output,
-                hypervisor_name).networks.create(network_name)
+        add_hypervisor_output(
+                self._output, hypervisor_name, 'networks', network_name)
         if path:
             write_node_data(path, [
                 ('host-bridge', bridge_name),
                 ('mac-address', mac_address)])
 
         if network_name not in libvirt.networks:
-            libvirt.networks[network_name] = { 'bridge-name': bridge_name }
+            libvirt.networks[network_name] = {
+                    'bridge-name': bridge_name,
+                    'active': False,
+                    'interfaces': []}
 
     def _update_network(self, hypervisor_name, network_id):
         libvirt = self._hypervisor_mgr.get_libvirt(hypervisor_name)
@@ -194,22 +198,26 @@ class LibvirtNetwork(VirtBase): #pylint: disable=too-few-public-methods
             libvirt = self._hypervisor_mgr.get_libvirt(hypervisor_name)
             is_active = None
             if libvirt and network_name in libvirt.networks:
-                network = libvirt.conn.networkLookupByName(network_name)
-                is_active = network.isActive()
+                is_active = libvirt.networks[network_name]['active']
                 if self._action_allowed(is_active, action):
                     self._log.info(
                             f'[{hypervisor_name}] '
                             f'Running {action} on network {network_name}')
+                    network = libvirt.conn.networkLookupByName(network_name)
                     network_action_method = getattr(network, action)
                     network_action_method()
-                    get_hypervisor_output_node(self._output,
-                            hypervisor_name).networks.create(network_name)
+                    add_hypervisor_output(
+                            self._output, hypervisor_name, 'networks',
+                            network_name)
                     if action == 'undefine':
                         if path:
                             write_node_data(path, [
                                 ('host-bridge', None),
                                 ('mac-address', None)])
-                        del libvirt.networks[network_name]
+                        libvirt.networks.pop(network_name, None)
+                    else:
+                        libvirt.networks[network_name]['active'] = (
+                                action == 'create')
                     return
 
             if libvirt:
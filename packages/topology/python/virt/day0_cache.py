@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Content-addressed cache of day0 images.
+
+A day0 image is a function of the volume builder, its templates and the
+template variables, so images are cached by a hash of these. Password hashes
+are salted, so they are memoized per authgroup mapping to keep the variables
+(and so the hash) of an unchanged device the same between actions.
+Redefining an unchanged topology then reuses the images already built.
+
+Before a topology is defined, the images of all of its devices are built in
+parallel (see build_day0_images), so the define of each device only uploads
+its image.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from passlib.hash import md5_crypt, sha512_crypt
+
+_ncs = __import__('_ncs')
+
+DAY0_CACHE_SIZE = 128
+DAY0_BUILD_WORKERS = 8
+
+_password_hashes = {}
+_password_hashes_lock = threading.Lock()
+
+
+def get_password_hashes(authgroup_name, mapping):
+    """
+    Return the password hashes used by the day0 templates for an authgroup
+    mapping, hashing the password only the first time it is seen.
+    """
+    key = (authgroup_name, mapping.remote_name, mapping.remote_password)
+    with _password_hashes_lock:
+        hashes = _password_hashes.get(key, None)
+    if hashes is None:
+        password = _ncs.decrypt(mapping.remote_password)
+        hashes = {
+            'password': sha512_crypt.using(rounds=5000).hash(password),
+            'password-md5': md5_crypt.using(salt_size=4).hash(password)}
+        with _password_hashes_lock:
+            hashes = _password_hashes.setdefault(key, hashes)
+    return hashes
+
+
+def get_day0_image_key(builder_name, templates, variables):
+    """A hash of everything a day0 image is built from"""
+    return hashlib.sha256(json.dumps(
+            [builder_name, templates, variables], sort_keys=True).encode()
+        ).hexdigest()
+
+
+class Day0ImageCache():
+    """
+    The most recently used day0 images, by key. An image is only built once:
+    a request for an image which is still being built waits for it.
+    """
+
+    def __init__(self, size=DAY0_CACHE_SIZE):
+        self._size = size
+        self._images = OrderedDict()  # {key: Future}
+        self._lock = threading.Lock()
+
+    def get_image(self, key, create):
+        with self._lock:
+            future = self._images.get(key, None)
+            if future is not None:
+                self._images.move_to_end(key)
+                create = None
+            else:
+                future = self._images[key] = Future()
+                while len(self._images) > self._size:
+                    self._images.popitem(last=False)
+
+        if create is not None:
+            try:
+                future.set_result(create())
+            except Exception as exc:
+                with self._lock:
+                    if self._images.get(key, None) is future:
+                        del self._images[key]
+                future.set_exception(exc)
+        return future.result()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+
+
+day0_image_cache = Day0ImageCache()
+
+
+def build_day0_images(builds, log):
+    """
+    Run each day0 image build (a callable, returning the image) in parallel.
+    A failed build is logged and left to fail again when its device is
+    defined, so it is reported against that device.
+    """
+    if not builds:
+        return
+    log.info(f'Building {len(builds)} day0 images')
+    with ThreadPoolExecutor(max_workers=min(
+            DAY0_BUILD_WORKERS, len(builds))) as executor:
+        futures = [executor.submit(build) for build in builds]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as exc: #pylint: disable=broad-except
+                log.warning(f'Failed to build day0 image: {exc}')
@@ -1,12 +1,17 @@
 #!/usr/bin/python3
+import threading
 from abc import abstractmethod
 import ncs
 from ncs import maapi, maagic
 from virt.virt_base import VirtBase
-from virt.topology_status import write_node_data, get_hypervisor_output_node
+from virt.topology_status import \
+        write_node_data, add_hypervisor_output, get_devices_status
+from virt.status_writer import status_writer
 
 
 def nso_device_onboard(path):
+    # The device template reads the management interface leaves
+    status_writer.flush()
     with maapi.single_write_trans('admin', 'python') as trans:
         template = ncs.template.Template(trans, path)
         template.apply('nso-device-template', None)
@@ -18,9 +23,7 @@ def nso_device_delete(device_name):
         trans.apply()
 
 class DomainManager():
-    def __init__(self, topology, domain_registry):
-        dev_defs = maagic.cd(topology, '../libvirt/device-definition')
-
+    def __init__(self, snapshot, domain_registry):
         self._device_ids_by_name = {}
         self._device_names = {}
         self._device_paths = {}
@@ -29,14 +32,19 @@ class DomainManager():
         self._domain_is_container = {}
         self._domain_needs_bridge_networking = {}
 
-        for device in topology.devices.device:
-            device_id = int(device.id)
-            self._device_ids_by_name[device.device_name] = device_id
-            self._device_names[device_id] = device.device_name
-            self._device_paths[device_id] = device._path
+        # Provisioning status of every device, loaded on first use and
+        # updated by set_device_status as the action progresses
+        self._device_status = None
+        self._device_status_lock = threading.Lock()
+
+        for device in snapshot.devices:
+            device_id = device.id
+            self._device_ids_by_name[device.name] = device_id
+            self._device_names[device_id] = device.name
+            self._device_paths[device_id] = device.path
             self._device_control_plane_ids[device_id] = device.control_plane_id
 
-            device_type = str(dev_defs[device.definition].device_type)
+            device_type = device.device_type
             domain_class = domain_registry.get(device_type)
 
             self._device_types[device_id] = device_type
@@ -57,6 +65,21 @@ class DomainManager():
     def get_control_plane_id(self, device_id):
         return self._device_control_plane_ids.get(device_id, None)
 
+    def get_device_status(self, device_id):
+        with self._device_status_lock:
+            if self._device_status is None:
+                device_status = get_devices_status(self._device_paths.values())
+                self._device_status = {
+                        device_id: device_status[device_path]
+                        for device_id, device_path
+                        in self._device_paths.items()}
+            return self._device_status.get(int(device_id), None)
+
+    def set_device_status(self, device_id, status):
+        with self._device_status_lock:
+            if self._device_status is not None:
+                self._device_status[int(device_id)] = status
+
     def resolve_control_plane_id(self, device_id):
         return self.get_control_plane_id(device_id) or device_id
 
@@ -81,8 +104,8 @@ class Domain(VirtBase):
 
         self._define(device)
 
-        get_hypervisor_output_node(
-                self._output, hypervisor).domains.create(device.device_name)
+        add_hypervisor_output(
+                self._output, hypervisor, 'domains', device.device_name)
 
         if dev_def.ned_id is not None:
             self._log.info(f'Creating device {device.device_name} in NSO')
@@ -98,7 +121,8 @@ class Domain(VirtBase):
                     ('mac-address', None),
                     ('host-interface', None)])
 
-            for iface_id in range(self._connection_mgr.get_num_device_ifaces()):
+            for iface_id in self._connection_mgr.get_device_iface_ids(
+                    device.id):
                 self._connection_mgr.write_iface_data(
                     device.id, iface_id, [
 #                           ('id', None),
@@ -140,5 +164,8 @@ class Domain(VirtBase):
     def shutdown_supported(self):
         pass
 
+    def watch_shutdown(self, device, waiter):
+        pass
+
     def _has_data_plane(self, device):
         return True
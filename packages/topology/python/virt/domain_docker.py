@@ -2,7 +2,7 @@ from abc import abstractmethod
 
 from virt.domain import Domain
 from virt.connection import generate_iface_dev_name
-from virt.topology_status import write_node_data, get_hypervisor_output_node
+from virt.topology_status import write_node_data, add_hypervisor_output
 
 
 class DomainDocker(Domain):
@@ -30,15 +30,7 @@ class DomainDocker(Domain):
 
     def get_docker_ifaces(self, device, first_iface = 0, device_id = None):
         device_id = int(device.id)
-        docker_ifaces = []
-        for iface_id in range(first_iface,
-                self._connection_mgr.get_num_device_ifaces()):
-            path = self._connection_mgr.get_iface_path(device_id, iface_id)
-
-            if path:
-                docker_ifaces.append(iface_id)
-
-        return docker_ifaces
+        return self._connection_mgr.get_device_iface_ids(device_id, first_iface)
 
     def _define(self, device):
         device_name = device.device_name
@@ -106,6 +98,12 @@ class DomainDocker(Domain):
         docker = self._hypervisor_mgr.get_device_docker(device.id)
         return docker and docker.is_active(device.device_name)
 
+    def watch_shutdown(self, device, waiter):
+        docker = self._hypervisor_mgr.get_device_docker(device.id)
+        if docker and device.device_name in docker.containers:
+            waiter.watch_docker(device.device_name, docker, self._dev_defs[
+                    device.definition].shutdown_timeout)
+
     def shutdown_supported(self):
         return self.SHUTDOWN_SUPPORTED
 
@@ -122,9 +120,12 @@ class DomainDocker(Domain):
                             f'Running {action} on container {container_name} ')
                     action_method = getattr(self, action_name)
                     action_method(docker, *args)
+                    self._hypervisor_mgr.invalidate_host_network_state(
+                            docker.name, '', (container_name, ))
 
-                    get_hypervisor_output_node(
-                            self._output, docker.name).domains.create(container_name)
+                    add_hypervisor_output(
+                            self._output, docker.name, 'domains',
+                            container_name)
                     return True
         if docker:
             self._log.info(f'[{docker.name}] '
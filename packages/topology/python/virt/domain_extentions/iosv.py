@@ -1,10 +1,8 @@
 #!/usr/bin/python3
 
-import os
-import fs
-
 from virt.virt_factory import VirtFactory
-from virt.volume import Volume, generate_day0_volume_name
+from virt.fat_image import create_fat12_disk_image
+from virt.volume import Volume
 from virt.domain_libvirt import DomainLibvirt
 
 _ncs = __import__('_ncs')
@@ -31,21 +29,7 @@ class IOSvVolume(Volume):
 
     def _create_day0_image(self, file_name, variables, _):
         day0_str = self._templates.apply_template(file_name, variables)
-        tmp_disk_file = \
-                f'tmp-{generate_day0_volume_name(variables["device-name"])}'
-
-        offset = self._create_raw_disk_image(tmp_disk_file)
 
-        self._log.info('Writing day0 file to partition')
+        self._log.info('Writing day0 file to disk image')
         self._log.debug(f'ios_config.txt:\n{day0_str}')
-        with fs.open_fs(f'fat://{tmp_disk_file}?'
-                        f'offset={offset}') as flash_drive:
-            flash_drive.writetext('/ios_config.txt', day0_str)
-
-        with open(tmp_disk_file, 'rb') as binary_file:
-            disk_byte_str = binary_file.read()
-
-        self._log.info(f'Deleting temporary disk file {tmp_disk_file}')
-        os.remove(tmp_disk_file)
-
-        return disk_byte_str
+        return create_fat12_disk_image({'ios_config.txt': day0_str})
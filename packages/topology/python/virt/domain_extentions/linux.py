@@ -13,6 +13,8 @@ _ncs = __import__('_ncs')
 
 @VirtFactory.register_volume('Linux')
 class LinuxVolume(Volume):
+    DAY0_TEMPLATES = ('meta-data.yaml', 'network-config.yaml', 'ethernet.yaml')
+
     def _load_templates(self):
         super()._load_templates()
         self._templates.load_template('cloud-init', 'meta-data.yaml')
@@ -21,7 +23,7 @@ class LinuxVolume(Volume):
 
     def _get_cloud_init_ethernets(self, device_id):
         network_config = ''
-        for iface_id in range(self._connection_mgr.get_num_device_ifaces()):
+        for iface_id in self._connection_mgr.get_device_iface_ids(device_id):
             network = self._connection_mgr.get_iface_network_id(device_id,
                     iface_id) or self._connection_mgr.get_iface_bridge_name(
                     device_id, iface_id)
@@ -45,11 +47,17 @@ class LinuxVolume(Volume):
                 ('ip-address', ip_address)])
         return network_config
 
-    def _create_day0_image(self, file_name, variables, device_id):
+    def _get_day0_variables(self, device_id, device_name, dev_def):
+        variables = super()._get_day0_variables(
+                device_id, device_name, dev_def)
+        variables['ethernets'] = self._get_cloud_init_ethernets(device_id)
+        return variables
+
+    def _create_day0_image(self, file_name, variables, _):
         meta_data = self._templates.apply_template('meta-data.yaml', variables)
         network_config = self._templates.apply_template(
                 'network-config.yaml',variables)
-        network_config += self._get_cloud_init_ethernets(device_id)
+        network_config += variables['ethernets']
         user_data = self._templates.apply_template(file_name, variables)
 
         self._log.info('Writing cloud-init files to iso stream')
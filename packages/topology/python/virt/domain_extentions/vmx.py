@@ -1,12 +1,8 @@
 #!/usr/bin/python3
 
-import os
-from fs.tarfs import TarFS
-
-import fs
-
 from virt.virt_factory import VirtFactory
-from virt.volume import Volume, generate_day0_volume_name
+from virt.fat_image import create_fat12_disk_image
+from virt.volume import Volume, create_tgz
 from virt.domain_libvirt import DomainLibvirt
 from virt.connection_libvirt import DomainNetworks
 
@@ -45,35 +41,20 @@ class VmxDomain(DomainLibvirt):
 
 @VirtFactory.register_volume('vMX')
 class VmxVolume(Volume):
+    DAY0_TEMPLATES = ('junos-vmx-loader.conf', )
+
     def _load_templates(self):
         super()._load_templates()
         self._templates.load_template('images', 'junos-vmx-loader.conf')
 
     def _create_day0_image(self, file_name, variables, _):
         day0_str = self._templates.apply_template(file_name, variables)
-        tmp_disk_file = \
-                f'tmp-{generate_day0_volume_name(variables["device-name"])}'
-
-        offset = self._create_raw_disk_image(tmp_disk_file, False)
 
-        self._log.info('Writing day0 file to partition')
+        self._log.info('Writing day0 file to disk image')
         self._log.debug(f'/config/juniper.conf:\n{day0_str}')
-        with fs.open_fs(f'fat://{tmp_disk_file}?'
-                        f'offset={offset}') as flash_drive:
-            with TarFS(flash_drive.openbin('/vmm-config.tgz', 'wb'),
-                                write=True, compression='gz') as tarfile:
-                tarfile.makedir('/config')
-                tarfile.writetext('/config/juniper.conf', day0_str)
-
-                tarfile.makedir('/boot')
-                tarfile.writetext('/boot/loader.conf',
-                        self._templates.apply_template(
-                            'junos-vmx-loader.conf', {}))
-
-        with open(tmp_disk_file, 'rb') as binary_file:
-            disk_byte_str = binary_file.read()
-
-        self._log.info(f'Deleting temporary disk file {tmp_disk_file}')
-        os.remove(tmp_disk_file)
-
-        return disk_byte_str
+        return create_fat12_disk_image({
+            'vmm-config.tgz': create_tgz({
+                'config/juniper.conf': day0_str,
+                'boot/loader.conf': self._templates.apply_template(
+                    'junos-vmx-loader.conf', {})})
+            }, create_partition_table=False)
@@ -14,6 +14,8 @@ class Vxr8000Domain(DomainVxr):
 
 @VirtFactory.register_volume('VXR-8000')
 class Vxr8000Volume(Volume):
+    # The image is also written to a local file
+    CACHE_DAY0_IMAGE = False
 
     def _create_day0_image(self, file_name, variables, _):
         image_str = self._templates.apply_template(
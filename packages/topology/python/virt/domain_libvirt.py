@@ -5,7 +5,7 @@ from virt.connection import (
     generate_geneve_iface_name, generate_network_id, generate_network_name,
 )
 from virt.template import xml_to_string
-from virt.topology_status import get_hypervisor_output_node, write_node_data
+from virt.topology_status import add_hypervisor_output, write_node_data
 from virt.volume import generate_volume_name, generate_day0_volume_name
 from monitor.console_activity import start_console_logger, stop_console_logger
 
@@ -123,8 +123,14 @@ class DomainXmlBuilder():
 
     def add_data_ifaces(self, include_null_interfaces, model_type,
             min_ifaces = 0, first_iface = 0, device_id = None):
-        for iface_id in range(first_iface,
-                self._connection_mgr.get_num_device_ifaces()):
+        # Null interfaces keep the NIC positions of the connected interfaces,
+        # so every interface id up to the highest in the topology is needed
+        iface_ids = range(first_iface,
+                self._connection_mgr.get_num_device_ifaces()) if (
+                include_null_interfaces or min_ifaces) else \
+                self._connection_mgr.get_device_iface_ids(
+                        device_id or self._device_id, first_iface)
+        for iface_id in iface_ids:
             bridge_name = self._connection_mgr.get_iface_bridge_name(
                     device_id or self._device_id, iface_id)
             network_id = self._connection_mgr.get_iface_network_id(
@@ -227,6 +233,7 @@ class DomainLibvirt(Domain):
 
         if libvirt:
             libvirt.conn.defineXML(domain_xml_str)
+            libvirt.refresh_domain(device_name)
 
     def _undefine(self, device):
         return self._action('undefine', device)
@@ -235,28 +242,51 @@ class DomainLibvirt(Domain):
         device_name = device.device_name
         libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
         if libvirt and device_name in libvirt.domains:
-            return libvirt.conn.lookupByName(device_name).isActive()
+            return libvirt.domains[device_name]['active']
         return False
 
+    def watch_shutdown(self, device, waiter):
+        device_name = device.device_name
+        libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
+        if libvirt and device_name in libvirt.domains:
+            waiter.watch_libvirt(device_name, libvirt, self._dev_defs[
+                    device.definition].shutdown_timeout)
+
     def shutdown_supported(self):
         return self.SHUTDOWN_SUPPORTED
 
+    def _get_linked_containers(self, device_id):
+        """The containers with a direct link to a tap interface of a domain"""
+        container_names = set()
+        for iface_id in self._connection_mgr.get_device_iface_ids(device_id):
+            (other_id, _) = self._connection_mgr.get_interface_direct_link_info(
+                    device_id, iface_id)
+            if other_id is not None and self._domain_mgr.is_container(other_id):
+                container_names.add(self._domain_mgr.get_device_name(other_id))
+        return container_names
+
     def _action(self, action, *args):
         device, = args
         device_name = device.device_name
         libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
         if libvirt and device_name in libvirt.domains:
-            domain = libvirt.conn.lookupByName(device_name)
-            if self._action_allowed(domain.isActive(), action):
+            if self._action_allowed(
+                    libvirt.domains[device_name]['active'], action):
                 self._log.info(f'[{libvirt.name}] '
                                f'Running {action} on domain {device_name} ')
+                domain = libvirt.conn.lookupByName(device_name)
                 if action == 'undefine':
                     domain.undefineFlags(VIR_DOMAIN_UNDEFINE_NVRAM)
+                    libvirt.remove_domain(device_name)
                 else:
                     domain_action_method = getattr(domain, action)
                     domain_action_method()
-                get_hypervisor_output_node(
-                        self._output, libvirt.name).domains.create(device_name)
+                    libvirt.refresh_domain(device_name)
+                self._hypervisor_mgr.invalidate_host_network_state(
+                        libvirt.name, f'vtap-{device.id}-',
+                        self._get_linked_containers(int(device.id)))
+                add_hypervisor_output(
+                        self._output, libvirt.name, 'domains', device_name)
                 if action == 'create':
                     start_console_logger(device._path)
                     # Plumb VM interfaces after domain is started
@@ -1,6 +1,6 @@
 from virt.domain import Domain
 from virt.connection import generate_bridge_name
-from virt.topology_status import write_node_data, get_hypervisor_output_node
+from virt.topology_status import write_node_data, add_hypervisor_output
 from virt.volume import generate_day0_volume_name
 
 
@@ -30,8 +30,8 @@ class VxrJsonBuilder():
         bridge['connection_type'] = 'tap'
 
     def add_data_ifaces(self, iface_prefix, first_iface = 0, device_id = None):
-        for iface_id in range(first_iface,
-                self._connection_mgr.get_num_device_ifaces()):
+        for iface_id in self._connection_mgr.get_device_iface_ids(
+                device_id or self._device_id, first_iface):
             bridge_name = self._connection_mgr.get_iface_bridge_name(
                     device_id or self._device_id, iface_id)
             network_id = self._connection_mgr.get_iface_network_id(
@@ -156,8 +156,8 @@ class DomainVxr(Domain):
                 action_method = getattr(self, action_name)
                 result = action_method(vxr, *args)
 
-                get_hypervisor_output_node(
-                        self._output, vxr.name).domains.create(device_name)
+                add_hypervisor_output(
+                        self._output, vxr.name, 'domains', device_name)
                 return result
         self._log.info(f'[{vxr.name}] Skipping {action} on simulation {device_name}')
         return False
@@ -0,0 +1,212 @@
+#!/usr/bin/python3
+"""
+In-memory FAT12 disk images, for day0 volumes.
+
+Builds the same image as a zeroed 1008KiB file partitioned with fdisk and
+formatted with mkfs.fat (-F 12 -g 2/63 -h 1 -R 8 -s 8), with the files
+written to the root directory, directly into a bytes buffer.
+"""
+import struct
+import time
+import zlib
+
+BYTES_PER_SECTOR = 512
+SECTORS_PER_TRACK = 63
+HEADS = 2
+DISK_SECTORS = 1024 * 1024 // BYTES_PER_SECTOR \
+        // SECTORS_PER_TRACK * SECTORS_PER_TRACK  # 2016
+
+HIDDEN_SECTORS = 1
+RESERVED_SECTORS = 8
+SECTORS_PER_CLUSTER = 8
+NUM_FATS = 2
+ROOT_DIR_ENTRIES = 512
+MEDIA_DESCRIPTOR = 0xf8
+PARTITION_TYPE_FAT12 = 0x01
+
+DIR_ENTRY_SIZE = 32
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = 0x0f
+LFN_CHARS_PER_ENTRY = 13
+SHORT_NAME_CHARS = '!#$%&\'()-@^_`{}~'
+
+
+def _chs(lba):
+    cylinder = lba // (HEADS * SECTORS_PER_TRACK)
+    head = lba // SECTORS_PER_TRACK % HEADS
+    sector = lba % SECTORS_PER_TRACK + 1
+    return bytes((head, sector | (cylinder >> 2 & 0xc0), cylinder & 0xff))
+
+def _dos_date_time(timestamp):
+    tm = time.localtime(timestamp)
+    return ((tm.tm_year - 1980) << 9 | tm.tm_mon << 5 | tm.tm_mday,
+            tm.tm_hour << 11 | tm.tm_min << 5 | tm.tm_sec // 2)
+
+
+def _short_name(name, used):
+    """
+    Return the 11 byte 8.3 name of a file, and whether a long name is also
+    needed (the name is not a valid upper case 8.3 name).
+    """
+    (base, _, ext) = name.rpartition('.') if '.' in name else (name, '', '')
+
+    def _clean(part):
+        return ''.join(char if char.isascii() and char.isalnum() or
+                       char in SHORT_NAME_CHARS
+                       else '_' for char in part.upper() if char not in ' .')
+
+    short_base = _clean(base)
+    short_ext = _clean(ext)[:3]
+    short_name = (short_base.ljust(8) + short_ext.ljust(3)).encode('ascii')
+    needs_long_name = not (base and short_base == base and short_ext == ext
+                           and len(base) <= 8 and short_name not in used)
+    if needs_long_name:
+        index = 1
+        while True:
+            tail = f'~{index}'
+            short_name = (f'{short_base[:8 - len(tail)]}{tail}'.ljust(8) +
+                          short_ext.ljust(3)).encode('ascii')
+            if short_name not in used:
+                break
+            index += 1
+    used.add(short_name)
+    return (short_name, needs_long_name)
+
+def _long_name_entries(name, short_name):
+    """The long name directory entries of a file, in on-disk order"""
+    checksum = 0
+    for char in short_name:
+        checksum = ((checksum & 1) << 7) + (checksum >> 1) + char & 0xff
+
+    chars = name.encode('utf-16-le')
+    num_entries = -(-len(name) // LFN_CHARS_PER_ENTRY)
+    padded = chars + b'\x00\x00' if len(name) % LFN_CHARS_PER_ENTRY else chars
+    padded = padded.ljust(num_entries * LFN_CHARS_PER_ENTRY * 2, b'\xff')
+
+    entries = []
+    for index in range(num_entries):
+        part = padded[index * 26:(index + 1) * 26]
+        sequence = index + 1 | (0x40 if index == num_entries - 1 else 0)
+        entries.append(struct.pack('<B10sBBB12sH4s',
+                sequence, part[:10], ATTR_LONG_NAME, 0, checksum,
+                part[10:22], 0, part[22:]))
+    return reversed(entries)
+
+
+class Fat12Image():
+    """
+    A FAT12 filesystem with files in its root directory. The filesystem
+    fills the disk, or the single primary partition of the disk (starting
+    on the second track) if a partition table is created.
+    """
+
+    def __init__(self, create_partition_table=True):
+        self._first_sector = (
+                SECTORS_PER_TRACK if create_partition_table else 0)
+        self._files = []  # [(name, content)]
+
+    def add_file(self, name, content):
+        if isinstance(content, str):
+            content = content.encode()
+        self._files.append((name, content))
+
+    def _layout(self, total_sectors):
+        """Returns (sectors per FAT, root directory sectors, clusters)"""
+        root_dir_sectors = ROOT_DIR_ENTRIES * DIR_ENTRY_SIZE // BYTES_PER_SECTOR
+        fat_sectors = 1
+        while True:
+            data_sectors = (total_sectors - RESERVED_SECTORS -
+                            NUM_FATS * fat_sectors - root_dir_sectors)
+            clusters = data_sectors // SECTORS_PER_CLUSTER
+            needed = -(-((clusters + 2) * 3 // 2 + 1) // BYTES_PER_SECTOR)
+            if needed <= fat_sectors:
+                return (fat_sectors, root_dir_sectors, clusters)
+            fat_sectors = needed
+
+    def _boot_sector(self, total_sectors, fat_sectors, volume_id):
+        boot_sector = bytearray(BYTES_PER_SECTOR)
+        boot_sector[0:62] = struct.pack('<3s8sHBHBHHBHHHIIBBBI11s8s',
+                b'\xeb\x3c\x90', b'mkfs.fat',
+                BYTES_PER_SECTOR, SECTORS_PER_CLUSTER, RESERVED_SECTORS,
+                NUM_FATS, ROOT_DIR_ENTRIES, total_sectors, MEDIA_DESCRIPTOR,
+                fat_sectors, SECTORS_PER_TRACK, HEADS, HIDDEN_SECTORS, 0,
+                0x80, 0, 0x29, volume_id, b'NO NAME    ', b'FAT12   ')
+        boot_sector[510:512] = b'\x55\xaa'
+        return boot_sector
+
+    def _partition_table(self, total_sectors):
+        last_sector = self._first_sector + total_sectors - 1
+        mbr = bytearray(BYTES_PER_SECTOR)
+        mbr[446:462] = (b'\x80' + _chs(self._first_sector) +
+                bytes((PARTITION_TYPE_FAT12, )) + _chs(last_sector) +
+                struct.pack('<II', self._first_sector, total_sectors))
+        mbr[510:512] = b'\x55\xaa'
+        return mbr
+
+    def to_bytes(self):
+        total_sectors = DISK_SECTORS - self._first_sector
+        (fat_sectors, root_dir_sectors, clusters) = self._layout(total_sectors)
+        cluster_size = SECTORS_PER_CLUSTER * BYTES_PER_SECTOR
+
+        fat = bytearray(fat_sectors * BYTES_PER_SECTOR)
+        def _set_fat_entry(cluster, value):
+            offset = cluster * 3 // 2
+            if cluster % 2:
+                fat[offset] = fat[offset] & 0x0f | value << 4 & 0xf0
+                fat[offset + 1] = value >> 4 & 0xff
+            else:
+                fat[offset] = value & 0xff
+                fat[offset + 1] = fat[offset + 1] & 0xf0 | value >> 8 & 0x0f
+
+        _set_fat_entry(0, 0xf00 | MEDIA_DESCRIPTOR)
+        _set_fat_entry(1, 0xfff)
+
+        (date, time_of_day) = _dos_date_time(time.time())
+        root_dir = bytearray()
+        data = bytearray()
+        used_short_names = set()
+        next_cluster = 2
+        for (name, content) in self._files:
+            num_clusters = -(-len(content) // cluster_size)
+            if next_cluster + num_clusters > clusters + 2:
+                raise Exception(f'No space for {name} in day0 disk image')
+            first_cluster = next_cluster if num_clusters else 0
+            for cluster in range(next_cluster, next_cluster + num_clusters):
+                _set_fat_entry(cluster, cluster + 1
+                        if cluster < next_cluster + num_clusters - 1 else 0xfff)
+            next_cluster += num_clusters
+            data += content.ljust(num_clusters * cluster_size, b'\x00')
+
+            (short_name, needs_long_name) = _short_name(name, used_short_names)
+            if needs_long_name:
+                root_dir += b''.join(_long_name_entries(name, short_name))
+            root_dir += struct.pack('<11sBBBHHHHHHHI',
+                    short_name, ATTR_ARCHIVE, 0, 0, time_of_day, date, date, 0,
+                    time_of_day, date, first_cluster, len(content))
+
+        if len(root_dir) > ROOT_DIR_ENTRIES * DIR_ENTRY_SIZE:
+            raise Exception('Too many files for day0 disk image')
+
+        volume_id = zlib.crc32(b''.join(content for (_, content) in self._files))
+        image = bytearray(DISK_SECTORS * BYTES_PER_SECTOR)
+        offset = self._first_sector * BYTES_PER_SECTOR
+        if self._first_sector:
+            image[0:BYTES_PER_SECTOR] = self._partition_table(total_sectors)
+        image[offset:offset + BYTES_PER_SECTOR] = self._boot_sector(
+                total_sectors, fat_sectors, volume_id)
+        offset += RESERVED_SECTORS * BYTES_PER_SECTOR
+        for _ in range(NUM_FATS):
+            image[offset:offset + len(fat)] = fat
+            offset += len(fat)
+        image[offset:offset + len(root_dir)] = root_dir
+        offset += root_dir_sectors * BYTES_PER_SECTOR
+        image[offset:offset + len(data)] = data
+        return bytes(image)
+
+
+def create_fat12_disk_image(files, create_partition_table=True):
+    """Return a FAT12 disk image containing files {name: content}"""
+    image = Fat12Image(create_partition_table)
+    for (name, content) in files.items():
+        image.add_file(name, content)
+    return image.to_bytes()
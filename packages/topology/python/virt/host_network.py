@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+"""
+Snapshot of the network interfaces on a hypervisor host.
+
+The InterfacePlumber decides what to do for each interface of each link by
+checking which interfaces exist on the host and in the container network
+namespaces, and by looking up container PIDs. The snapshot collects all of
+these in a single batch over the SSH connection, so the checks are answered
+from memory.
+
+The plumber patches the snapshot as it creates, moves and deletes
+interfaces. Starting or stopping a domain changes the host interfaces outside
+of the plumber (tap interfaces, container namespaces), so the domains mark
+the interfaces or containers they change as stale. Only those are collected
+again, when they are next checked.
+"""
+import threading
+
+CONTAINER_MARKER = 'container'
+
+# Print each running container's name and PID, followed by the interfaces in
+# its network namespace
+_COLLECT_CONTAINER_IFACES = (
+    "docker ps -q | "
+    "xargs -r docker inspect -f '{{.Name}} {{.State.Pid}}' | "
+    "while read -r name pid; do "
+    f"printf '%s\\n' \"{CONTAINER_MARKER} ${{name#/}} $pid\"; "
+    "nsenter -t \"$pid\" -n ip -o link show || true; "
+    "done")
+
+
+def _collect_container_command(container_name):
+    """Print the name and PID of one container, and its interfaces"""
+    return (f"pid=$(docker inspect -f '{{{{.State.Pid}}}}' {container_name} "
+            f"2>/dev/null); "
+            f"printf '%s\\n' "
+            f"\"{CONTAINER_MARKER} {container_name} ${{pid:-0}}\"; "
+            "[ \"${pid:-0}\" = 0 ] || "
+            "nsenter -t \"$pid\" -n ip -o link show || true")
+
+
+def parse_ip_link_names(output):
+    """
+    Return the interface names from 'ip -o link show' output, without the
+    @peer suffix of veth interfaces.
+    """
+    names = set()
+    for line in output.split('\n'):
+        parts = line.split(': ', 2)
+        if len(parts) == 3 and parts[0].isdigit():
+            names.add(parts[1].split('@')[0])
+    return names
+
+
+def parse_container_ifaces(output):
+    """
+    Return ({container_name: pid}, {container_name: {iface_name}}) from the
+    output of the container collection commands.
+    """
+    container_pids = {}
+    container_ifaces = {}
+    container_name = None
+    for line in output.split('\n'):
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == CONTAINER_MARKER:
+            (_, container_name, pid) = parts
+            if pid != '0':
+                container_pids[container_name] = pid
+            container_ifaces[container_name] = set()
+        elif container_name is not None:
+            container_ifaces[container_name] |= parse_ip_link_names(line)
+    return (container_pids, container_ifaces)
+
+
+class HostNetworkState():
+    def __init__(self, hypervisor_name, executor, log):
+        self._hypervisor_name = hypervisor_name
+        self._executor = executor
+        self._log = log
+        self._host_ifaces = None
+        self._container_pids = None     # {container_name: pid}
+        self._container_ifaces = None   # {container_name: {iface_name}}
+        self._stale_host_prefixes = set()
+        self._stale_containers = set()
+        # Patches made while collecting, replayed over the collected state
+        self._patches = None
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()
+
+    def _collect(self):
+        self._log.debug(
+                f'[{self._hypervisor_name}] Collecting host network state')
+        (host_result, container_result) = self._executor.execute([
+                'ip -o link show',
+                _COLLECT_CONTAINER_IFACES])
+        return (parse_ip_link_names(host_result['stdout']),
+                *parse_container_ifaces(container_result['stdout']))
+
+    def _get_state(self):
+        """Return the state, collecting it the first time it is needed"""
+        with self._collect_lock:
+            with self._lock:
+                if self._host_ifaces is not None:
+                    return (self._host_ifaces, self._container_pids,
+                            self._container_ifaces)
+                self._patches = []
+            state = self._collect()
+            with self._lock:
+                (self._host_ifaces, self._container_pids,
+                 self._container_ifaces) = state
+                self._replay_patches()
+                return state
+
+    def _replay_patches(self):
+        for patch in self._patches:
+            patch()
+        self._patches = None
+
+    def _refresh_host_ifaces(self, iface_name):
+        """Collect the host interfaces again, if iface_name may be stale"""
+        with self._collect_lock:
+            with self._lock:
+                if not iface_name.startswith(
+                        tuple(self._stale_host_prefixes)):
+                    return
+                prefixes = tuple(self._stale_host_prefixes)
+                self._stale_host_prefixes.clear()
+                self._patches = []
+            self._log.debug(
+                    f'[{self._hypervisor_name}] Collecting host interfaces')
+            (result, ) = self._executor.execute(['ip -o link show'])
+            host_ifaces = parse_ip_link_names(result['stdout'])
+            with self._lock:
+                self._host_ifaces = {name for name in self._host_ifaces
+                                     if not name.startswith(prefixes)}
+                self._host_ifaces |= {name for name in host_ifaces
+                                      if name.startswith(prefixes)}
+                self._replay_patches()
+
+    def _refresh_container(self, container_name):
+        """Collect the PID and interfaces of a container again, if stale"""
+        with self._collect_lock:
+            with self._lock:
+                if container_name not in self._stale_containers:
+                    return
+                self._stale_containers.discard(container_name)
+                self._patches = []
+            self._log.debug(f'[{self._hypervisor_name}] Collecting network '
+                            f'state of container {container_name}')
+            (result, ) = self._executor.execute(
+                    [_collect_container_command(container_name)])
+            (container_pids, container_ifaces) = parse_container_ifaces(
+                    result['stdout'])
+            with self._lock:
+                self._container_pids.pop(container_name, None)
+                self._container_pids.update(container_pids)
+                self._container_ifaces[container_name] = container_ifaces.get(
+                        container_name, set())
+                self._replay_patches()
+
+    def invalidate_host_ifaces(self, prefix=''):
+        """Mark the host interfaces starting with prefix (default all) stale"""
+        with self._lock:
+            self._stale_host_prefixes.add(prefix)
+
+    def invalidate_container(self, container_name):
+        """Mark the PID and interfaces of a container stale"""
+        with self._lock:
+            self._stale_containers.add(container_name)
+
+    def host_iface_exists(self, iface_name):
+        self._get_state()
+        self._refresh_host_ifaces(iface_name)
+        with self._lock:
+            return iface_name in self._host_ifaces
+
+    def container_iface_exists(self, container_name, iface_name):
+        self._get_state()
+        self._refresh_container(container_name)
+        with self._lock:
+            return iface_name in self._container_ifaces.get(
+                    container_name, ())
+
+    def get_container_pid(self, container_name):
+        self._get_state()
+        self._refresh_container(container_name)
+        with self._lock:
+            return self._container_pids.get(container_name, None)
+
+    def _patch(self, patch):
+        with self._lock:
+            if self._host_ifaces is not None:
+                patch()
+            if self._patches is not None:
+                self._patches.append(patch)
+
+    def add_host_iface(self, iface_name):
+        self._patch(lambda: self._host_ifaces.add(iface_name))
+
+    def remove_host_iface(self, iface_name):
+        self._patch(lambda: self._host_ifaces.discard(iface_name))
+
+    def add_container_iface(self, container_name, iface_name):
+        self._patch(lambda: self._container_ifaces.setdefault(
+                container_name, set()).add(iface_name))
+
+    def remove_container_iface(self, container_name, iface_name):
+        self._patch(lambda: self._container_ifaces.get(
+                container_name, set()).discard(iface_name))
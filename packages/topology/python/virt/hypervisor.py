@@ -1,10 +1,15 @@
+import threading
+
+from virt.host_network import HostNetworkState
 from virt.hypervisor_docker import HypervisorDocker
 from virt.hypervisor_libvirt import HypervisorLibvirt
 from virt.hypervisor_vxr import HypervisorVxr
+from virt.volume_provisioner import VolumeProvisioner
 
 
 class HypervisorManager():
-    def __init__(self, hypervisors, topology, log):
+    def __init__(self, snapshot, log):
+        hypervisors = snapshot.hypervisors
         self._libvirt_connections = {
                 hypervisor.name: HypervisorLibvirt(hypervisor, log)
                 for hypervisor in hypervisors if hypervisor.host}
@@ -23,23 +28,35 @@ class HypervisorManager():
         self._geneve_tunnel_ip_addresses = {
                 hypervisor.name: hypervisor.geneve_tunnel_ip_address
                 for hypervisor in hypervisors }
+        self._parallel_action_limits = {
+                hypervisor.name: hypervisor.max_parallel_actions
+                for hypervisor in hypervisors }
         self._hypervisors = {
-                int(device.id): device.hypervisor or topology.libvirt.hypervisor
-                for device in topology.devices.device}
+                device.id: device.hypervisor for device in snapshot.devices}
+        self._host_network_states = {
+                hypervisor.name: HostNetworkState(hypervisor.name,
+                    self.get_ssh_executor(hypervisor.name), log)
+                for hypervisor in hypervisors if hypervisor.host}
+        self._connect_lock = threading.Lock()
         self._log = log
+        self.volume_provisioner = VolumeProvisioner(log)
+        # Day0 image builds prepared before the devices are defined, so the
+        # day0 variables (and their side effects) are only generated once
+        self.day0_image_builds = {}  # {device_id: build}
 
     def get_libvirt(self, hypervisor_name):
         libvirt_conn = self._libvirt_connections.get(hypervisor_name, None)
-        if libvirt_conn and libvirt_conn.conn is None:
-            libvirt_conn.connect()
-            libvirt_conn.populate_cache()
+        with self._connect_lock:
+            if libvirt_conn and libvirt_conn.conn is None:
+                libvirt_conn.connect()
         return libvirt_conn
 
     def get_docker(self, hypervisor_name):
         docker_conn = self._docker_connections.get(hypervisor_name, None)
-        if docker_conn and docker_conn.conn is None:
-            docker_conn.connect()
-            docker_conn.populate_cache()
+        with self._connect_lock:
+            if docker_conn and docker_conn.conn is None:
+                docker_conn.connect()
+                docker_conn.populate_cache()
         return docker_conn
 
     def get_vxr(self, hypervisor_name):
@@ -55,6 +72,29 @@ class HypervisorManager():
     def get_device_vxr(self, device_id):
         return self.get_vxr(self._hypervisors[int(device_id)])
 
+    def get_ssh_executor(self, hypervisor_name):
+        # The SSH connection does not depend on the libvirt connection
+        return self._libvirt_connections[hypervisor_name].get_ssh_executor()
+
+    def get_host_network_state(self, hypervisor_name):
+        return self._host_network_states[hypervisor_name]
+
+    def invalidate_host_network_state(self, hypervisor_name,
+                                      iface_prefix=None, container_names=()):
+        """
+        Called when starting or stopping a domain, which adds or removes
+        interfaces on the host without going through the InterfacePlumber.
+        Marks the host interfaces starting with iface_prefix, and the
+        containers, stale.
+        """
+        host_network_state = self._host_network_states.get(
+                hypervisor_name, None)
+        if host_network_state:
+            if iface_prefix is not None:
+                host_network_state.invalidate_host_ifaces(iface_prefix)
+            for container_name in container_names:
+                host_network_state.invalidate_container(container_name)
+
     def get_external_bridge(self, hypervisor_name):
         return self._external_bridges[hypervisor_name]
 
@@ -64,6 +104,9 @@ class HypervisorManager():
     def get_device_hypervisor(self, device_id):
         return self._hypervisors.get(device_id, None)
 
+    def get_parallel_action_limit(self, hypervisor_name):
+        return self._parallel_action_limits.get(hypervisor_name, None)
+
     def get_device_udp_tunnel_ip_address(self, device_id):
         return self._udp_tunnel_ip_addresses[self._hypervisors[device_id]]
 
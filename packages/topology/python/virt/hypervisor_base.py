@@ -21,11 +21,15 @@ class Hypervisor:
             _ncs.decrypt(hypervisor.password) if hypervisor.password is not None
             else None
         )
+        self._ssh_idle_timeout = hypervisor.ssh_idle_timeout
         self._log = log
         self._ssh_executor = None
 
     def get_ssh_executor(self):
-        """Return a shared SshExecutor for this host. Creates it on first use."""
+        """
+        Return a shared SshExecutor for this host. Creates it on first use.
+        The SSH connection itself is pooled, so it outlives this object.
+        """
         if self._ssh_executor is None:
             self._ssh_executor = SshExecutor(
                 name=self.name,
@@ -33,5 +37,6 @@ class Hypervisor:
                 host=self._host,
                 username=self._username,
                 password=self._password,
+                idle_timeout=self._ssh_idle_timeout,
             )
         return self._ssh_executor
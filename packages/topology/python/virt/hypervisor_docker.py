@@ -1,5 +1,8 @@
-import subprocess
+import json
+import threading
+import time
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
 
@@ -7,11 +10,168 @@ from virt.hypervisor_base import Hypervisor
 
 _ncs = __import__('_ncs')
 
+ACTIVE_CONTAINER_STATES = ('running', 'paused', 'restarting')
+INTERFACE_DISCOVERY_WORKERS = 16
+
+IP_LINK_JSON_COMMAND = 'ip -j -d link'
+IP_LINK_TEXT_COMMAND = 'ip link'
+CONTAINER_STATE_TIMEOUT = 10
+
+# Container status after each docker container event. A destroy event
+# removes the container.
+CONTAINER_EVENT_STATES = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+    'stop': 'exited',
+    'destroy': None
+}
+
+
+class ContainerStateTable():
+    """
+    Status of every container on a docker host, seeded once from a container
+    listing and kept current by the docker events stream.
+
+    HypervisorDocker objects are created for every action, so there is one
+    table per docker host for the whole process, with its own docker client.
+    If the events stream closes (e.g. docker is restarted), the table is
+    seeded and subscribed again the next time it is used.
+    """
+
+    def __init__(self, name, log):
+        self.name = name
+        self.containers = {}  # {container_name: {'status': status}}
+        self._log = log
+        self._conn = None
+        self._events = None
+        self._listeners = []
+        self._condition = threading.Condition()
+        self._subscribe_lock = threading.Lock()
+
+    def is_subscribed(self):
+        with self._condition:
+            return self._events is not None
+
+    def subscribe(self, create_client):
+        """
+        Subscribe to the container events, then seed the table. Events which
+        are already reflected in the listing are replayed in order, so the
+        status still ends up current.
+
+        The docker calls are made outside the condition lock, so readers of
+        the table are not blocked by them, and only the new stream is swapped
+        in under it. Concurrent subscribers are serialized on their own lock.
+        """
+        with self._subscribe_lock:
+            with self._condition:
+                if self._events is not None:
+                    return
+                conn = self._conn
+            if conn is None:
+                conn = create_client()
+            try:
+                events = conn.events(
+                        decode=True, filters={'type': 'container'})
+                containers = conn.containers.list(all=True)
+            except Exception:
+                conn.close()
+                with self._condition:
+                    self._conn = None
+                raise
+            with self._condition:
+                self._conn = conn
+                self._events = events
+                self.seed(containers)
+            threading.Thread(
+                    target=self._read_events, args=(events,),
+                    name=f'DockerEvents-{self.name}-Thread',
+                    daemon=True).start()
+
+    def seed(self, containers):
+        with self._condition:
+            self.containers.clear()
+            for container in containers:
+                self.containers[container.name] = {
+                        'status': container.status
+                        }
+            self._condition.notify_all()
+
+    def _read_events(self, events):
+        try:
+            for event in events:
+                action = event.get('Action', event.get('status'))
+                if action in CONTAINER_EVENT_STATES:
+                    self.set_status(
+                            event.get('Actor', {}).get(
+                                'Attributes', {}).get('name'),
+                            CONTAINER_EVENT_STATES[action])
+        except Exception: #pylint: disable=broad-except
+            pass
+        self._log.warning(f'[{self.name}] Docker events stream closed')
+        with self._condition:
+            if self._events is events:
+                self._events = None
+                self._conn.close()
+                self._conn = None
+            self._condition.notify_all()
+
+    def set_status(self, container_name, status):
+        with self._condition:
+            if status is None:
+                self.containers.pop(container_name, None)
+            else:
+                self.containers[container_name] = { 'status': status }
+            listeners = list(self._listeners)
+            self._condition.notify_all()
+        for listener in listeners:
+            listener(container_name, status)
+
+    def get_status(self, container_name):
+        with self._condition:
+            container = self.containers.get(container_name, None)
+            return container['status'] if container else None
+
+    def wait_for_status(self, container_name, statuses, timeout):
+        """
+        Block until the container status is one of statuses (None for a
+        removed container). Returns False if the timeout passed first, or
+        there is no events stream to report the change.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.get_status(container_name) not in statuses:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._events is None:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def add_listener(self, listener):
+        with self._condition:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._condition:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+
+_container_tables = {}
+_container_tables_lock = threading.Lock()
+
+def get_container_table(name, url, log):
+    with _container_tables_lock:
+        return _container_tables.setdefault(
+                (name, url), ContainerStateTable(name, log))
+
 
 class HypervisorDocker(Hypervisor):
     def __init__(self, hypervisor, log):
         super().__init__(hypervisor, log)
-        self.containers = {}
         self.networks = {}
 
         self.interfaces = namedtuple('Interfaces', 'veths taps')(
@@ -19,13 +179,19 @@ class HypervisorDocker(Hypervisor):
             taps = [])
 
         self.conn = None
+        self._network_lock = threading.Lock()
 
-        self._tls_certs=(
-                (hypervisor.tls.client_certificate, hypervisor.tls.client_key)
-                if hypervisor.tls.exists() else None)
+        self._tls_certs = hypervisor.tls_certs
         self._url = f'tcp://{self._host}:2376' if (
                 self._tls_certs) else 'ssh://{self._host}'
 
+        self._container_table = get_container_table(
+                self.name, self._url, log)
+
+    @property
+    def containers(self):
+        return self._container_table.containers
+
     def __enter__(self):
         self.connect()
         return self
@@ -35,25 +201,56 @@ class HypervisorDocker(Hypervisor):
             self.conn.close()
             self.conn = None
 
-    def connect(self):
+    def _create_client(self):
         tls_config = docker.tls.TLSConfig(
                 client_cert=self._tls_certs) if (
                         self._tls_certs) else False
-        self.conn = docker.DockerClient(
+        return docker.DockerClient(
                 base_url=self._url,
                 tls=tls_config,
                 use_ssh_client=not tls_config)
 
+    def connect(self):
+        self.conn = self._create_client()
+
     def populate_cache(self):
         self._log.info(f'[{self.name}] Populating docker connection cache')
-        self.populate_containers()
+        self._container_table.subscribe(self._create_client)
         self.populate_networks()
 
     def populate_containers(self):
-        for container in self.conn.containers.list(all=True):
-            self.containers[container.name] = {
-                    'status': container.status
-                    }
+        # Kept current by the events stream once subscribed
+        if not self._container_table.is_subscribed():
+            self._container_table.seed(self.conn.containers.list(all=True))
+
+    def add_container_listener(self, listener):
+        """
+        Call listener(container_name, status) on every container status
+        change reported by the events stream. The status is None when the
+        container is removed.
+        """
+        self._container_table.add_listener(listener)
+
+    def remove_container_listener(self, listener):
+        self._container_table.remove_listener(listener)
+
+    def get_container_status(self, container_name):
+        return self._container_table.get_status(container_name)
+
+    def wait_for_container_status(self, container_name, statuses,
+                                  timeout=CONTAINER_STATE_TIMEOUT):
+        return self._container_table.wait_for_status(
+                container_name, statuses, timeout)
+
+    def _update_container_status(self, container, statuses):
+        """
+        Wait for the events stream to report a change made through the
+        docker API. If it is not reported in time, refresh the status from
+        the container itself.
+        """
+        if not self.wait_for_container_status(container.name, statuses):
+            container.reload()
+            self._container_table.set_status(container.name, container.status)
 
     def process_ip_link_output(self, output):
         """
@@ -141,26 +338,82 @@ class HypervisorDocker(Hypervisor):
                                     del ifaces[iface_index]
         return ifaces
 
+    def process_ip_link_json(self, output):
+        """
+        Parse 'ip -j -d link' output to extract interface information.
+
+        Returns the same dict as process_ip_link_output, with the same
+        handling of interfaces in named (non-numeric) namespaces and of
+        interfaces with a peer in the host namespace:
+
+        dict: {interface_key: [name, peer, bridge, mac]}
+        """
+        ifaces = {}
+        for link in json.loads(output):
+            if 'link_netns' in link and not str(link['link_netns']).isdigit():
+                continue
+            iface_index = link['ifindex']
+            iface_peer = (str(link['link_index'])
+                          if 'link_index' in link else None)
+            if link.get('link_netnsid', None) == 0:
+                iface_index = f'{iface_index}@{iface_peer}'
+            ifaces[iface_index] = [link['ifname'], iface_peer,
+                                   link.get('master', None),
+                                   link.get('address', None)]
+        return ifaces
+
+    def _process_ip_link(self, json_output, text_output_fn):
+        """
+        Parse the JSON output if the ip command supports it (iproute2 does,
+        busybox does not), otherwise get and parse the text output.
+        """
+        if json_output.lstrip().startswith('['):
+            return self.process_ip_link_json(json_output)
+        return self.process_ip_link_output(text_output_fn())
+
+    def _collect_host_interfaces(self):
+        executor = self.get_ssh_executor()
+        return self._process_ip_link(
+                executor.execute(IP_LINK_JSON_COMMAND)['stdout'],
+                lambda: executor.execute(IP_LINK_TEXT_COMMAND)['stdout'])
+
+    def _collect_container_interfaces(self, container):
+        (exit_code, output) = container.exec_run(IP_LINK_JSON_COMMAND)
+        return self._process_ip_link(
+                output.decode() if exit_code == 0 else '',
+                lambda: container.exec_run(
+                    IP_LINK_TEXT_COMMAND).output.decode())
+
     def _collect_all_interfaces(self):
         """
         Collect all network interfaces from host and containers.
+
+        The host (over the persistent SSH connection) and each running
+        container are queried concurrently. The results are merged in the
+        same order as they were previously collected, host first.
         """
         ifaces = {}
-
-        # Get host interfaces
-        result = subprocess.run(["ssh", self._host, "ip link"],
-                check=True, capture_output=True, text=True).stdout
-        host_ifaces = self.process_ip_link_output(result)
-        for index, (iface, peer, bridge, mac) in host_ifaces.items():
-            ifaces[index] = ('<host>', iface, peer, bridge, mac)
-
-        # Get container interfaces
-        for container in self.conn.containers.list(all=True):
-            if container.status == 'running':
-                result = container.exec_run('ip link')
-                container_ifaces = self.process_ip_link_output(result.output.decode())
-                for index, (iface, peer, bridge, mac) in container_ifaces.items():
-                    ifaces[index] = (container.name, iface, peer, bridge, mac)
+        containers = [ container
+                       for container in self.conn.containers.list(all=True)
+                       if container.status == 'running' ]
+
+        with ThreadPoolExecutor(max_workers=INTERFACE_DISCOVERY_WORKERS) as pool:
+            host_future = pool.submit(self._collect_host_interfaces)
+            container_futures = [
+                    (container.name, pool.submit(
+                        self._collect_container_interfaces, container))
+                    for container in containers ]
+
+            # Get host interfaces
+            for index, (iface, peer, bridge, mac) in \
+                    host_future.result().items():
+                ifaces[index] = ('<host>', iface, peer, bridge, mac)
+
+            # Get container interfaces
+            for (container_name, future) in container_futures:
+                for index, (iface, peer, bridge, mac) in \
+                        future.result().items():
+                    ifaces[index] = (container_name, iface, peer, bridge, mac)
 
         return ifaces
 
@@ -229,6 +482,10 @@ class HypervisorDocker(Hypervisor):
         self._classify_interfaces(ifaces)
 
     def create_network(self, bridge_name, subnet, internal=True):
+        with self._network_lock:
+            self._create_network(bridge_name, subnet, internal)
+
+    def _create_network(self, bridge_name, subnet, internal):
         if bridge_name not in self.networks:
             self._log.info(
                     f'[{self.name}] Creating docker network {bridge_name}')
@@ -253,6 +510,10 @@ class HypervisorDocker(Hypervisor):
             self.networks[bridge_name] = { 'containers': [] }
 
     def delete_network(self, bridge_name):
+        with self._network_lock:
+            self._delete_network(bridge_name)
+
+    def _delete_network(self, bridge_name):
         if bridge_name in self.networks:
             network = self.conn.networks.get(bridge_name)
             if len(network.containers) == 0:
@@ -306,8 +567,9 @@ class HypervisorDocker(Hypervisor):
                 security_opt=[ 'apparmor=unconfined' ],
                 stdin_open=True,
                 tty=True)
-        self.containers[container_name] = { 'status': 'created' }
-        self.networks[mgmt_bridge]['containers'].append(container_name)
+        self._container_table.set_status(container_name, 'created')
+        with self._network_lock:
+            self.networks[mgmt_bridge]['containers'].append(container_name)
 
     def start(self, container_name):
         if (container_name in self.containers and
@@ -315,6 +577,7 @@ class HypervisorDocker(Hypervisor):
             self._log.info(f'[{self.name}] Starting container {container_name}')
             container = self.conn.containers.get(container_name)
             container.start()
+            self._update_container_status(container, ACTIVE_CONTAINER_STATES)
 
     def post_start_commands(self,
                 container_name, post_start_commands):
@@ -341,6 +604,7 @@ class HypervisorDocker(Hypervisor):
             self._log.info(f'[{self.name}] Stopping container {container_name}')
             container = self.conn.containers.get(container_name)
             container.stop()
+            self._update_container_status(container, ('exited', 'dead'))
 
     def remove(self, container_name):
         if (container_name in self.containers and
@@ -348,7 +612,7 @@ class HypervisorDocker(Hypervisor):
             self._log.info(f'[{self.name}] Removing container {container_name}')
             container = self.conn.containers.get(container_name)
             container.remove()
-            del self.containers[container_name]
+            self._container_table.set_status(container_name, None)
 
     def connect_network(self, container_name, network_name):
         self._log.info(
@@ -366,5 +630,8 @@ class HypervisorDocker(Hypervisor):
             network.disconnect(container_name)
 
     def is_active(self, container_name):
-        return container_name in (
-                container.name for container in self.conn.containers.list() )
+        if not self._container_table.is_subscribed():
+            return container_name in (
+                    container.name for container in self.conn.containers.list() )
+        return self.get_container_status(
+                container_name) in ACTIVE_CONTAINER_STATES
@@ -1,8 +1,347 @@
+import threading
 from collections import defaultdict
-from xml.etree.ElementTree import fromstring
+from collections.abc import MutableMapping
+from functools import partial
+from xml.etree.ElementTree import XMLPullParser
 import libvirt
 
 from virt.hypervisor_base import Hypervisor
+from virt.libvirt_events import start_event_loop
+
+# Summed over every vCPU, disk or interface of a domain
+DOMAIN_COUNTERS = {
+    'cpu-time': (libvirt.VIR_DOMAIN_STATS_CPU_TOTAL, 'cpu.time'),
+    'block-read-bytes': (libvirt.VIR_DOMAIN_STATS_BLOCK, 'block.{}.rd.bytes'),
+    'block-write-bytes': (libvirt.VIR_DOMAIN_STATS_BLOCK, 'block.{}.wr.bytes'),
+    'net-rx-bytes': (libvirt.VIR_DOMAIN_STATS_INTERFACE, 'net.{}.rx.bytes'),
+    'net-tx-bytes': (libvirt.VIR_DOMAIN_STATS_INTERFACE, 'net.{}.tx.bytes')
+}
+
+# Detect a dead connection after 5 unanswered keepalives, 5 seconds apart
+LIBVIRT_KEEPALIVE_INTERVAL = 5
+LIBVIRT_KEEPALIVE_COUNT = 5
+
+
+def _sum_domain_counter(stats, key):
+    if '{}' not in key:
+        return stats.get(key, None)
+    prefix = key.split('.', 1)[0]
+    return sum(stats.get(key.format(index), 0)
+               for index in range(stats.get(f'{prefix}.count', 0)))
+
+def _domain_stats_types(include_counters):
+    stats_types = (libvirt.VIR_DOMAIN_STATS_STATE |
+                   libvirt.VIR_DOMAIN_STATS_VCPU |
+                   libvirt.VIR_DOMAIN_STATS_BALLOON)
+    if include_counters:
+        for (stats_type, _) in DOMAIN_COUNTERS.values():
+            stats_types |= stats_type
+    return stats_types
+
+def _domain_record(stats, include_counters):
+    active = stats.get('state.state') != libvirt.VIR_DOMAIN_SHUTOFF
+    record = {
+            'vcpus': stats.get('vcpu.maximum') if active else None,
+            'memory': round(stats['balloon.maximum']/1024) if (
+                active and 'balloon.maximum' in stats) else None,
+            'active': active}
+    if include_counters:
+        record.update({
+            counter: _sum_domain_counter(stats, key) if active else None
+            for counter, (_, key) in DOMAIN_COUNTERS.items()})
+    return record
+
+def _volume_record(volume):
+    info = volume.info()
+    return {
+            'capacity': round(info[1]/1024/1024),
+            'allocation': round(info[2]/1024/1024)}
+
+def parse_domain_interfaces(xml_desc):
+    """
+    Return (type, source, target device, MAC address) of each network or
+    bridge interface in a domain's XML. Only the <interface> elements are
+    kept, every other device is discarded as soon as it has been parsed.
+    """
+    ifaces = []
+    parser = XMLPullParser(events=('start', 'end'))
+    parser.feed(xml_desc)
+    path = []
+    for (event, elem) in parser.read_events():
+        if event == 'start':
+            path.append(elem.tag)
+            continue
+        path.pop()
+        if path != ['domain', 'devices']:
+            continue
+        iface_type = elem.get('type')
+        source = elem.find('source')
+        if (elem.tag == 'interface' and source is not None and
+                iface_type in ['network', 'bridge']):
+            mac = elem.find('mac')
+            target = elem.find('target')
+            ifaces.append((iface_type, source.get(iface_type),
+                           target.get('dev') if target is not None else 'none',
+                           mac.get('address')))
+        elem.clear()
+    parser.close()
+    return ifaces
+
+def _network_record(network, active=None):
+    if active is None:
+        active = bool(network.isActive())
+    return {
+            'bridge-name': network.bridgeName(),
+            'active': active,
+            'interfaces': []}
+
+
+class LazySection(MutableMapping):
+    """
+    A dict which is only loaded from the hypervisor when it is first
+    accessed. load() returns the initial contents. Once loaded, it is kept
+    up to date by the libvirt events and the actions which change it, or
+    reloaded by reset().
+
+    Updates made while it is loading (i.e. from an event) mean the loaded
+    contents may be stale, so they are returned but not kept.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._data = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _loaded(self):
+        with self._load_lock:
+            with self._lock:
+                if self._data is not None:
+                    return self._data
+                generation = self._generation
+            data = self._load()
+            with self._lock:
+                if generation == self._generation:
+                    self._data = data
+            return data
+
+    def is_loaded(self):
+        return self._data is not None
+
+    def reset(self):
+        with self._lock:
+            self._generation += 1
+            self._data = None
+
+    def set_if_loaded(self, key, value):
+        with self._lock:
+            self._generation += 1
+            if self._data is not None:
+                self._data[key] = value
+
+    def discard_if_loaded(self, key):
+        with self._lock:
+            self._generation += 1
+            if self._data is not None:
+                self._data.pop(key, None)
+
+    def __getitem__(self, key):
+        return self._loaded()[key]
+
+    def __setitem__(self, key, value):
+        self._loaded()[key] = value
+
+    def __delitem__(self, key):
+        del self._loaded()[key]
+
+    def __contains__(self, key):
+        return key in self._loaded()
+
+    def __iter__(self):
+        return iter(list(self._loaded()))
+
+    def __len__(self):
+        return len(self._loaded())
+
+    def __repr__(self):
+        return repr(self._data) if self.is_loaded() else '<not loaded>'
+
+
+class LibvirtConnection():
+    """
+    A long-lived connection to the libvirt daemon of one hypervisor, shared
+    by every action in the Python VM. Domain, network and storage pool
+    lifecycle events keep its caches current, so they can be trusted
+    without looking each object up again.
+
+    Libvirt has no volume events. Volumes are kept current by the volume
+    actions, and a pool's volumes are reloaded when the pool is refreshed.
+    """
+
+    def __init__(self, name, url, auth, log):
+        self.name = name
+        self._log = log
+        self.conn = libvirt.openAuth(url, auth, 0)
+        if self.conn is None:
+            raise Exception(f'Failed to open connection to {url}')
+        self.closed = False
+
+        self.domains = LazySection(self._load_domains)
+        self.volumes = LazySection(self._load_pools)  # by pool
+        self.networks = LazySection(self._load_networks)
+
+        # Interfaces parsed from each domain's XML, by domain UUID. The
+        # generation of a domain changes with every lifecycle event (i.e. it
+        # is redefined, or started and given new tap interfaces), and every
+        # device attached to or detached from the running domain
+        self._domain_interfaces = {}  # {uuid: (generation, interfaces)}
+        self._domain_generations = defaultdict(int)
+
+        self.conn.setKeepAlive(LIBVIRT_KEEPALIVE_INTERVAL,
+                               LIBVIRT_KEEPALIVE_COUNT)
+        self.conn.registerCloseCallback(self._close_callback, None)
+        self.conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                self._domain_callback, None)
+        for event_id in (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED,
+                         libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+            self.conn.domainEventRegisterAny(
+                    None, event_id, self._domain_device_callback, None)
+        self.conn.networkEventRegisterAny(
+                None, libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE,
+                self._network_callback, None)
+        self.conn.storagePoolEventRegisterAny(
+                None, libvirt.VIR_STORAGE_POOL_EVENT_ID_LIFECYCLE,
+                self._pool_callback, None)
+        self.conn.storagePoolEventRegisterAny(
+                None, libvirt.VIR_STORAGE_POOL_EVENT_ID_REFRESH,
+                self._pool_refresh_callback, None)
+
+    def _close_callback(self, _conn, reason, _):
+        self._log.info(f'[{self.name}] Libvirt connection closed ({reason})')
+        self.closed = True
+
+    # Callbacks run on the event loop thread, so they make no libvirt calls.
+    # Changed records are loaded again when they are next accessed.
+
+    def _domain_callback(self, _conn, domain, event, _detail, _):
+        self._domain_generations[domain.UUIDString()] += 1
+        if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+            self.domains.discard_if_loaded(domain.name())
+        else:
+            self.invalidate_domain(domain.name())
+
+    def _domain_device_callback(self, _conn, domain, _device_alias, _):
+        self._domain_generations[domain.UUIDString()] += 1
+
+    def _network_callback(self, _conn, network, event, _detail, _):
+        if event == libvirt.VIR_NETWORK_EVENT_UNDEFINED:
+            self.networks.discard_if_loaded(network.name())
+        else:
+            self.networks.set_if_loaded(network.name(), LazySection(
+                    partial(_network_record, network)))
+
+    def _pool_callback(self, _conn, pool, event, _detail, _):
+        if event == libvirt.VIR_STORAGE_POOL_EVENT_UNDEFINED:
+            self.volumes.discard_if_loaded(pool.name())
+        elif event == libvirt.VIR_STORAGE_POOL_EVENT_DEFINED:
+            self.volumes.set_if_loaded(pool.name(),
+                    LazySection(partial(self._load_volumes, pool)))
+
+    def _pool_refresh_callback(self, _conn, pool, _):
+        pool_volumes = self._get_loaded_pool_volumes(pool.name())
+        if pool_volumes is not None:
+            pool_volumes.reset()
+
+    def _load_domains(self):
+        return {domain.name(): _domain_record(stats, False)
+                for (domain, stats) in self.conn.getAllDomainStats(
+                    _domain_stats_types(False))}
+
+    def _load_domain_record(self, domain_name):
+        ((_, stats), ) = self.conn.domainListGetStats(
+                [self.conn.lookupByName(domain_name)],
+                _domain_stats_types(False))
+        return _domain_record(stats, False)
+
+    def invalidate_domain(self, domain_name):
+        """The domain is loaded again when it is next accessed"""
+        self.domains.set_if_loaded(domain_name, LazySection(
+                partial(self._load_domain_record, domain_name)))
+
+    def get_domain_interfaces(self):
+        """
+        Return {domain_name: [(type, source, target device, MAC address)]}.
+        Only the domains which have changed since they were last parsed are
+        fetched and parsed again.
+        """
+        domain_interfaces = {}
+        parsed = {}
+        for domain in self.conn.listAllDomains():
+            uuid = domain.UUIDString()
+            generation = self._domain_generations[uuid]
+            cached = self._domain_interfaces.get(uuid, None)
+            if cached is None or cached[0] != generation:
+                cached = (generation,
+                          parse_domain_interfaces(domain.XMLDesc(0)))
+            parsed[uuid] = cached
+            domain_interfaces[domain.name()] = cached[1]
+        self._domain_interfaces = parsed
+        return domain_interfaces
+
+    def _load_pools(self):
+        return {pool.name(): LazySection(partial(self._load_volumes, pool))
+                for pool in self.conn.listAllStoragePools()}
+
+    def _load_volumes(self, pool):
+        # Volume sizes are only read when they are accessed
+        return {volume.name(): LazySection(partial(_volume_record, volume))
+                for volume in pool.listAllVolumes()}
+
+    def _get_loaded_pool_volumes(self, pool_name):
+        if self.volumes.is_loaded() and pool_name in self.volumes:
+            pool_volumes = self.volumes[pool_name]
+            if pool_volumes.is_loaded():
+                return pool_volumes
+        return None
+
+    def _load_networks(self):
+        active = {network.name() for network in self.conn.listAllNetworks(
+                libvirt.VIR_CONNECT_LIST_NETWORKS_ACTIVE)}
+        return {network.name(): _network_record(
+                    network, network.name() in active)
+                for network in self.conn.listAllNetworks()}
+
+    def add_volume(self, pool_name, volume):
+        """Add a single volume, if the pool's volumes have been loaded"""
+        pool_volumes = self._get_loaded_pool_volumes(pool_name)
+        if pool_volumes is not None:
+            pool_volumes.set_if_loaded(volume.name(),
+                    LazySection(partial(_volume_record, volume)))
+
+    def remove_volume(self, pool_name, volume_name):
+        pool_volumes = self._get_loaded_pool_volumes(pool_name)
+        if pool_volumes is not None:
+            pool_volumes.discard_if_loaded(volume_name)
+
+
+_libvirt_connections = {}
+_libvirt_connections_lock = threading.Lock()
+
+def get_libvirt_connection(name, url, auth, log):
+    """
+    Return the shared connection to a hypervisor, opening it if this is the
+    first use, or if the previous connection has been closed.
+    """
+    start_event_loop()
+    with _libvirt_connections_lock:
+        connection = _libvirt_connections.get((name, url), None)
+        if connection is None or connection.closed:
+            log.info(f'[{name}] Opening libvirt connection')
+            connection = LibvirtConnection(name, url, auth, log)
+            _libvirt_connections[(name, url)] = connection
+        return connection
 
 
 class HypervisorLibvirt(Hypervisor):
@@ -10,10 +349,12 @@ class HypervisorLibvirt(Hypervisor):
     def __init__(self, hypervisor, log):
         super().__init__(hypervisor, log)
         self.conn = None
+        self._connection = None
         self.bridges = defaultdict(lambda: defaultdict(dict, interfaces=[]))
-        self.networks = {}
-        self.domains = {}
-        self.volumes = {}  # by pool
+        self.networks = None
+        self.domains = None
+        self.domain_counters = None
+        self.volumes = None  # by pool
 
         username_str = f'{self._username}@' if self._username else ''
 
@@ -51,63 +392,71 @@ class HypervisorLibvirt(Hypervisor):
                  libvirt.VIR_CRED_PASSPHRASE,
                  libvirt.VIR_CRED_NOECHOPROMPT
                 ], self._user_interaction_callback, None]
-        self.conn = libvirt.openAuth(self._url, auth, 0)
-        if self.conn is None:
-            raise Exception(f'Failed to open connection to {self._url}')
+        self._connection = get_libvirt_connection(
+                self.name, self._url, auth, self._log)
+        self.conn = self._connection.conn
+        self.domains = self._connection.domains
+        self.volumes = self._connection.volumes
+        self.networks = self._connection.networks
 
     def disconnect(self):
-        self.conn.close()
+        """The shared connection stays open for the next action"""
+        self.conn = None
 
-    def populate_cache(self):
-        self._log.info(f'[{self.name}] Populating libvirt connection cache')
-        self.populate_domains()
-        self.populate_volumes()
-        self.populate_networks()
+    def populate_domains(self, include_counters=False):
+        """
+        The state, vCPUs and memory of every domain are loaded into domains
+        when first used, and kept up to date by events. Optionally get a
+        snapshot of every domain which also includes the CPU time and the
+        block and network byte counters (see DOMAIN_COUNTERS), in a single
+        call, into domain_counters for capacity reporting.
+        """
+        self.domain_counters = {
+                domain.name(): _domain_record(stats, True)
+                for (domain, stats) in self.conn.getAllDomainStats(
+                    _domain_stats_types(True))} if include_counters else None
 
-    def populate_domains(self):
-        for domain in self.conn.listAllDomains():
-            active = domain.isActive()
-            self.domains[domain.name()] = {
-                    'vcpus': domain.maxVcpus() if active else None,
-                    'memory': round(domain.maxMemory()/1024) if active else None,
-                    'active': active}
+    def refresh_domain(self, domain_name):
+        """
+        Reload a domain changed by an action. The lifecycle event for the
+        change arrives asynchronously, and may not have been handled yet.
+        """
+        self._connection.invalidate_domain(domain_name)
+
+    def remove_domain(self, domain_name):
+        self.domains.discard_if_loaded(domain_name)
 
     def populate_volumes(self):
-        for pool in self.conn.listAllStoragePools():
-            pool_volumes = self.volumes[pool.name()] = {}
-            for volume in pool.listAllVolumes():
-                info = volume.info()
-                pool_volumes[volume.name()] = {
-                        'capacity': round(info[1]/1024/1024),
-                        'allocation': round(info[2]/1024/1024)}
+        """Volumes changed outside of the topology raise no events"""
+        self.volumes.reset()
 
-    def populate_networks(self, include_ifaces = False):
-        self.networks = {
-                network.name(): {
-                    'bridge-name': network.bridgeName(),
-                    'interfaces': []
-                } for network in self.conn.listAllNetworks()}
+    def add_volume(self, pool_name, volume):
+        self._connection.add_volume(pool_name, volume)
 
+    def remove_volume(self, pool_name, volume_name):
+        self._connection.remove_volume(pool_name, volume_name)
+
+    def populate_networks(self, include_ifaces = False):
         if not include_ifaces:
             return
 
-        for domain in self.conn.listAllDomains():
-            xml = fromstring(domain.XMLDesc(0))
-            ifaces = xml.find('devices').findall('interface')
-            for iface in ifaces:
-                iface_type = iface.get('type')
-                source = iface.find('source')
-                if source is not None and iface_type in ['network', 'bridge']:
-                    mac = iface.find('mac')
-                    target = iface.find('target')
-                    dev = target.get('dev') if target is not None else 'none'
-                    source_dict = getattr(self, f'{iface_type}s')
-                    name = source.get(iface_type)
-                    if name not in source_dict and iface_type == 'network':
-                        name = f'***missing*** {name}'
-                        if name not in source_dict:
-                            source_dict[name] = {'interfaces': []}
-                    source_dict[name]['interfaces'].append({
-                        'domain-name': domain.name(),
-                        'host-interface': dev,
-                        'mac-address': mac.get('address')})
+        # Interfaces are added to a copy, not to the shared cache
+        self.networks = {
+                network_name: {
+                    'bridge-name': network['bridge-name'],
+                    'interfaces': []
+                } for (network_name, network)
+                in self._connection.networks.items()}
+
+        for (domain_name, ifaces) in (
+                self._connection.get_domain_interfaces().items()):
+            for (iface_type, name, dev, mac_address) in ifaces:
+                source_dict = getattr(self, f'{iface_type}s')
+                if name not in source_dict and iface_type == 'network':
+                    name = f'***missing*** {name}'
+                    if name not in source_dict:
+                        source_dict[name] = {'interfaces': []}
+                source_dict[name]['interfaces'].append({
+                    'domain-name': domain_name,
+                    'host-interface': dev,
+                    'mac-address': mac_address})
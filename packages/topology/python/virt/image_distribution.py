@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""
+Distribution of base images to the hypervisors of a topology.
+
+Device volumes are created from a base image in the storage pool of the
+hypervisor the device is on. Before a topology is defined, every base image
+it uses is checked on each of its hypervisors, and copied to the hypervisors
+where it is missing from one which has it. The copies run in parallel, as a
+libvirt download stream from the source piped into an upload stream to the
+destination.
+
+Only the hypervisors the topology uses are checked, unless an image is on
+none of them, in which case the other hypervisors are looked at for a
+source. The source of a copy is identified by the SHA-256 checksum of its
+contents, computed on the hypervisor over the pooled SSH connection and
+memoized by path, size and modification time. Each image content is
+transferred to a hypervisor at most once: other base images with the same
+content are cloned from the first copy within the destination pool. Each
+copy is verified against the checksum of its source.
+"""
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import fromstring
+
+from virt.template import Templates
+
+DISTRIBUTION_WORKERS = 4
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+_checksums = {}  # {(hypervisor_name, path, size, mtime): sha256}
+_checksums_lock = threading.Lock()
+
+
+class ImageDistributor():
+    def __init__(self, hypervisor_mgr, log):
+        self._hypervisor_mgr = hypervisor_mgr
+        self._log = log
+        self._templates = Templates()
+        self._templates.load_template('templates', 'volume.xml')
+
+    def _get_volume(self, hypervisor_name, pool_name, image_name):
+        libvirt = self._hypervisor_mgr.get_libvirt(hypervisor_name)
+        if (libvirt and pool_name in libvirt.volumes and
+                image_name in libvirt.volumes[pool_name]):
+            return libvirt.conn.storagePoolLookupByName(
+                    pool_name).storageVolLookupByName(image_name)
+        return None
+
+    def get_checksum(self, hypervisor_name, volume):
+        """The SHA-256 checksum of a volume, calculated on its hypervisor"""
+        path = volume.path()
+        executor = self._hypervisor_mgr.get_ssh_executor(hypervisor_name)
+        result = executor.execute(f"stat -L -c '%s %Y' '{path}'")
+        if result['exit_code'] != 0:
+            raise Exception(f'[{hypervisor_name}] Cannot read image {path}: '
+                            f'{result["stderr"].strip()}')
+        (size, mtime) = result['stdout'].split()
+        key = (hypervisor_name, path, size, mtime)
+
+        with _checksums_lock:
+            checksum = _checksums.get(key, None)
+        if checksum is None:
+            result = executor.execute(f"sha256sum '{path}'",
+                    f'Calculating checksum of image {path}')
+            if result['exit_code'] != 0:
+                raise Exception(f'[{hypervisor_name}] Failed to calculate '
+                                f'checksum of {path}: '
+                                f'{result["stderr"].strip()}')
+            checksum = result['stdout'].split()[0]
+            with _checksums_lock:
+                _checksums[key] = checksum
+        return checksum
+
+    def _get_volume_xml(self, image_name, volume):
+        """The XML of a new volume with the capacity and format of volume"""
+        volume_format = fromstring(volume.XMLDesc(0)).find('target/format')
+        return self._templates.apply_template('volume.xml', {
+            'name': image_name,
+            'capacity': volume.info()[1],
+            'format-type': volume_format.get('type') if (
+                volume_format is not None) else 'raw'})
+
+    def _copy(self, source_name, source_volume, hypervisor_name, pool_name,
+              image_name):
+        """Copy a volume from one hypervisor to another, through streams"""
+        source = self._hypervisor_mgr.get_libvirt(source_name)
+        libvirt = self._hypervisor_mgr.get_libvirt(hypervisor_name)
+        pool = libvirt.conn.storagePoolLookupByName(pool_name)
+        volume = pool.createXML(
+                self._get_volume_xml(image_name, source_volume))
+
+        self._log.info(f'[{hypervisor_name}] Copying image {image_name} '
+                       f'from {source_name}')
+        download = source.conn.newStream()
+        upload = libvirt.conn.newStream()
+        try:
+            source_volume.download(download, 0, 0)
+            volume.upload(upload, 0, 0)
+            while True:
+                chunk = download.recv(TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.send(chunk)
+            download.finish()
+            upload.finish()
+        except Exception:
+            download.abort()
+            upload.abort()
+            volume.delete()
+            raise
+        libvirt.add_volume(pool_name, volume)
+        return volume
+
+    def _clone(self, hypervisor_name, pool_name, image_name, volume):
+        """Copy a volume within a hypervisor, for the same image content"""
+        libvirt = self._hypervisor_mgr.get_libvirt(hypervisor_name)
+        self._log.info(f'[{hypervisor_name}] Copying image {image_name} '
+                       f'from {volume.name()}')
+        pool = libvirt.conn.storagePoolLookupByName(pool_name)
+        clone = pool.createXMLFrom(
+                self._get_volume_xml(image_name, volume), volume)
+        libvirt.add_volume(pool_name, clone)
+        return clone
+
+    def _distribute(self, checksum, source_name, source_volume,
+                    hypervisor_name, images):
+        """
+        Copy one image content to a hypervisor, then clone it for each other
+        image (pool_name, image_name) with the same content.
+        """
+        ((pool_name, image_name), *other_images) = images
+        volume = self._copy(source_name, source_volume, hypervisor_name,
+                            pool_name, image_name)
+        copy_checksum = self.get_checksum(hypervisor_name, volume)
+        if copy_checksum != checksum:
+            volume.delete()
+            self._hypervisor_mgr.get_libvirt(hypervisor_name).remove_volume(
+                    pool_name, image_name)
+            raise Exception(f'[{hypervisor_name}] Checksum of copied image '
+                            f'{image_name} ({copy_checksum}) does not match '
+                            f'{source_name} ({checksum})')
+        for (other_pool_name, other_image_name) in other_images:
+            self._clone(hypervisor_name, other_pool_name, other_image_name,
+                        volume)
+
+    def _find_source(self, hypervisor_names, pool_name, image_name):
+        """Returns (hypervisor_name, volume) of an image, or None"""
+        for hypervisor_name in hypervisor_names:
+            try:
+                volume = self._get_volume(
+                        hypervisor_name, pool_name, image_name)
+            except Exception as exc: #pylint: disable=broad-except
+                self._log.warning(f'[{hypervisor_name}] Cannot look for '
+                                  f'base image {image_name}: {exc}')
+                continue
+            if volume is not None:
+                return (hypervisor_name, volume)
+        return None
+
+    def distribute(self, images):
+        """
+        Make sure each base image is on each hypervisor that needs it.
+        images is a set of (hypervisor_name, pool_name, image_name).
+        Hypervisors which do not need an image are only looked at for a
+        source, when none of those which need it have it.
+        """
+        required = defaultdict(set)  # {(pool_name, image_name): {hypervisor}}
+        for (hypervisor_name, pool_name, image_name) in images:
+            required[(pool_name, image_name)].add(hypervisor_name)
+
+        # {(checksum, hypervisor_name): (source, [(pool_name, image_name)])}
+        transfers = {}
+        for ((pool_name, image_name), needed_on) in required.items():
+            missing = {hypervisor_name for hypervisor_name in needed_on
+                       if self._get_volume(hypervisor_name, pool_name,
+                                           image_name) is None}
+            if not missing:
+                continue
+
+            other_hypervisors = sorted(set(
+                    self._hypervisor_mgr.get_hypervisors()) - needed_on)
+            source = self._find_source(
+                    sorted(needed_on - missing), pool_name, image_name
+                ) or self._find_source(
+                    other_hypervisors, pool_name, image_name)
+            if source is None:
+                raise Exception(f'Base image {image_name} is not in storage '
+                                f'pool {pool_name} on any hypervisor')
+
+            checksum = self.get_checksum(*source)
+            for hypervisor_name in sorted(missing):
+                transfers.setdefault((checksum, hypervisor_name),
+                        (source, []))[1].append((pool_name, image_name))
+
+        if not transfers:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(
+                DISTRIBUTION_WORKERS, len(transfers))) as executor:
+            futures = [executor.submit(self._distribute, checksum,
+                                       source_name, source_volume,
+                                       hypervisor_name, transfer_images)
+                       for ((checksum, hypervisor_name),
+                            ((source_name, source_volume), transfer_images))
+                       in transfers.items()]
+            for future in futures:
+                future.result()
@@ -0,0 +1,30 @@
+#!/usr/bin/python3
+"""
+Libvirt event loop for the Python VM.
+
+Libvirt only delivers events (i.e. domain lifecycle events) on connections
+opened after an event loop implementation has been registered, so
+start_event_loop() must be called before any connection is opened.
+"""
+import threading
+import libvirt
+
+_event_loop_lock = threading.Lock()
+_event_loop_thread = None
+
+
+def _run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
+
+
+def start_event_loop():
+    global _event_loop_thread #pylint: disable=global-statement
+    with _event_loop_lock:
+        if _event_loop_thread is None:
+            libvirt.virEventRegisterDefaultImpl()
+            _event_loop_thread = threading.Thread(
+                    target=_run_event_loop,
+                    name='LibvirtEventLoop-Thread',
+                    daemon=True)
+            _event_loop_thread.start()
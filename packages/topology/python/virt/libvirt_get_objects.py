@@ -2,6 +2,7 @@ from ncs.dp import Action
 from ncs import maagic
 from virt.hypervisor_libvirt import HypervisorLibvirt
 from virt.hypervisor_docker import HypervisorDocker
+from virt.topology_snapshot import compile_hypervisor
 
 
 def create_list_item(name, yang_list):
@@ -31,7 +32,7 @@ class LibvirtGetObjects(Action):
     @Action.action
     def cb_action(self, uinfo, name, kp, input, output, trans):
         self.log.info('action name: ', name)
-        hypervisor = maagic.get_node(trans, kp[1:])
+        hypervisor = compile_hypervisor(maagic.get_node(trans, kp[1:]))
         trans.maapi.install_crypto_keys()
 
         with HypervisorDocker(hypervisor, self.log) as docker_conn:
@@ -59,8 +60,10 @@ class LibvirtGetObjects(Action):
 
         with HypervisorLibvirt(hypervisor, self.log) as libvirt_conn:
             if name == 'domains':
-                libvirt_conn.populate_domains()
-                dict_dict_to_yang_list(libvirt_conn.domains, output.domain)
+                libvirt_conn.populate_domains(input.include_counters)
+                dict_dict_to_yang_list(libvirt_conn.domain_counters
+                        if input.include_counters else libvirt_conn.domains,
+                        output.domain)
 
             elif name == 'volumes':
                 libvirt_conn.populate_volumes()
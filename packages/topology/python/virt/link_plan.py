@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+"""
+Bulk plumbing of the container interfaces of a whole topology.
+
+ConnectionDocker plumbs one interface at a time as each device is started.
+The link plan instead works out every outstanding plumbing operation for
+all the containers on a hypervisor (veth pairs, TAP moves, bridge
+attachments and GENEVE tunnels) and renders them as 'ip -batch' input: one
+batch for the host namespace, applied first, and one for each container
+namespace. All the batches of a hypervisor are applied in a single SSH
+invocation.
+
+Operations are only planned for interfaces which are not already plumbed,
+according to the HostNetworkState of the hypervisor, so applying a plan is
+idempotent. A plan can be rendered without applying it (dry run). Once it is
+applied, the HostNetworkState is patched with the changes the plan made.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from virt.connection_docker import GENEVE_MTU
+
+HOST_NAMESPACE = 'host'
+APPLY_WORKERS = 8
+
+
+class LinkPlan():
+    """Plumbing operations for the containers on one hypervisor"""
+
+    def __init__(self, hypervisor_name, host_network_state):
+        self.hypervisor_name = hypervisor_name
+        self.host_ops = []
+        self.namespace_ops = {}  # {container_name: (pid, [ops])}
+        self.skipped = []
+        self._state = host_network_state
+        # [(HostNetworkState method, args)], patched in order once applied
+        self._state_changes = []
+
+    def _add_state_change(self, method, *args):
+        self._state_changes.append((method, args))
+
+    def _add_namespace_ops(self, container_name, pid, ops):
+        self.namespace_ops.setdefault(container_name, (pid, []))[1].extend(ops)
+
+    def _move_into_container(self, container_name, pid, host_iface,
+                             container_iface=None):
+        """Move a host interface into a container, renaming it if needed"""
+        self.host_ops.append(f'link set {host_iface} netns {pid}')
+        ops = []
+        if container_iface and container_iface != host_iface:
+            ops.append(f'link set {host_iface} name {container_iface}')
+        ops.append(f'link set {container_iface or host_iface} up')
+        self._add_namespace_ops(container_name, pid, ops)
+        self._add_state_change('remove_host_iface', host_iface)
+        self._add_state_change('add_container_iface',
+                               container_name, container_iface or host_iface)
+
+    def add_container_to_container_link(self, this_end, other_end):
+        ends = [(end, self._state.get_container_pid(end.device_name))
+                for end in (this_end, other_end)
+                if not self._state.container_iface_exists(
+                    end.device_name, end.interface_name)]
+        if not ends:
+            return
+
+        waiting = [end.device_name for (end, pid) in ends if pid is None]
+        if waiting:
+            self.skipped.append(
+                f'{this_end.device_name}:{this_end.interface_name} <--> '
+                f'{other_end.device_name}:{other_end.interface_name}: '
+                f'waiting for {", ".join(waiting)}')
+            return
+
+        # The veth pair exists if either end is still on the host. An end
+        # missing from both the host and its container when the other end
+        # exists means the pair is broken, which is left to a restart
+        missing = [end.interface_name for (end, _) in ends
+                   if not self._state.host_iface_exists(end.interface_name)]
+        if len(missing) == 2:
+            self.host_ops.append(
+                f'link add {this_end.interface_name} type veth '
+                f'peer name {other_end.interface_name}')
+            self._add_state_change('add_host_iface', this_end.interface_name)
+            self._add_state_change('add_host_iface', other_end.interface_name)
+        elif missing:
+            self.skipped.append(f'{missing[0]}: interface does not exist')
+            return
+
+        for (end, pid) in ends:
+            self._move_into_container(
+                    end.device_name, pid, end.interface_name)
+
+    def add_tap_to_container_link(self, container_end, vm_end):
+        container_name = container_end.device_name
+        container_iface = container_end.interface_name
+        tap_iface = vm_end.interface_name
+
+        if self._state.container_iface_exists(container_name, container_iface):
+            return
+
+        pid = self._state.get_container_pid(container_name)
+        if pid is None or not self._state.host_iface_exists(tap_iface):
+            self.skipped.append(
+                f'{tap_iface} --> {container_name}:{container_iface}: '
+                f'waiting for ' + (container_name if pid is None else
+                                   f'tap interface {tap_iface}'))
+            return
+
+        self.host_ops.append(f'link set {tap_iface} down')
+        self._move_into_container(
+                container_name, pid, tap_iface, container_iface)
+
+    def add_overlay_interface(self, container_end, geneve):
+        container_name = container_end.device_name
+        container_iface = container_end.interface_name
+
+        if self._state.container_iface_exists(container_name, container_iface):
+            return
+
+        pid = self._state.get_container_pid(container_name)
+        if pid is None:
+            self.skipped.append(f'{container_name}:{container_iface} <--> '
+                                f'{geneve.interface_name}: '
+                                f'waiting for {container_name}')
+            return
+
+        if not self._state.host_iface_exists(geneve.interface_name):
+            self.host_ops += [
+                f'link add {geneve.interface_name} type geneve '
+                    f'id {geneve.vni} remote {geneve.remote_ip_address}',
+                f'link set {geneve.interface_name} mtu {GENEVE_MTU}',
+                f'link set {geneve.interface_name} up' ]
+            self._add_state_change('add_host_iface', geneve.interface_name)
+
+        self.host_ops.append(
+            f'link add link {geneve.interface_name} '
+                f'name {container_iface} type macvtap mode bridge')
+        self._add_state_change('add_host_iface', container_iface)
+        self._move_into_container(container_name, pid, container_iface)
+
+    def add_bridge_interface(self, container_end, bridge_name):
+        container_name = container_end.device_name
+        container_iface = container_end.interface_name
+        host_iface = f'{container_iface}-host'
+
+        if self._state.container_iface_exists(container_name, container_iface):
+            return
+
+        pid = self._state.get_container_pid(container_name)
+        if pid is None:
+            self.skipped.append(f'{container_name}:{container_iface} <--> '
+                                f'bridge:{bridge_name}: '
+                                f'waiting for {container_name}')
+            return
+
+        self.host_ops += [
+            f'link add {container_iface} type veth peer name {host_iface}',
+            f'link set {host_iface} master {bridge_name}',
+            f'link set {host_iface} up' ]
+        self._add_state_change('add_host_iface', container_iface)
+        self._add_state_change('add_host_iface', host_iface)
+        self._move_into_container(container_name, pid, container_iface)
+
+    def num_operations(self):
+        return len(self.host_ops) + sum(
+                len(ops) for (_, ops) in self.namespace_ops.values())
+
+    def render(self):
+        """Returns {namespace: ip -batch input}, host namespace first"""
+        batches = {}
+        if self.host_ops:
+            batches[HOST_NAMESPACE] = '\n'.join(self.host_ops) + '\n'
+        for (container_name, (_, ops)) in self.namespace_ops.items():
+            batches[container_name] = '\n'.join(ops) + '\n'
+        return batches
+
+    def get_commands(self):
+        """The commands applying all batches, to run as one SSH batch"""
+        commands = []
+        if self.namespace_ops:
+            commands.append('mkdir -p /var/run/netns')
+            commands += [f'ln -sf /proc/{pid}/ns/net /var/run/netns/{pid}'
+                         for (pid, _) in self.namespace_ops.values()]
+        for (namespace, batch) in self.render().items():
+            netns = '' if namespace == HOST_NAMESPACE else (
+                    f'-n {self.namespace_ops[namespace][0]} ')
+            commands.append(f"ip {netns}-batch - <<'EOF'\n{batch}EOF")
+        return commands
+
+    def apply(self, executor):
+        """
+        Apply all batches, then patch the host network state. If applying
+        fails part way, the host interfaces and the containers of the plan
+        are marked stale instead.
+        """
+        if not self.num_operations():
+            return
+        try:
+            executor.execute(self.get_commands(),
+                    f'Applying {self.num_operations()} plumbing operations')
+        except Exception:
+            self._state.invalidate_host_ifaces()
+            for container_name in self.namespace_ops:
+                self._state.invalidate_container(container_name)
+            raise
+        for (method, args) in self._state_changes:
+            getattr(self._state, method)(*args)
+
+
+def build_link_plans(device_ids, hypervisor_mgr, domain_mgr, connection_mgr):
+    """
+    Plan the plumbing of every container interface of the given devices.
+
+    Returns {hypervisor_name: LinkPlan}
+    """
+    plans = {}
+    planned_links = set()
+
+    def _get_plan(hypervisor_name):
+        if hypervisor_name not in plans:
+            plans[hypervisor_name] = LinkPlan(hypervisor_name,
+                    hypervisor_mgr.get_host_network_state(hypervisor_name))
+        return plans[hypervisor_name]
+
+    for device_id in device_ids:
+        hypervisor_name = hypervisor_mgr.get_device_hypervisor(device_id)
+        if (not domain_mgr.is_container(device_id) or
+                not hypervisor_mgr.is_real(hypervisor_name)):
+            continue
+
+        for iface_id in connection_mgr.get_device_iface_ids(device_id):
+            this_end = connection_mgr.get_interface_host_info(
+                    device_id, iface_id)
+            if this_end is None or this_end.interface_name is None:
+                continue
+
+            (other_device_id, other_iface_id) = \
+                    connection_mgr.get_interface_direct_link_info(
+                            device_id, iface_id)
+
+            if other_device_id:
+                link = frozenset(((device_id, iface_id),
+                                  (other_device_id, other_iface_id)))
+                if link in planned_links:
+                    continue
+                planned_links.add(link)
+
+                other_end = connection_mgr.get_interface_host_info(
+                        other_device_id, other_iface_id)
+                if other_end is None or other_end.interface_name is None:
+                    _get_plan(hypervisor_name).skipped.append(
+                            f'{this_end.device_name}:{this_end.interface_name}'
+                            f' <--> device {other_device_id} interface '
+                            f'{other_iface_id}: no host interface')
+                elif other_end.is_container:
+                    _get_plan(hypervisor_name).add_container_to_container_link(
+                            this_end, other_end)
+                else:
+                    _get_plan(hypervisor_name).add_tap_to_container_link(
+                            this_end, other_end)
+                continue
+
+            geneve = connection_mgr.get_interface_geneve_info(
+                    device_id, iface_id)
+            if geneve:
+                _get_plan(hypervisor_name).add_overlay_interface(
+                        this_end, geneve)
+                continue
+
+            bridge = connection_mgr.get_interface_any_bridge_info(
+                    device_id, iface_id)
+            if bridge:
+                _get_plan(hypervisor_name).add_bridge_interface(
+                        this_end, bridge)
+
+    return plans
+
+
+def apply_link_plans(plans, hypervisor_mgr):
+    """Apply the plans of each hypervisor in parallel"""
+    plans = [plan for plan in plans.values() if plan.num_operations()]
+    if not plans:
+        return
+    with ThreadPoolExecutor(max_workers=min(
+            APPLY_WORKERS, len(plans))) as executor:
+        futures = [executor.submit(plan.apply,
+                hypervisor_mgr.get_ssh_executor(plan.hypervisor_name))
+                   for plan in plans]
+        for future in futures:
+            future.result()
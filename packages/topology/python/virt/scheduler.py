@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+"""
+Dependency-aware scheduling of per-device actions.
+
+Device actions are added as tasks with the keys of the tasks they must wait
+for. Independent tasks are run concurrently on a bounded set of worker
+threads, with an optional limit on the number of tasks running at the same
+time on each hypervisor.
+"""
+import threading
+import traceback
+from collections import defaultdict
+
+MAX_WORKERS = 16
+
+
+class SchedulerTask():
+    #pylint: disable=too-few-public-methods
+    def __init__(self, key, function, hypervisor, depends_on):
+        self.key = key
+        self.function = function
+        self.hypervisor = hypervisor
+        self.depends_on = set(depends_on)
+        self.dependents = []
+
+
+class DeviceScheduler():
+    """
+    Runs tasks in dependency order on a pool of worker threads.
+
+    Tasks can only depend on tasks that have already been added, so the task
+    graph is always acyclic. Each worker thread enters worker_context() once
+    and passes the value it yields to every task it runs. This allows each
+    worker to hold thread specific resources (i.e. a MAAPI transaction).
+
+    If a task raises an exception, no new tasks are started, running tasks
+    are allowed to finish and the first exception is re-raised by run().
+    """
+
+    def __init__(self, log, worker_context, max_workers=MAX_WORKERS):
+        self._log = log
+        self._worker_context = worker_context
+        self._max_workers = max_workers
+        self._tasks = {}
+        self._hypervisor_limits = {}
+
+        self._condition = threading.Condition()
+        self._ready = []
+        self._remaining = 0
+        self._running = defaultdict(int)
+        self._error = None
+
+    def set_hypervisor_limit(self, hypervisor_name, limit):
+        self._hypervisor_limits[hypervisor_name] = limit
+
+    def add_task(self, key, function, hypervisor=None, depends_on=()):
+        if key in self._tasks:
+            raise Exception(f'Task {key} has already been scheduled')
+
+        depends_on = [dep for dep in depends_on if dep != key]
+        missing = [dep for dep in depends_on if dep not in self._tasks]
+        if missing:
+            raise Exception(
+                    f'Task {key} depends on unknown tasks {missing}')
+
+        task = SchedulerTask(key, function, hypervisor, depends_on)
+        for dep in task.depends_on:
+            self._tasks[dep].dependents.append(task)
+        self._tasks[key] = task
+
+    def _hypervisor_available(self, hypervisor):
+        limit = self._hypervisor_limits.get(hypervisor)
+        return limit is None or self._running[hypervisor] < limit
+
+    def _next_task(self):
+        with self._condition:
+            while True:
+                if self._error is not None or self._remaining == 0:
+                    return None
+                for task in self._ready:
+                    if self._hypervisor_available(task.hypervisor):
+                        self._ready.remove(task)
+                        self._running[task.hypervisor] += 1
+                        return task
+                self._condition.wait()
+
+    def _task_complete(self, task, error=None):
+        with self._condition:
+            self._running[task.hypervisor] -= 1
+            self._remaining -= 1
+            if error is not None:
+                if self._error is None:
+                    self._error = error
+            else:
+                for dependent in task.dependents:
+                    dependent.depends_on.discard(task.key)
+                    if not dependent.depends_on:
+                        self._ready.append(dependent)
+            self._condition.notify_all()
+
+    def _worker(self):
+        try:
+            with self._worker_context() as context:
+                while True:
+                    task = self._next_task()
+                    if task is None:
+                        return
+                    try:
+                        task.function(context)
+                    except Exception as err: #pylint: disable=broad-except
+                        self._log.error(f'Task {task.key} failed: {err}')
+                        self._log.debug(traceback.format_exc())
+                        self._task_complete(task, err)
+                    else:
+                        self._task_complete(task)
+        except Exception as err: #pylint: disable=broad-except
+            self._log.error(f'Scheduler worker failed: {err}')
+            with self._condition:
+                if self._error is None:
+                    self._error = err
+                self._condition.notify_all()
+
+    def run(self):
+        if not self._tasks:
+            return
+
+        self._ready = [task for task in self._tasks.values()
+                       if not task.depends_on]
+        self._remaining = len(self._tasks)
+        self._error = None
+
+        num_workers = min(self._max_workers, len(self._tasks))
+        self._log.info(f'Scheduling {len(self._tasks)} tasks '
+                       f'on {num_workers} workers')
+
+        workers = [threading.Thread(
+                        target=self._worker, name=f'DeviceScheduler-{idx}')
+                   for idx in range(num_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+"""
+Wait for domains and containers to stop using libvirt domain lifecycle
+events and the container status changes reported by the docker events
+stream (see ContainerStateTable), instead of polling each device.
+"""
+import threading
+import time
+import libvirt
+
+from virt.hypervisor_docker import ACTIVE_CONTAINER_STATES
+
+SHUTDOWN_TIMEOUT = 60
+
+
+class ShutdownWaiter():
+    """
+    Tracks a set of devices that are shutting down. Each device is watched
+    with its own deadline, from the shutdown-timeout of its device
+    definition (or the default timeout). wait() returns as soon as the last
+    device has stopped, or its deadline has passed.
+
+    A device is always checked once after its event source is subscribed,
+    so a device that stops before (or while) it is being watched is not
+    missed.
+    """
+
+    def __init__(self, log, timeout=SHUTDOWN_TIMEOUT):
+        self._log = log
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._deadlines = {}  # {device_name: deadline}
+        self._libvirt_callbacks = {}  # {hypervisor_name: (conn, callback_id)}
+        self._docker_hypervisors = {}  # {hypervisor_name: hypervisor}
+
+    def _watch(self, device_name, timeout):
+        with self._condition:
+            self._deadlines[device_name] = time.monotonic() + (
+                    timeout if timeout is not None else self._timeout)
+
+    def _stopped(self, device_name):
+        with self._condition:
+            if self._deadlines.pop(device_name, None) is not None:
+                self._log.info(f'{device_name} has stopped')
+                self._condition.notify_all()
+
+    def _libvirt_lifecycle_callback(self, _conn, domain, event, _detail, _):
+        if event == libvirt.VIR_DOMAIN_EVENT_STOPPED:
+            self._stopped(domain.name())
+
+    def watch_libvirt(self, device_name, hypervisor, timeout=None):
+        self._watch(device_name, timeout)
+        if hypervisor.name not in self._libvirt_callbacks:
+            self._libvirt_callbacks[hypervisor.name] = (
+                    hypervisor.conn,
+                    hypervisor.conn.domainEventRegisterAny(
+                        None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                        self._libvirt_lifecycle_callback, None))
+
+        if not hypervisor.domains[device_name]['active']:
+            self._stopped(device_name)
+
+    def _docker_container_listener(self, container_name, status):
+        if status not in ACTIVE_CONTAINER_STATES:
+            self._stopped(container_name)
+
+    def watch_docker(self, device_name, hypervisor, timeout=None):
+        self._watch(device_name, timeout)
+        if hypervisor.name not in self._docker_hypervisors:
+            self._docker_hypervisors[hypervisor.name] = hypervisor
+            hypervisor.add_container_listener(self._docker_container_listener)
+
+        if not hypervisor.is_active(device_name):
+            self._stopped(device_name)
+
+    def close(self):
+        for (conn, callback_id) in self._libvirt_callbacks.values():
+            conn.domainEventDeregisterAny(callback_id)
+        self._libvirt_callbacks.clear()
+        for hypervisor in self._docker_hypervisors.values():
+            hypervisor.remove_container_listener(
+                    self._docker_container_listener)
+        self._docker_hypervisors.clear()
+
+    def wait(self):
+        """
+        Block until every watched device has stopped or passed its deadline.
+        Returns a sorted list of the devices that missed their deadline.
+        """
+        try:
+            with self._condition:
+                while self._deadlines:
+                    now = time.monotonic()
+                    if all(deadline <= now
+                           for deadline in self._deadlines.values()):
+                        break
+                    self._condition.wait(min(
+                        deadline - now
+                        for deadline in self._deadlines.values()
+                        if deadline > now))
+                return sorted(self._deadlines)
+        finally:
+            self.close()
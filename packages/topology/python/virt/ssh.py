@@ -1,15 +1,143 @@
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import paramiko
 
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_IDLE_TIMEOUT = 600
+SSH_EVICTION_INTERVAL = 60
+
 
 class CommandExecutionError(Exception):
     """Raised when command execution fails"""
 
+
+class _PooledClient():
+    def __init__(self):
+        self.client = None
+        self.idle_timeout = SSH_IDLE_TIMEOUT
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.lock = threading.Lock()
+
+    def is_active(self):
+        transport = self.client.get_transport() if self.client else None
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
+
+
+class SshConnectionPool():
+    """
+    Process-wide pool of SSH connections, keyed by (host, username,
+    password), so that a changed password gets its own connection rather than
+    closing one which may be in use.
+
+    Hypervisor objects are created for every action, so connections are kept
+    here to be reused by later actions. Connections are kept alive with SSH
+    keepalives, reconnected when they are found to be closed, and closed by a
+    background thread once they have been idle for their idle timeout.
+    """
+
+    def __init__(self, eviction_interval=SSH_EVICTION_INTERVAL):
+        self._eviction_interval = eviction_interval
+        self._clients = {}  # {(host, username, password): _PooledClient}
+        self._lock = threading.Lock()
+        self._eviction_thread = None
+
+    def _connect(self, host, username, password, log):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        log.debug(f'Establishing SSH connection to {host}')
+
+        client.connect(
+            host,
+            username=username,
+            password=password,
+            timeout=10,
+            look_for_keys=True if not password else False
+        )
+        client.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
+
+        log.debug(f'SSH connection established to {host}')
+        return client
+
+    def _get_entry(self, host, username, password):
+        with self._lock:
+            if self._eviction_thread is None:
+                self._eviction_thread = threading.Thread(
+                        target=self._evict_idle_clients,
+                        name='SshConnectionPool-Thread',
+                        daemon=True)
+                self._eviction_thread.start()
+            return self._clients.setdefault(
+                    (host, username, password), _PooledClient())
+
+    @contextmanager
+    def client(self, host, username, password, log,
+               idle_timeout=SSH_IDLE_TIMEOUT):
+        """
+        Yield a connected paramiko SSHClient for the host, connecting (or
+        reconnecting) if necessary. The client is not evicted while in use.
+        """
+        entry = self._get_entry(host, username, password)
+        with entry.lock:
+            if not entry.is_active():
+                entry.close()
+                entry.client = self._connect(host, username, password, log)
+            entry.idle_timeout = idle_timeout
+            entry.in_use += 1
+            client = entry.client
+        try:
+            yield client
+        finally:
+            with entry.lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def reconnect(self, host, username, password, log, failed_client):
+        """
+        Replace a client which failed to open a channel. Other users of the
+        same client may also call this, only the first one reconnects.
+        """
+        entry = self._get_entry(host, username, password)
+        with entry.lock:
+            if entry.client is failed_client:
+                entry.close()
+                entry.client = self._connect(host, username, password, log)
+            return entry.client
+
+    def _evict_idle_clients(self):
+        while True:
+            time.sleep(self._eviction_interval)
+            with self._lock:
+                entries = list(self._clients.values())
+            for entry in entries:
+                with entry.lock:
+                    if (entry.client and not entry.in_use and
+                            time.monotonic() - entry.last_used >
+                            entry.idle_timeout):
+                        entry.close()
+
+
+ssh_pool = SshConnectionPool()
+
+
 class SshExecutor:
     """
-    Maintains a persistent SSH connection to a single host.
+    Executes commands on a single host, over a connection shared through
+    the process-wide SshConnectionPool.
     """
 
-    def __init__(self, name, log, host, username, password=None):
+    def __init__(self, name, log, host, username, password=None,
+                 idle_timeout=SSH_IDLE_TIMEOUT):
         """
         Args:
             name: Name for logging purposes (e.g. hypervisor name)
@@ -17,35 +145,36 @@ class SshExecutor:
             host: Hypervisor hostname or IP
             username: SSH username
             password: SSH password (optional, will use SSH keys if None)
+            idle_timeout: Seconds before the unused connection is closed
         """
         self._name = name
         self._host = host
         self._username = username
         self._password = password
+        self._idle_timeout = idle_timeout
         self._log = log
-        self._client = None
-        self._connected = False
 
-    def connect(self):
-        if self._connected and self._client:
-            return
+    @contextmanager
+    def _client(self):
+        with ssh_pool.client(self._host, self._username, self._password,
+                             self._log, self._idle_timeout) as client:
+            yield client
 
-        self._client = paramiko.SSHClient()
-        self._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        self._log.debug(f'Establishing SSH connection to {self._host}')
-
-        self._client.connect(
-            self._host,
-            username=self._username,
-            password=self._password,
-            timeout=10,
-            look_for_keys=True if not self._password else False
-        )
-
-        self._connected = True
-
-        self._log.debug(f'SSH connection established to {self._host}')
+    def _exec_command(self, client, command):
+        """
+        Open a channel and run a command. If the channel cannot be opened the
+        connection has been lost, so reconnect and try once more. Commands
+        are never retried once they have been started.
+        """
+        try:
+            return client.exec_command(command)
+        except (paramiko.SSHException, EOFError, OSError):
+            self._log.debug(
+                    f'[{self._name}] SSH connection to {self._host} lost, '
+                    f'reconnecting')
+            client = ssh_pool.reconnect(self._host, self._username,
+                    self._password, self._log, client)
+            return client.exec_command(command)
 
     def execute(self, commands, description=None):
         """
@@ -55,6 +184,8 @@ class SshExecutor:
         If executing a single command (for example to check the
         existence of an interface), then a failure may be expected and will
         not generate a warning.
+        A list of commands is run as a single script over one channel (see
+        _execute_batch), stopping at the first command that fails.
 
         Args:
             commands: Single command string or list of commands
@@ -68,47 +199,93 @@ class SshExecutor:
                 'exit_code': int
             }
         """
-        self.connect()  # No-op if already connected
-
-        single_command = isinstance(commands, str)
-        if single_command:
-            commands = [commands]
-
         if self._log and description:
             self._log.info(f'[{self._name}] {description}')
 
-        results = []
-        for cmd in commands:
-            if self._log:
-                self._log.debug(f'[{self._name}] Executing: {cmd}')
+        if not isinstance(commands, str):
+            return self._execute_batch(commands)
+
+        if self._log:
+            self._log.debug(f'[{self._name}] Executing: {commands}')
 
-            _, stdout, stderr = self._client.exec_command(cmd)
+        with self._client() as client:
+            _, stdout, stderr = self._exec_command(client, commands)
 
             # Wait for command to complete and get results
             exit_code = stdout.channel.recv_exit_status()
             stdout_data = stdout.read().decode('utf-8')
             stderr_data = stderr.read().decode('utf-8')
 
+        return {
+            'stdout': stdout_data,
+            'stderr': stderr_data,
+            'exit_code': exit_code
+        }
+
+    def _execute_batch(self, commands):
+        """
+        Run a list of commands as one script over a single channel.
+
+        Each command's output is framed by marker lines on stdout and stderr,
+        so the results can be split per command. The script stops at the
+        first command that fails, like running the commands one at a time.
+        """
+        if not commands:
+            return []
+
+        marker = f'#batch-{uuid.uuid4().hex}'
+        script = ''
+        for idx, cmd in enumerate(commands):
+            if self._log:
+                self._log.debug(f'[{self._name}] Executing: {cmd}')
+            script += (
+                f"printf '%s\\n' '{marker} begin {idx}'\n"
+                f"printf '%s\\n' '{marker} begin {idx}' >&2\n"
+                f"{{ {cmd}\n}} </dev/null\n"
+                f"rc=$?\n"
+                f"printf '\\n%s\\n' \"{marker} end {idx} $rc\"\n"
+                f"printf '\\n%s\\n' '{marker} end {idx}' >&2\n"
+                f"[ $rc -eq 0 ] || exit $rc\n")
+
+        with self._client() as client:
+            stdin, stdout, stderr = self._exec_command(client, 'sh -s')
+            stdin.write(script)
+            stdin.channel.shutdown_write()
+
+            # Wait for the script to complete and get results
+            stdout.channel.recv_exit_status()
+            stdout_data = stdout.read().decode('utf-8')
+            stderr_data = stderr.read().decode('utf-8')
+
+        marker = re.escape(marker)
+        stderr_results = dict(re.findall(
+            f'{marker} begin (\\d+)\n(.*?)\n{marker} end \\1\n',
+            stderr_data, re.DOTALL))
+
+        results = []
+        for (idx, output, exit_code) in re.findall(
+                f'{marker} begin (\\d+)\n(.*?)\n{marker} end \\1 (\\d+)\n',
+                stdout_data, re.DOTALL):
             results.append({
-                'stdout': stdout_data,
-                'stderr': stderr_data,
-                'exit_code': exit_code
+                'stdout': output,
+                'stderr': stderr_results.get(idx, ''),
+                'exit_code': int(exit_code)
             })
 
-            if exit_code != 0 and not single_command:
-                raise CommandExecutionError(
-                    f'[{self._name}] Command failed (exit {exit_code}): {cmd}\n'
-                    f'stderr: {stderr_data}'
-                )
+        if len(results) < len(commands) and (
+                not results or results[-1]['exit_code'] == 0):
+            raise CommandExecutionError(
+                f'[{self._name}] Command batch did not complete: '
+                f'{commands[len(results)]}\n'
+                f'stderr: {stderr_data}'
+            )
 
-        return results[0] if single_command else results
+        if results[-1]['exit_code'] != 0:
+            raise CommandExecutionError(
+                f'[{self._name}] Command failed '
+                f'(exit {results[-1]["exit_code"]}): '
+                f'{commands[len(results) - 1]}\n'
+                f'stderr: {results[-1]["stderr"]}'
+            )
 
-    def close(self):
-        if self._client:
-            self._log.debug(f'Closing SSH connection to {self._host}')
-            self._client.close()
-            self._client = None
-            self._connected = False
-
-    def __del__(self):
-        self.close()
+        return results
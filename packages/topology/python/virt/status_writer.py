@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""
+Batched writes of topology status leaves.
+
+During a topology action every device, interface and network writes a few
+status leaves. Writing each of them in its own transaction makes the number
+of transactions grow with the size of the topology. The StatusWriter queues
+the writes instead, keeps only the last value written to each leaf and
+applies the queue in one transaction per datastore, either when the flush
+interval expires or when the batch ends. Writes which fail to be applied are
+queued again, so they are retried by the next flush.
+
+The writer is process-wide: while any action has a batch open, the status
+writes of every action are queued, and are applied by the periodic flush or
+by whichever batch ends first. Code which reads status leaves calls flush()
+first. An error from a periodic flush is raised by the next batch to end.
+"""
+import threading
+from contextlib import contextmanager
+
+from ncs import maapi, RUNNING, OPERATIONAL
+
+FLUSH_INTERVAL = 2
+
+
+class StatusWriter():
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self._flush_interval = flush_interval
+        self._queue_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._queue = {}  # {(db, path): value}
+        self._active = 0
+        self._stop_event = None
+        self._error = None
+
+    def is_active(self):
+        return self._active > 0
+
+    def set(self, path, value, db=RUNNING):
+        """Queue a leaf write. A value of None deletes the leaf."""
+        with self._queue_lock:
+            # Re-insert so the queue keeps the order of the last writes
+            self._queue.pop((db, path), None)
+            self._queue[(db, path)] = value
+
+    def _apply(self, db, writes):
+        with maapi.single_write_trans('admin', 'python', db=db) as trans:
+            for path, value in writes:
+                try:
+                    if value is None:
+                        trans.safe_delete(path)
+                    else:
+                        trans.set_elem(value, path)
+                except Exception: #pylint: disable=broad-except
+                    if db != RUNNING:
+                        raise
+            trans.apply()
+
+    def flush(self):
+        """
+        Apply the queued writes. If applying fails, the writes which were not
+        applied are queued again, unless a newer value has been queued for
+        the same leaf meanwhile, and the error is raised.
+        """
+        with self._flush_lock:
+            with self._queue_lock:
+                queue, self._queue = self._queue, {}
+            try:
+                for db in (RUNNING, OPERATIONAL):
+                    writes = [(path, value)
+                              for (write_db, path), value in queue.items()
+                              if write_db == db]
+                    if writes:
+                        self._apply(db, writes)
+                        for (path, _) in writes:
+                            del queue[(db, path)]
+            except Exception:
+                with self._queue_lock:
+                    # The writes queued since are newer, so are kept last
+                    for (key, value) in self._queue.items():
+                        queue.pop(key, None)
+                        queue[key] = value
+                    self._queue = queue
+                raise
+
+    def _flush_periodically(self, stop_event):
+        while not stop_event.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as err: #pylint: disable=broad-except
+                self._error = err
+
+    def _start(self):
+        with self._queue_lock:
+            self._active += 1
+            if self._active == 1:
+                self._stop_event = threading.Event()
+                threading.Thread(
+                        target=self._flush_periodically,
+                        args=(self._stop_event,),
+                        name='StatusWriter-Thread',
+                        daemon=True).start()
+
+    def _stop(self):
+        with self._queue_lock:
+            self._active -= 1
+            if self._active == 0:
+                self._stop_event.set()
+
+    @contextmanager
+    def batch(self):
+        """
+        Queue status writes until the end of the with block. Batches can be
+        nested or run concurrently (i.e. by parallel actions), each one
+        flushes the queue when it ends.
+        """
+        self._start()
+        try:
+            yield self
+        finally:
+            self._stop()
+            self.flush()
+            error, self._error = self._error, None
+            if error is not None:
+                raise error
+
+
+status_writer = StatusWriter()
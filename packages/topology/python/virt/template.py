@@ -1,5 +1,12 @@
 #!/usr/bin/python3
-from collections import defaultdict
+"""
+Templates for the libvirt XML, day0 files and device definitions.
+
+Template files are compiled once per process into a template registry shared
+by all builders, and compiled again only when the file is modified. The
+placeholders of a template are checked when it is compiled, so an invalid
+template fails when it is loaded rather than when it is applied.
+"""
 from xml.etree.ElementTree import fromstring, tostring
 from xml.dom.minidom import parseString
 
@@ -7,6 +14,7 @@ import os
 import re
 import string
 import json
+import threading
 
 PYTHON_DIR = os.path.dirname(__file__)
 
@@ -20,6 +28,66 @@ class Template(string.Template):
     braceidpattern = '(?a:[_a-z\-][_a-z0-9\-]*)'
 
 
+class CompiledTemplate(Template):
+    """A template file, with the names of its placeholders"""
+
+    def __init__(self, template, filename):
+        super().__init__(template)
+        self.filename = filename
+        self.is_xml = os.path.splitext(filename)[1] == '.xml'
+        self.placeholders = self._get_placeholders()
+
+    def _get_placeholders(self):
+        placeholders = set()
+        for match in self.pattern.finditer(self.template):
+            if match.group('invalid') is not None:
+                position = match.start('invalid')
+                line = self.template.count('\n', 0, position) + 1
+                column = position - self.template.rfind('\n', 0, position)
+                raise Exception(f'Invalid placeholder in template '
+                                f'{self.filename}: line {line}, col {column}')
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                placeholders.add(name)
+        return frozenset(placeholders)
+
+    def apply(self, variables):
+        """Substitute the variables, with an empty string for any missing"""
+        return self.substitute({name: variables.get(name, '')
+                                for name in self.placeholders})
+
+
+class TemplateRegistry():
+    """The compiled template files, by path, shared by all builders"""
+
+    def __init__(self):
+        self._templates = {}  # {file_path: (mtime, CompiledTemplate)}
+        self._lock = threading.Lock()
+
+    def get_template(self, path, filename):
+        """The compiled template of a file, compiling it if it has changed"""
+        file_path = f'{PYTHON_DIR}/{path}/{filename}'
+        mtime = os.stat(file_path).st_mtime_ns
+        with self._lock:
+            (compiled_mtime, template) = self._templates.get(
+                    file_path, (None, None))
+        if compiled_mtime == mtime:
+            return template
+
+        with open(file_path, 'r', encoding='utf8') as template_file:
+            template = CompiledTemplate(template_file.read(), filename)
+        with self._lock:
+            self._templates[file_path] = (mtime, template)
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+
+template_registry = TemplateRegistry()
+
+
 class Templates():
     def __init__(self):
         self.templates = {}
@@ -36,29 +104,31 @@ class Templates():
             if value == '':
                 element.attrib.pop(attrib)
 
-    def _clean_xml(self, xml_str):
-        xml = fromstring(xml_str)
+    def _clean_xml(self, xml):
         self._remove_empty_attributes(xml)
         self._remove_nodes_with_empty_attributes(xml)
-        return xml_to_string(xml)
-
-    def _apply_template(self, template_name, variables):
-        return Template(self.templates[template_name]
-                ).substitute(defaultdict(str, variables))
+        return xml
 
     def apply_template(self, template_name, variables):
-        is_xml = os.path.splitext(template_name)[1] == '.xml'
-        result = self._apply_template(template_name, variables)
-        return self._clean_xml(result) if is_xml else result
+        template = self.templates[template_name]
+        result = template.apply(variables)
+        return xml_to_string(self._clean_xml(fromstring(result))
+                ) if template.is_xml else result
 
     def apply_xml_template(self, template_name, variables):
-        return fromstring(self.apply_template(template_name, variables))
+        template = self.templates[template_name]
+        result = template.apply(variables)
+        return self._clean_xml(fromstring(result)
+                ) if template.is_xml else fromstring(result)
 
     def apply_json_template(self, template_name, variables):
         return json.loads(self.apply_template(template_name, variables))
 
+    def get_template_text(self, template_name):
+        template = self.templates.get(template_name, None)
+        return template.template if template is not None else None
+
     def load_template(self, path, filename):
         if filename not in self.templates:
-            with open(f'{PYTHON_DIR}/{path}/{filename}',
-                    'r', encoding='utf8') as template_file:
-                self.templates[filename] = str(template_file.read())
+            self.templates[filename] = template_registry.get_template(
+                    path, filename)
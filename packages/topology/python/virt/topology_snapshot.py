@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+"""
+Compiled snapshot of the topology configuration.
+
+The managers created by the VirtFactory need the devices, device types,
+links, networks and hypervisors of a topology. Reading these through maagic
+is done one leaf at a time, so building the managers for every action (or
+several times for a single hard-reset) walks the whole configuration again.
+
+The snapshot holds the same data in frozen dataclasses. Snapshots are cached
+by CDB transaction id, so actions on an unchanged configuration reuse the
+compiled snapshot and build their managers from it without any maagic reads.
+The status leaves written during actions (interface addresses, host
+interfaces, provisioning and operational status) are all config false
+cdb-oper data, which does not change the transaction id, so these writes do
+not invalidate the snapshot. Scheduling or unscheduling the topology ping
+does change the configuration, so the next action compiles it again.
+"""
+import socket
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from ncs import maagic, maapi
+
+from virt.connection import force_maagic_leaf_val2str
+
+_ncs = __import__('_ncs')
+
+SNAPSHOT_CACHE_SIZE = 8
+
+
+@dataclass(frozen=True)
+class ManagementNetworkConfig:
+    bridge: str
+    ip_address_start: str
+    gateway_address: str
+    dns_server_address: str
+
+
+@dataclass(frozen=True)
+class HypervisorConfig: #pylint: disable=too-many-instance-attributes
+    name: str
+    host: Optional[str]
+    transport: str
+    username: Optional[str]
+    password: Optional[str]
+    tls_certs: Optional[Tuple[str, str]]
+    management_network: ManagementNetworkConfig
+    mac_address_start: str
+    external_bridge: str
+    udp_tunnel_ip_address: str
+    geneve_tunnel_ip_address: str
+    max_parallel_actions: int
+    ssh_idle_timeout: int
+
+
+@dataclass(frozen=True)
+class DeviceConfig:
+    id: int
+    name: str
+    path: str
+    definition: str
+    device_type: str
+    control_plane_id: Optional[int]
+    hypervisor: str
+
+
+@dataclass(frozen=True)
+class LinkConfig:
+    path: str
+    a_end_device: str
+    z_end_device: str
+    a_end_interface_id: Optional[int]
+    z_end_interface_id: Optional[int]
+    a_end_bridge: Optional[str]
+    z_end_bridge: Optional[str]
+
+
+@dataclass(frozen=True)
+class NetworkDeviceConfig:
+    name: str
+    path: str
+    interface_id: Optional[int]
+
+
+@dataclass(frozen=True)
+class NetworkConfig:
+    name: str
+    path: str
+    external_bridge: Optional[str]
+    ipv4_subnet_start: str
+    interface_id: int
+    devices: Tuple[NetworkDeviceConfig, ...]
+
+
+@dataclass(frozen=True)
+class TopologySnapshot:
+    name: str
+    path: str
+    hypervisor: str
+    hypervisors: Tuple[HypervisorConfig, ...]
+    devices: Tuple[DeviceConfig, ...]
+    links: Tuple[LinkConfig, ...]
+    networks: Tuple[NetworkConfig, ...]
+
+    def get_hypervisor(self, hypervisor_name):
+        return next((hypervisor for hypervisor in self.hypervisors
+                     if hypervisor.name == hypervisor_name), None)
+
+
+def compile_hypervisor(hypervisor):
+    mgmt_network = hypervisor.management_network
+    return HypervisorConfig(
+            name=hypervisor.name,
+            host=hypervisor.host,
+            transport=hypervisor.transport,
+            username=hypervisor.username,
+            password=hypervisor.password,
+            tls_certs=(
+                (hypervisor.tls.client_certificate, hypervisor.tls.client_key)
+                if hypervisor.tls.exists() else None),
+            management_network=ManagementNetworkConfig(
+                bridge=mgmt_network.bridge,
+                ip_address_start=mgmt_network.ip_address_start,
+                gateway_address=mgmt_network.gateway_address,
+                dns_server_address=mgmt_network.dns_server_address),
+            mac_address_start=hypervisor.mac_address_start,
+            external_bridge=hypervisor.external_bridge,
+            udp_tunnel_ip_address=hypervisor.udp_tunnel_ip_address,
+            geneve_tunnel_ip_address=hypervisor.geneve_tunnel_ip_address,
+            max_parallel_actions=hypervisor.max_parallel_actions,
+            ssh_idle_timeout=hypervisor.ssh_idle_timeout)
+
+def _compile_device(device, dev_defs, default_hypervisor):
+    return DeviceConfig(
+            id=int(device.id),
+            name=device.device_name,
+            path=device._path,
+            definition=device.definition,
+            device_type=str(dev_defs[device.definition].device_type),
+            control_plane_id=device.control_plane_id,
+            hypervisor=device.hypervisor or default_hypervisor)
+
+def _compile_link(link):
+    return LinkConfig(
+            path=link._path,
+            a_end_device=link.a_end_device,
+            z_end_device=link.z_end_device,
+            a_end_interface_id=link.a_end_interface.id,
+            z_end_interface_id=link.z_end_interface.id,
+            a_end_bridge=link.external_connection.a_end_bridge,
+            z_end_bridge=link.external_connection.z_end_bridge)
+
+def _compile_network(network):
+    return NetworkConfig(
+            name=network.name,
+            path=network._path,
+            external_bridge=network.external_bridge,
+            ipv4_subnet_start=force_maagic_leaf_val2str(
+                network, 'ipv4-subnet-start'),
+            interface_id=network.interface_id,
+            devices=tuple(NetworkDeviceConfig(
+                    name=device.name,
+                    path=device._path,
+                    interface_id=device.interface.id)
+                for device in network.devices.device))
+
+def compile_topology(topology):
+    default_hypervisor = topology.libvirt.hypervisor
+    hypervisors = maagic.cd(topology, '../libvirt/hypervisor')
+    dev_defs = maagic.cd(topology, '../libvirt/device-definition')
+    return TopologySnapshot(
+            name=topology.name,
+            path=topology._path,
+            hypervisor=default_hypervisor,
+            hypervisors=tuple(compile_hypervisor(hypervisor)
+                for hypervisor in hypervisors),
+            devices=tuple(
+                _compile_device(device, dev_defs, default_hypervisor)
+                for device in topology.devices.device),
+            links=tuple(_compile_link(link) for link in topology.links.link),
+            networks=tuple(_compile_network(network)
+                for network in topology.networks.network))
+
+
+_snapshot_cache = OrderedDict()
+_snapshot_cache_lock = threading.Lock()
+
+def _get_config_txid():
+    sock = socket.socket()
+    _ncs.cdb.connect(sock, _ncs.cdb.DATA_SOCKET, '127.0.0.1', _ncs.PORT)
+    try:
+        return _ncs.cdb.get_txid(sock)
+    finally:
+        _ncs.cdb.close(sock)
+
+def get_topology_snapshot(topology):
+    """
+    Return the snapshot of a topology, compiling it if the configuration has
+    changed since the cached snapshot was compiled.
+
+    The snapshot is compiled in a new transaction opened between two reads of
+    the transaction id. It is only cached if the id did not change, so a
+    snapshot is never cached under the id of a different configuration.
+    """
+    txid = _get_config_txid()
+    key = (txid, topology._path)
+    with _snapshot_cache_lock:
+        snapshot = _snapshot_cache.get(key, None)
+        if snapshot is not None:
+            _snapshot_cache.move_to_end(key)
+            return snapshot
+
+    with maapi.single_read_trans('admin', 'python') as trans:
+        snapshot = compile_topology(maagic.get_node(trans, topology._path))
+
+    if _get_config_txid() == txid:
+        with _snapshot_cache_lock:
+            _snapshot_cache[key] = snapshot
+            while len(_snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+                _snapshot_cache.popitem(last=False)
+    return snapshot
@@ -1,10 +1,13 @@
 #!/usr/bin/python3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import ncs
 from ncs import maapi, maagic, OPERATIONAL
 from ncs.dp import Action
+from virt.status_writer import status_writer
 _ncs = __import__('_ncs')
 
 ACTION_STATUS_MAP = {
@@ -14,7 +17,13 @@ ACTION_STATUS_MAP = {
     'destroy': 'defined',
     'undefine': 'undefined'}
 
+CHECK_WORKERS = 8
+
 def write_node_data(path, leaf_value_pairs):
+    if status_writer.is_active():
+        for leaf, value in leaf_value_pairs:
+            status_writer.set(f'{path}/{leaf}', value)
+        return
     with maapi.single_write_trans('admin', 'python') as trans:
         for leaf, value in leaf_value_pairs:
             try:
@@ -26,32 +35,53 @@ def write_node_data(path, leaf_value_pairs):
                 pass
         trans.apply()
 
-def get_hypervisor_output_node(output, hypervisor_name):
-    if hypervisor_name in output.hypervisor:
-        return output.hypervisor[hypervisor_name]
-    return output.hypervisor.create(hypervisor_name)
+_output_lock = threading.Lock()
+
+def add_hypervisor_output(output, hypervisor_name, kind, name):
+    """
+    Add name to the kind list (domains, volumes or networks) of a hypervisor
+    in the action output, which is shared by the action worker threads.
+    """
+    with _output_lock:
+        if hypervisor_name in output.hypervisor:
+            hypervisor_node = output.hypervisor[hypervisor_name]
+        else:
+            hypervisor_node = output.hypervisor.create(hypervisor_name)
+        getattr(hypervisor_node, kind).create(name)
 
 def update_operational_status(node, status):
+    if status_writer.is_active():
+        status_writer.set(
+                f'{node._path}/operational-status', status, OPERATIONAL)
+        return
     with maapi.single_write_trans('admin', 'python', db=OPERATIONAL) as trans:
         trans.set_elem(status, f'{node._path}/operational-status')
         trans.apply()
 
 def update_provisioning_status(node, status):
+    if status_writer.is_active():
+        status_writer.set(
+                f'{node._path}/provisioning-status', status, OPERATIONAL)
+        return
     with maapi.single_write_trans('admin', 'python', db=OPERATIONAL) as trans:
         trans.set_elem(status, f'{node._path}/provisioning-status')
         trans.apply()
 
 def update_status_after_action(node, action):
     update_provisioning_status(node, ACTION_STATUS_MAP[action])
+    return ACTION_STATUS_MAP[action]
 
 def update_device_status_after_action(node, action, unmanaged=False):
+    """Returns the new provisioning status of the device"""
     if unmanaged and action == 'create':
         update_provisioning_status(node, 'unmanaged')
         update_operational_status(node, 'reachable')
-    else:
-        update_status_after_action(node, action)
-        if action in ('shutdown', 'destroy', 'undefine'):
-            update_operational_status(node, 'not-reachable')
+        return 'unmanaged'
+
+    status = update_status_after_action(node, action)
+    if action in ('shutdown', 'destroy', 'undefine'):
+        update_operational_status(node, 'not-reachable')
+    return status
 
 def schedule_topology_ping(keypath):
     with maapi.single_write_trans('admin', 'python') as trans:
@@ -67,19 +97,32 @@ def unschedule_topology_ping(topology_name):
         trans.safe_delete(f'/scheduler/task{{ping-topology-{topology_name}}}')
         trans.apply()
 
-def get_device_status(device_path):
+def get_devices_status(device_paths):
+    """
+    Read the provisioning status of several devices in one transaction.
+    Returns a dict of {device_path: status}.
+    """
+    status_writer.flush()
     with maapi.single_read_trans('admin', 'python', db=OPERATIONAL) as trans:
-        device = maagic.get_node(trans, device_path)
-        return device.provisioning_status
+        return {device_path:
+                    maagic.get_node(trans, device_path).provisioning_status
+                for device_path in device_paths}
 
 
 class TopologyStatus():
     def __init__(self, log):
         self.log = log
         self.device_states = {}
+        self.device_timings = {}
+        self.device_failures = {}  # {device_name: (phase, error)}
+        self._lock = threading.Lock()
+
+    def _set_device_state(self, device_name, status):
+        with self._lock:
+            self.device_states[device_name] = status
 
     def update_device_status(self, topology_device, status):
-        self.device_states[topology_device.device_name] = status
+        self._set_device_state(topology_device.device_name, status)
         update_provisioning_status(topology_device, status)
 
     def check_console_activity(self, topology_device, timeout):
@@ -105,7 +148,7 @@ class TopologyStatus():
 
     def ping_device(self, topology_device, root):
         device_name = topology_device.device_name
-        self.device_states[device_name] = topology_device.provisioning_status
+        self._set_device_state(device_name, topology_device.provisioning_status)
         nso_device = root.devices.device[device_name]
         if nso_device.state.admin_state == 'southbound-locked':
             self.update_device_status(topology_device, 'ready')
@@ -128,7 +171,12 @@ class TopologyStatus():
         device_name = topology_device.device_name
         nso_device = root.devices.device[device_name]
         self.log.info(f'Fetching SSH host keys on {device_name}...')
-        nso_device.ssh.fetch_host_keys()
+        fetch_host_keys = nso_device.ssh.fetch_host_keys()
+        if str(fetch_host_keys.result) == 'failed':
+            self.log.warning(f'Failed to fetch SSH host keys on '
+                             f'{device_name}: {fetch_host_keys.info}')
+            return False
+        return True
 
     def sync_device(self, topology_device, root):
         device_name = topology_device.device_name
@@ -141,25 +189,71 @@ class TopologyStatus():
         else:
             self.update_device_status(topology_device, 'ready')
 
+    def _check_device(self, device_name, device_path):
+        """
+        Readiness pipeline for one device: ping, then fetch SSH host keys,
+        then sync-from. Each phase only runs if the previous one succeeded.
+        The sync runs in a new transaction so it sees the fetched host keys.
+        Returns the phase timings, and records a failed phase (including any
+        error raised by a phase) in device_failures.
+        """
+        timings = {}
+        phase = 'ping'
+
+        def _timed(next_phase, function, *args):
+            nonlocal phase
+            phase = next_phase
+            start = time.monotonic()
+            result = function(*args)
+            timings[phase] = time.monotonic() - start
+            return result
+
+        try:
+            with maapi.single_read_trans('admin', 'python') as trans:
+                root = maagic.get_root(trans)
+                device = maagic.get_node(trans, device_path)
+                if not _timed('ping', self.ping_device, device, root):
+                    return timings
+                if not _timed('fetch-host-keys',
+                        self.fetch_ssh_host_keys, device, root):
+                    with self._lock:
+                        self.device_failures[device_name] = (
+                                phase, 'Failed to fetch SSH host keys')
+                    return timings
+
+            with maapi.single_read_trans('admin', 'python') as trans:
+                root = maagic.get_root(trans)
+                device = maagic.get_node(trans, device_path)
+                _timed('sync', self.sync_device, device, root)
+        except Exception as exc: #pylint: disable=broad-except
+            self.log.error(f'Checking {device_name} failed in {phase}: {exc}')
+            with self._lock:
+                self.device_failures[device_name] = (phase, str(exc))
+
+        return timings
+
     def check(self, topology):
         root = maagic.get_root(topology)
-        reachable_devices = [ device
-            for device in topology.devices.device
-            if root.topologies.libvirt.device_definition[
+        devices = []
+        for device in topology.devices.device:
+            if (root.topologies.libvirt.device_definition[
                     device.definition].ned_id is not None and
-                device.provisioning_status != 'ready' and
-                self.ping_device(device, root) ]
-
-        with maapi.single_read_trans('admin', 'python') as trans:
-            root = maagic.get_root(trans)
-            for device in reachable_devices:
-                self.fetch_ssh_host_keys(device, root)
+                    device.provisioning_status != 'ready'):
+                devices.append((device.device_name, device._path))
+                # Kept if the check of the device fails before the ping
+                self._set_device_state(
+                        device.device_name, device.provisioning_status)
 
-        time.sleep(2)
-        with maapi.single_read_trans('admin', 'python') as trans:
-            root = maagic.get_root(trans)
-            for device in reachable_devices:
-                self.sync_device(device, root)
+        if devices:
+            with ThreadPoolExecutor(max_workers=min(
+                    CHECK_WORKERS, len(devices))) as executor:
+                futures = {
+                        device_name: executor.submit(
+                            self._check_device, device_name, device_path)
+                        for (device_name, device_path) in devices }
+                self.device_timings = {
+                        device_name: future.result()
+                        for device_name, future in futures.items() }
 
         if all(status == 'ready' for status in self.device_states.values()):
             topology_status = 'ready'
@@ -182,8 +276,15 @@ class CheckTopologyStatus(Action):
         if input.frequency == 'schedule':
             schedule_topology_ping(kp)
         else:
-            for (device, status) in TopologyStatus(self.log).check(
+            topology_status = TopologyStatus(self.log)
+            for (device, status) in topology_status.check(
                     maagic.get_node(trans, kp)).items():
                 output_device = output.device.create()
                 output_device.name = device
                 output_device.status = status
+                for (phase, duration) in topology_status.device_timings.get(
+                        device, {}).items():
+                    output_device[f'{phase}-time'] = f'{duration:.3f}'
+                if device in topology_status.device_failures:
+                    (output_device.failed_phase, output_device.error) = \
+                            topology_status.device_failures[device]
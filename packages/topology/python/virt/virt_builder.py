@@ -80,17 +80,37 @@ class VirtBuilder():
             if device_ids:
                 self._factory.create(topology_networks_class)(action, output)
 
-    def volume(self, action, output, device):
+    def get_volume_builder(self, device):
         device_type = self._get_device_type(device)
         if device_type not in self._volume_builders:
             self._volume_builders[device_type] = self._factory.create(
                     self._factory.volume_registry.get(
                             device_type, ConcreteVolume))
-        return self._volume_builders[device_type](action, output, device)
+        return self._volume_builders[device_type]
+
+    def volume(self, action, output, device):
+        return self.get_volume_builder(device)(action, output, device)
+
+    def get_base_images(self, devices):
+        return set(filter(None, (
+                self.get_volume_builder(device).get_base_image(device)
+                for device in devices)))
+
+    def provision_volumes(self, devices):
+        for device in devices:
+            self.get_volume_builder(device).provision(device)
+
+    def get_day0_image_builds(self, devices):
+        return list(filter(None, (
+                self.get_volume_builder(device).get_day0_image_build(device)
+                for device in devices)))
 
     def is_domain_active(self, device):
         return self.get_domain_builder(device).is_active(device)
 
+    def watch_domain_shutdown(self, device, waiter):
+        return self.get_domain_builder(device).watch_shutdown(device, waiter)
+
     def domain_supports_shutdown(self, device):
         return self.get_domain_builder(device).shutdown_supported()
 
@@ -105,3 +125,6 @@ class VirtBuilder():
 
     def get_connection_mgr(self):
         return self._factory.get_connection_mgr()
+
+    def get_domain_mgr(self):
+        return self._factory.get_domain_mgr()
@@ -1,16 +1,18 @@
 #!/usr/bin/python3
+from copy import copy
 from ipaddress import IPv4Interface
 from ncs import maagic
 
 from virt.hypervisor import HypervisorManager
 from virt.connection import ConnectionManager, generate_ip_address
 from virt.domain import DomainManager
+from virt.topology_snapshot import get_topology_snapshot
 
 
 class ResourceManager():
-    def __init__(self, hypervisor, username):
+    def __init__(self, hypervisor, username, authgroups):
         self._username = username
-        self._authgroups = maagic.get_root(hypervisor).devices.authgroups.group
+        self._authgroups = authgroups
 
         mgmt_network = hypervisor.management_network
         suffix = '{:02x}:{:02x}:{:02x}'
@@ -32,6 +34,11 @@ class ResourceManager():
     def generate_mgmt_subnet(self):
         return str(IPv4Interface(f'{self._mgmt_ip_address_start}/24').network)
 
+    def bind(self, trans):
+        resource_mgr = copy(self)
+        resource_mgr._authgroups = maagic.get_node(trans, self._authgroups._path)
+        return resource_mgr
+
     def get_authgroup_mapping(self, authgroup_name):
         authgroup = self._authgroups[authgroup_name]
         return authgroup.umap[self._username] if (
@@ -46,14 +53,14 @@ class VirtFactory():
     topology_networks_registry = {}
 
     def __init__(self, username, topology, log):
-        hypervisor_name = topology.libvirt.hypervisor
-        hypervisors = maagic.cd(topology, '../libvirt/hypervisor')
-        hypervisor = hypervisors[hypervisor_name]
-
-        self._hypervisor_mgr = HypervisorManager(hypervisors, topology, log)
-        self._resource_mgr = ResourceManager(hypervisor, username)
-        self._domain_mgr = DomainManager(topology, VirtFactory.domain_registry)
-        self._connection_mgr = ConnectionManager(topology,
+        snapshot = get_topology_snapshot(topology)
+
+        self._hypervisor_mgr = HypervisorManager(snapshot, log)
+        self._resource_mgr = ResourceManager(
+                snapshot.get_hypervisor(snapshot.hypervisor), username,
+                maagic.get_root(topology).devices.authgroups.group)
+        self._domain_mgr = DomainManager(snapshot, VirtFactory.domain_registry)
+        self._connection_mgr = ConnectionManager(snapshot,
                 self._hypervisor_mgr, self._domain_mgr, self._resource_mgr)
         self._dev_defs = maagic.cd(topology, '../libvirt/device-definition')
         self._log = log
@@ -69,6 +76,25 @@ class VirtFactory():
                 self._dev_defs,
                 self._log)
 
+    def bind(self, trans):
+        """
+        Return a copy of this factory which reads device definitions and
+        authgroups through the given transaction. The managers are shared.
+        Maagic nodes must not be shared between threads, so each scheduler
+        worker uses its own bound factory.
+        """
+        factory = copy(self)
+        factory._resource_mgr = self._resource_mgr.bind(trans)
+        factory._dev_defs = maagic.get_node(trans, self._dev_defs._path)
+        factory.topology = maagic.get_node(trans, self.topology._path)
+        return factory
+
+    def get_hypervisor_mgr(self):
+        return self._hypervisor_mgr
+
+    def get_domain_mgr(self):
+        return self._domain_mgr
+
     def get_device_type(self, device_id=None, device_name=None):
         if device_name:
             device_id = self._domain_mgr.get_device_id(device_name)
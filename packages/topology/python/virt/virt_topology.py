@@ -1,17 +1,24 @@
 #!/usr/bin/python3
-from time import sleep
+from contextlib import contextmanager
+from functools import partial
 
 import os
 import virt.domain_extentions
 
 from ncs.dp import Action
-from ncs import maagic
+from ncs import maagic, maapi
 from virt.topology_status import \
         update_device_status_after_action, update_status_after_action, \
         schedule_topology_ping, unschedule_topology_ping
 
+from virt.day0_cache import build_day0_images
+from virt.image_distribution import ImageDistributor
+from virt.link_plan import build_link_plans, apply_link_plans
 from virt.virt_factory import VirtFactory
 from virt.virt_builder import VirtBuilder
+from virt.scheduler import DeviceScheduler
+from virt.shutdown_waiter import ShutdownWaiter
+from virt.status_writer import status_writer
 from virt.topology_status import write_node_data
 
 _ncs = __import__('_ncs')
@@ -27,14 +34,14 @@ class Topology():
             raise Exception('No hypervisor defined for this topology')
 
         self._topology = topology
-        self._dev_defs = maagic.cd(topology, '../libvirt/device-definition')
         self._output = output
         self._log = log
 
-        self._virt_builder = VirtBuilder(
-                VirtFactory(username, topology, log))
+        self._virt_factory = VirtFactory(username, topology, log)
+        self._virt_builder = VirtBuilder(self._virt_factory)
 
-    def process_device_connections(self, action, output, device, when):
+    def process_device_connections(self, action, output, device, when,
+                                   virt_builder=None):
         """
         Iterate over each device interface and invoke the interface action.
         This will perform the appropriate stitching for the type of device.
@@ -46,38 +53,120 @@ class Topology():
         invoked on the other end of the link (when this function was executed
         for that device) but this device would not have been ready at that time.
         """
-        connection_mgr = self._virt_builder.get_connection_mgr()
-        if not self._virt_builder.domain_has_dataplane(device):
+        virt_builder = virt_builder or self._virt_builder
+        connection_mgr = virt_builder.get_connection_mgr()
+        if not virt_builder.domain_has_dataplane(device):
             return
-        for iface_id in range(connection_mgr.get_num_device_ifaces()):
-            self._virt_builder.connection(
+        for iface_id in connection_mgr.get_device_iface_ids(device.id):
+            virt_builder.connection(
                     action, output, device.id, iface_id, when, False)
             link_dest = connection_mgr.get_iface_link_dest(device.id, iface_id)
             if link_dest:
                 (other_device_id, other_iface_id) = link_dest
-                self._virt_builder.connection(
+                virt_builder.connection(
                         action, output,
                         other_device_id, other_iface_id, when, True)
 
-    def _device_action(self, action, output, device):
-        dev_def = self._dev_defs[device.definition]
+    def _device_action(self, action, output, device, virt_builder=None):
+        virt_builder = virt_builder or self._virt_builder
+        dev_def = maagic.cd(device, '../../../libvirt/device-definition')[
+                device.definition]
 
-        self._virt_builder.domain_networks(action, output, device)
-        self.process_device_connections(action, output, device, 'pre-domain')
+        virt_builder.domain_networks(action, output, device)
+        self.process_device_connections(
+                action, output, device, 'pre-domain', virt_builder)
 
         if action == 'define':
-            self._virt_builder.volume(action, output, device)
+            virt_builder.volume(action, output, device)
 
-        self._virt_builder.domain(action, output, device)
+        virt_builder.domain(action, output, device)
 
         if action != 'define':
-            self._virt_builder.volume(action, output, device)
+            virt_builder.volume(action, output, device)
 
-        self.process_device_connections(action, output, device, 'post-domain')
+        self.process_device_connections(
+                action, output, device, 'post-domain', virt_builder)
 
-        update_device_status_after_action(device,
-                action, dev_def.ned_id is None)
+        virt_builder.get_domain_mgr().set_device_status(device.id,
+                update_device_status_after_action(device,
+                    action, dev_def.ned_id is None))
 
+    @contextmanager
+    def _worker_context(self):
+        with maapi.single_read_trans('admin', 'python') as trans:
+            yield (trans, VirtBuilder(self._virt_factory.bind(trans)))
+
+    def _scheduled_device_action(self, action, output, device_path, context):
+        (trans, virt_builder) = context
+        self._device_action(action, output,
+                maagic.get_node(trans, device_path), virt_builder)
+
+    def _schedule_order(self, device):
+        return (bool(self._virt_builder.domain_is_container(device)),
+                int(device.id))
+
+    def _device_dependencies(self, action, devices):
+        """
+        Build the ordering constraints between the devices for an action.
+
+        Devices are ordered with all VMs before all containers (then by id).
+        Every dependency returned here follows that order, so the result is
+        always acyclic, and only constrains devices that actually interact:
+
+        - Libvirt managed networks are defined/started by the first member
+          and stopped/undefined by the last member, once the status of every
+          other member has been updated.
+        - Direct links between a container and a VM or another container are
+          plumbed when the second device sees the first as started. VMs come
+          before the containers which take their TAP interfaces.
+        - Data plane devices come after their control plane device.
+        """
+        domain_mgr = self._virt_factory.get_domain_mgr()
+        connection_mgr = self._virt_factory.get_connection_mgr()
+
+        order = {int(device.id): self._schedule_order(device)
+                 for device in devices}
+
+        # Interfaces are keyed by control plane id, map back to all devices
+        # that process them.
+        plane_devices = {}
+        for device_id in order:
+            plane_devices.setdefault(
+                    int(domain_mgr.resolve_control_plane_id(device_id)), []
+                    ).append(device_id)
+
+        dependencies = {device_id: set() for device_id in order}
+
+        def _add(first_ids, second_ids):
+            for first_id in first_ids:
+                for second_id in second_ids:
+                    if order[first_id] < order[second_id]:
+                        dependencies[second_id].add(first_id)
+                    elif order[second_id] < order[first_id]:
+                        dependencies[first_id].add(second_id)
+
+        for device_ids in plane_devices.values():
+            _add(device_ids, device_ids)
+
+        for members in connection_mgr.get_managed_network_members().values():
+            member_ids = sorted((device_id
+                    for member in members
+                    for device_id in plane_devices.get(member, [])),
+                key=order.get)
+            if len(member_ids) < 2:
+                continue
+            if action in ('define', 'create'):
+                _add(member_ids[:1], member_ids[1:])
+            else:
+                _add(member_ids[:-1], member_ids[-1:])
+
+        for (device_id, other_id) in connection_mgr.get_direct_link_peers():
+            if (domain_mgr.is_container(device_id) or
+                    domain_mgr.is_container(other_id)):
+                _add(plane_devices.get(device_id, []),
+                     plane_devices.get(other_id, []))
+
+        return dependencies
 
     def action(self, action, device_name=None):
         output = self._output.libvirt_action.create()
@@ -87,31 +176,83 @@ class Topology():
             self._virt_builder.topology_networks(
                     action, output, self._topology.devices.device)
 
-        for device in self._topology.devices.device:
-            if self._virt_builder.domain_is_container(device):
-                continue
-            if device_name is not None and device.device_name != device_name:
-                continue
-            self._device_action(action, output, device)
-
-        for device in self._topology.devices.device:
-            if not self._virt_builder.domain_is_container(device):
-                continue
-            if device_name is not None and device.device_name != device_name:
-                continue
-            self._device_action(action, output, device)
-
-
-    def wait_for_shutdown(self, device_name=None):
+        devices = sorted((device for device in self._topology.devices.device
+                          if device_name is None or
+                             device.device_name == device_name),
+                         key=self._schedule_order)
+
+        hypervisor_mgr = self._virt_factory.get_hypervisor_mgr()
+        scheduler = DeviceScheduler(self._log, self._worker_context)
+        for hypervisor_name in hypervisor_mgr.get_hypervisors():
+            scheduler.set_hypervisor_limit(hypervisor_name,
+                    hypervisor_mgr.get_parallel_action_limit(hypervisor_name))
+
+        dependencies = self._device_dependencies(action, devices)
+        for device in devices:
+            device_id = int(device.id)
+            scheduler.add_task(device_id,
+                    partial(self._scheduled_device_action,
+                            action, output, device._path),
+                    hypervisor_mgr.get_device_hypervisor(device_id),
+                    dependencies[device_id])
+
+        try:
+            with status_writer.batch():
+                # The day0 variables write interface data, so the images are
+                # built inside the batch, and reused when each device is
+                # defined
+                if action == 'define':
+                    ImageDistributor(hypervisor_mgr, self._log).distribute(
+                            self._virt_builder.get_base_images(devices))
+                    self._virt_builder.provision_volumes(devices)
+                    build_day0_images(
+                            self._virt_builder.get_day0_image_builds(devices),
+                            self._log)
+                scheduler.run()
+        finally:
+            hypervisor_mgr.volume_provisioner.shutdown()
+            hypervisor_mgr.day0_image_builds.clear()
+        return output
+
+    def plumb_links(self, output, dry_run=False):
+        """
+        Plumb the container interfaces of all devices in bulk (see
+        link_plan), and write the plan of each hypervisor to the output.
+        """
+        hypervisor_mgr = self._virt_factory.get_hypervisor_mgr()
+        plans = build_link_plans(
+                [int(device.id) for device in self._topology.devices.device],
+                hypervisor_mgr,
+                self._virt_factory.get_domain_mgr(),
+                self._virt_factory.get_connection_mgr())
+
+        for plan in plans.values():
+            hypervisor_output = output.hypervisor.create(plan.hypervisor_name)
+            hypervisor_output.operations = plan.num_operations()
+            for (namespace, batch) in plan.render().items():
+                hypervisor_output.namespace.create(namespace).batch = batch
+            for skipped in plan.skipped:
+                hypervisor_output.skipped.create(skipped)
+
+        if not dry_run:
+            apply_link_plans(plans, hypervisor_mgr)
+
+    def wait_for_shutdown(self, device_name=None, output=None):
         self._log.info('Waiting for shutdown to complete...')
-        timer = 0
-        while any(self._virt_builder.is_domain_active(device)
-                  for device in self._topology.devices.device
-                  if (device_name is None or device.device_name == device_name)
-                  and self._virt_builder.domain_supports_shutdown(device)
-                  ) and timer < 60:
-            sleep(10)
-            timer += 10
+        waiter = ShutdownWaiter(self._log)
+        for device in self._topology.devices.device:
+            if ((device_name is None or device.device_name == device_name) and
+                    self._virt_builder.domain_supports_shutdown(device)):
+                self._virt_builder.watch_domain_shutdown(device, waiter)
+
+        timed_out = waiter.wait()
+        if timed_out:
+            self._log.warning(
+                    f'Shutdown timed out for devices: {", ".join(timed_out)}')
+            if output is not None:
+                for timed_out_device in timed_out:
+                    output.shutdown_timeout.create(timed_out_device)
+        return timed_out
 
     def get_virt_builder(self):
         return self._virt_builder
@@ -143,8 +284,9 @@ class LibvirtAction(Action):
                 if not input.device:
                     unschedule_topology_ping(kp[1][0])
 
-                virt_topology.action('shutdown', input.device)
-                virt_topology.wait_for_shutdown(input.device)
+                shutdown_output = virt_topology.action(
+                        'shutdown', input.device)
+                virt_topology.wait_for_shutdown(input.device, shutdown_output)
                 action = 'destroy'
 
             virt_topology.action(action, input.device)
@@ -157,15 +299,12 @@ class LibvirtAction(Action):
             run_action('stop')
             action = 'start'
 
+        # The configuration does not change during a hard-reset, so the one
+        # Topology (and its managers) is used for each of its actions. The
+        # libvirt state they cache is kept up to date by the actions.
         if name == 'hard-reset':
             run_action('undefine')
-            virt_topology = None
-            sleep(5)
-            virt_topology = Topology(topology, self.log, output, uinfo.username)
             run_action('define')
-            virt_topology = None
-            sleep(5)
-            virt_topology = Topology(topology, self.log, output, uinfo.username)
 
         run_action(action)
 
@@ -194,3 +333,15 @@ class LibvirtNetworkAction(Action):
         virt_topology = Topology(topology, self.log, output, uinfo.username)
         #virt_topology.get_virt_builder().link_network(
         #        action, action_output, link)
+
+
+class LibvirtPlumbLinksAction(Action):
+    @Action.action
+    def cb_action(self, uinfo, name, kp, input, output, trans):
+        self.log.info('action name: ', name)
+
+        topology = maagic.get_node(trans, kp[1:])
+
+        trans.maapi.install_crypto_keys()
+        virt_topology = Topology(topology, self.log, output, uinfo.username)
+        virt_topology.plumb_links(output, input.dry_run)
@@ -1,13 +1,16 @@
 #!/usr/bin/python3
 from abc import abstractmethod
+from functools import partial
 from io import BytesIO
 
 import base64
-import subprocess
+import tarfile
+import time
 
-from passlib.hash import md5_crypt, sha512_crypt
-
-from virt.topology_status import get_hypervisor_output_node
+from virt.day0_cache import day0_image_cache, get_day0_image_key, \
+        get_password_hashes
+from virt.topology_status import add_hypervisor_output
+from virt.volume_upload import upload_volume
 from virt.virt_base import VirtBase
 
 _ncs = __import__('_ncs')
@@ -19,8 +22,38 @@ def generate_volume_name(device_name):
 def generate_day0_volume_name(device_name):
     return f'{device_name}-day0.img'
 
+def create_tgz(files):
+    """Return a gzipped tar archive of files {path: content}"""
+    tgz_stream = BytesIO()
+    mtime = time.time()
+    with tarfile.open(fileobj=tgz_stream, mode='w:gz') as tgz:
+        directories = set()
+        for (path, content) in files.items():
+            parts = path.split('/')[:-1]
+            for depth in range(1, len(parts) + 1):
+                directory = '/'.join(parts[:depth])
+                if directory not in directories:
+                    directories.add(directory)
+                    info = tarfile.TarInfo(directory)
+                    info.type = tarfile.DIRTYPE
+                    info.mode = 0o755
+                    info.mtime = mtime
+                    tgz.addfile(info)
+            byte_str = content.encode() if isinstance(content, str) else content
+            info = tarfile.TarInfo(path)
+            info.size = len(byte_str)
+            info.mode = 0o644
+            info.mtime = mtime
+            tgz.addfile(info, BytesIO(byte_str))
+    return tgz_stream.getvalue()
+
 
 class Volume(VirtBase):
+    # Templates used by _create_day0_image, as well as the day0 file
+    DAY0_TEMPLATES = ()
+    # Images are cached unless building them has other side effects
+    CACHE_DAY0_IMAGE = True
+
     def _load_templates(self):
         self._templates.load_template('templates', 'volume.xml')
 
@@ -30,61 +63,6 @@ class Volume(VirtBase):
         for template in day0_templates:
             self._templates.load_template('images', template)
 
-    def _create_raw_disk_image(self, file_name, create_partition_table=True):
-        size = 1024 * 1024 #1048576
-        bytes_per_sector = 512
-        sectors_per_track = 63
-        heads = 2
-
-        sectors = size / bytes_per_sector #2048
-        actual_sectors = int(sectors // sectors_per_track * sectors_per_track) #32*63 = 2016
-        actual_size = actual_sectors * bytes_per_sector #1032192
-        cylinders = int(actual_sectors / sectors_per_track / heads) #16
-        first_sector = sectors_per_track * int(create_partition_table) #63
-
-        #dd if=/dev/zero of=test.img count=2016
-        self._log.info(f'Creating empty disk image using temporary disk file '
-                       f'{file_name}')
-        with open(file_name, 'wb') as binary_file:
-            binary_file.write(b'\x00' * actual_size)
-
-        if first_sector > 0:
-            #fdisk --cylinders 16 --heads 2 --sectors 63 test.img
-            self._log.info('Creating partition table using fdisk')
-            with subprocess.Popen(['fdisk',
-                        '--cylinders', str(cylinders),
-                        '--heads', str(heads),
-                        '--sectors', str(sectors_per_track),
-                        file_name],
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,
-                    text=True) as fdisk:
-                fdisk.communicate(
-                        f'n\n' #Add partition
-                        f'p\n' #Partition type (primary)
-                        f'1\n' #Partition number
-                        f'{first_sector}\n' #First sector
-                        f'{actual_sectors-1}\n' #Last sector
-                        f't\n' #Change partition type
-                        f'01\n' #01 FAT12
-                        f'a\n' #Toggle boot flag
-                        f'w\n' #Write table and exit
-                    )
-
-        #mkfs.fat -F 12 -g 16/63 -h 1 -R 8 -s 8 -v --offset 63 ./test.img
-        self._log.info('Formatting partition using mkfs.fat')
-        subprocess.run(['mkfs.fat',
-                '-F', '12', #FAT size
-                '-g', f'{heads}/{sectors_per_track}', #Geometry
-                '-h', '1', #Hiddens sectors
-                '-R', '8', #Reserved sectors
-                '-s', '8', #Sectors per cluster
-                '--offset', f'{first_sector}',
-                file_name],
-            stdout=subprocess.DEVNULL, check=True)
-
-        return first_sector*bytes_per_sector
-
     def _add_iso_file(self, iso, file_string, file_name):
         self._log.debug(f'{file_name}:\n{file_string}')
         byte_str = file_string.encode()
@@ -97,8 +75,7 @@ class Volume(VirtBase):
 
         return image_byte_str
 
-    def _create_day0_volume(self, libvirt, device_id, device_name, dev_def):
-        volume_name = generate_day0_volume_name(device_name)
+    def _get_day0_variables(self, device_id, device_name, dev_def):
         mapping = self._resource_mgr.get_authgroup_mapping(dev_def.authgroup)
 
         variables = {
@@ -107,10 +84,7 @@ class Volume(VirtBase):
             'mac-address': self._resource_mgr.generate_mac_address(
                 device_id, 0xff, True),
             'username': mapping.remote_name,
-            'password': sha512_crypt.using(rounds=5000).hash(
-                _ncs.decrypt(mapping.remote_password)),
-            'password-md5': md5_crypt.using(salt_size=4).hash(
-                _ncs.decrypt(mapping.remote_password)),
+            **get_password_hashes(dev_def.authgroup, mapping),
             **self._resource_mgr.mgmt_network_variables}
 
         if dev_def.day0_upload_file:
@@ -118,9 +92,48 @@ class Volume(VirtBase):
                 byte_array = binary_file.read()
             variables['file-content'] = base64.b64encode(byte_array).decode()
 
+        return variables
+
+    def _get_day0_image_build(self, device_id, device_name, dev_def):
+        """
+        Return a callable which returns the day0 image, from the cache if an
+        identical image has already been built.
+        """
+        variables = self._get_day0_variables(device_id, device_name, dev_def)
         self._templates.load_template('images', dev_def.day0_file)
-        image_byte_str = self._create_day0_image(
+        create = partial(self._create_day0_image,
                 dev_def.day0_file, variables, device_id)
+        if not self.CACHE_DAY0_IMAGE:
+            return create
+
+        key = get_day0_image_key(type(self).__name__, {
+                template: self._templates.get_template_text(template)
+                for template in (dev_def.day0_file, *self.DAY0_TEMPLATES)},
+            variables)
+        return partial(day0_image_cache.get_image, key, create)
+
+    def get_day0_image_build(self, device):
+        """
+        The day0 image build of a device, if it is defined with one. The build
+        is kept until the day0 volume of the device is created, which reuses
+        it rather than generating the day0 variables again.
+        """
+        dev_def = self._dev_defs[device.definition]
+        if (dev_def.day0_file is None or not self.CACHE_DAY0_IMAGE or
+                not self._hypervisor_mgr.get_device_libvirt(device.id)):
+            return None
+        device_id = int(device.id)
+        build = self._get_day0_image_build(
+                device_id, device.device_name, dev_def)
+        self._hypervisor_mgr.day0_image_builds[device_id] = build
+        return build
+
+    def _create_day0_volume(self, libvirt, device_id, device_name, dev_def):
+        volume_name = generate_day0_volume_name(device_name)
+        build = self._hypervisor_mgr.day0_image_builds.pop(device_id, None)
+        if build is None:
+            build = self._get_day0_image_build(device_id, device_name, dev_def)
+        image_byte_str = build()
 
         pool = libvirt.conn.storagePoolLookupByName(dev_def.storage_pool)
         volume_xml_str = self._templates.apply_template('volume.xml', {
@@ -135,12 +148,11 @@ class Volume(VirtBase):
 
         self._log.info(
                 f'[{libvirt.name}] Uploading day0 image to volume {volume_name}')
-        stream = libvirt.conn.newStream()
-        volume.upload(stream, 0, len(image_byte_str))
-        stream.send(image_byte_str)
-        stream.finish()
-        get_hypervisor_output_node(
-                self._output, libvirt.name).volumes.create(volume_name)
+        upload_volume(libvirt.conn, volume, image_byte_str,
+                      self._log, f'[{libvirt.name}] ')
+        libvirt.add_volume(dev_def.storage_pool, volume)
+        add_hypervisor_output(
+                self._output, libvirt.name, 'volumes', volume_name)
 
     def _create_volume(self, libvirt, volume_name, pool_name,
             base_image_name, clone, new_size):
@@ -165,8 +177,8 @@ class Volume(VirtBase):
 
         if new_size is not None:
             vol.resize(new_size*1024*1024*1024)
-        get_hypervisor_output_node(
-                self._output, libvirt.name).volumes.create(volume_name)
+        libvirt.add_volume(pool_name, vol)
+        return volume_name
 
     def _delete_volume(self, libvirt, pool, volume_name, volume_type='volume'):
         if volume_name and volume_name in libvirt.volumes[pool.name()]:
@@ -174,8 +186,46 @@ class Volume(VirtBase):
             self._log.info(f'[{libvirt.name}] '
                            f'Running delete on {volume_type} {volume_name}')
             volume.delete()
-            get_hypervisor_output_node(
-                    self._output, libvirt.name).volumes.create(volume_name)
+            libvirt.remove_volume(pool.name(), volume_name)
+            add_hypervisor_output(
+                    self._output, libvirt.name, 'volumes', volume_name)
+
+    @staticmethod
+    def _has_volume(dev_def):
+        return dev_def.device_type not in ['XRd', 'SR-Linux', 'VXR-8000']
+
+    def _get_volume_create(self, libvirt, device_name, dev_def):
+        return partial(self._create_volume,
+                libvirt, generate_volume_name(device_name),
+                dev_def.storage_pool, dev_def.base_image,
+                dev_def.base_image_type == 'clone', dev_def.disk_size)
+
+    def _get_volume_progress(self, libvirt, volume_name, pool_name):
+        info = libvirt.conn.storagePoolLookupByName(
+                pool_name).storageVolLookupByName(volume_name).info()
+        return (round(info[2]/1024/1024), round(info[1]/1024/1024))
+
+    def get_base_image(self, device):
+        """Returns (hypervisor_name, pool_name, image_name), if it has one"""
+        dev_def = self._dev_defs[device.definition]
+        libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
+        if libvirt and self._has_volume(dev_def) and dev_def.base_image:
+            return (libvirt.name, dev_def.storage_pool, dev_def.base_image)
+        return None
+
+    def provision(self, device):
+        """
+        Start creating the volume of a device, ahead of its define. The
+        volume is added to the action output by define.
+        """
+        dev_def = self._dev_defs[device.definition]
+        libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
+        if libvirt and self._has_volume(dev_def):
+            self._hypervisor_mgr.volume_provisioner.submit(
+                    libvirt.name, dev_def.storage_pool,
+                    generate_volume_name(device.device_name),
+                    self._get_volume_create(
+                        libvirt, device.device_name, dev_def))
 
     def define(self, device):
         dev_def = self._dev_defs[device.definition]
@@ -183,10 +233,19 @@ class Volume(VirtBase):
         device_name = device.device_name
         libvirt = self._hypervisor_mgr.get_device_libvirt(device.id)
         if libvirt:
-            if not dev_def.device_type in ['XRd', 'SR-Linux', 'VXR-8000']:
-                self._create_volume(libvirt, generate_volume_name(device_name),
-                        dev_def.storage_pool, dev_def.base_image,
-                        dev_def.base_image_type == 'clone', dev_def.disk_size)
+            volume_name = generate_volume_name(device_name)
+            if self._has_volume(dev_def):
+                # The provisioner only creates the volume, it is added to the
+                # output here, on the worker thread
+                volume_name = self._hypervisor_mgr.volume_provisioner.wait(
+                        libvirt.name, dev_def.storage_pool, volume_name,
+                        partial(self._get_volume_progress, libvirt,
+                                volume_name, dev_def.storage_pool))
+                if volume_name is None:
+                    volume_name = self._get_volume_create(
+                            libvirt, device_name, dev_def)()
+                add_hypervisor_output(
+                        self._output, libvirt.name, 'volumes', volume_name)
 
             if dev_def.day0_file is not None:
                 self._create_day0_volume(
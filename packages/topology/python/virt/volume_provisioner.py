@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+"""
+Provisioning of device volumes ahead of the domain definitions.
+
+Cloning a multi-GB base image takes a long time, so when a topology is
+defined the volumes of all of its devices are created up front, in parallel,
+limited per storage pool and per hypervisor so that the storage is not
+overloaded. The define of each device then only waits for its own volumes.
+
+Libvirt has no job info for volume operations, so progress is reported from
+the allocation of the volume being created.
+"""
+import threading
+from concurrent import futures
+
+PROVISION_WORKERS = 16
+POOL_CONCURRENCY = 2
+HYPERVISOR_CONCURRENCY = 4
+PROGRESS_INTERVAL = 15
+
+
+class VolumeProvisioner():
+    def __init__(self, log):
+        self._log = log
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}  # {(hypervisor_name, pool_name, volume_name): Future}
+        self._limits = {}   # {hypervisor_name or (hypervisor_name, pool_name):
+                            #  Semaphore}
+
+    def _get_limit(self, key, concurrency):
+        with self._lock:
+            return self._limits.setdefault(
+                    key, threading.BoundedSemaphore(concurrency))
+
+    def _provision(self, hypervisor_name, pool_name, create):
+        with self._get_limit(hypervisor_name, HYPERVISOR_CONCURRENCY):
+            with self._get_limit((hypervisor_name, pool_name),
+                                 POOL_CONCURRENCY):
+                return create()
+
+    def submit(self, hypervisor_name, pool_name, volume_name, create):
+        """Start creating a volume, with create()"""
+        key = (hypervisor_name, pool_name, volume_name)
+        with self._lock:
+            if key in self._futures:
+                return
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                        max_workers=PROVISION_WORKERS,
+                        thread_name_prefix='VolumeProvisioner')
+            self._futures[key] = self._executor.submit(
+                    self._provision, hypervisor_name, pool_name, create)
+
+    def wait(self, hypervisor_name, pool_name, volume_name, get_progress):
+        """
+        Wait for a volume to be created, logging get_progress() (allocated
+        and total MiB) periodically. Returns the result of create(), or None
+        if the volume was not submitted, so must be created by the caller.
+        """
+        with self._lock:
+            future = self._futures.pop(
+                    (hypervisor_name, pool_name, volume_name), None)
+        if future is None:
+            return None
+
+        while True:
+            try:
+                return future.result(timeout=PROGRESS_INTERVAL)
+            except futures.TimeoutError:
+                try:
+                    (allocation, capacity) = get_progress()
+                    self._log.info(f'[{hypervisor_name}] Creating volume '
+                                   f'{volume_name}: {allocation}MiB of '
+                                   f'{capacity}MiB allocated')
+                except Exception: #pylint: disable=broad-except
+                    self._log.info(f'[{hypervisor_name}] Waiting for volume '
+                                   f'{volume_name}')
+
+    def shutdown(self):
+        """Wait for any volumes which were not waited for"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._futures.clear()
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+"""
+Streaming uploads of volume contents.
+
+The contents are sent to the libvirt stream in bounded chunks, straight from
+the source buffer (the day0 image built in memory), so the upload does not
+make its own copy of the image. Blocks of zeros are sent as holes in a sparse
+stream, rather than as data, which makes the upload of a mostly empty raw
+image much faster. If the hypervisor does not support sparse streams, the
+whole image is sent as data.
+
+A day0 upload file is not streamed from disk: its contents are a variable of
+the day0 template, so it is read in full and inlined into the image.
+"""
+import time
+import libvirt
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+SPARSE_BLOCK_SIZE = 64 * 1024
+
+
+def get_data_segments(data, block_size=SPARSE_BLOCK_SIZE):
+    """
+    Split data into segments of data and zeros, returned as a list of
+    [in_data, length]. Only whole blocks of zeros are treated as holes.
+    """
+    zero_block = bytes(block_size)
+    segments = []
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        in_data = block != zero_block[:len(block)]
+        if segments and segments[-1][0] == in_data:
+            segments[-1][1] += len(block)
+        else:
+            segments.append([in_data, len(block)])
+    return segments
+
+
+class _SparseUpload():
+    """The handlers for virStream.sparseSendAll, sending from a buffer"""
+
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+        self._segments = get_data_segments(data)
+        self.data_bytes = sum(length for (in_data, length) in self._segments
+                              if in_data)
+
+    def hole_handler(self, _stream, _):
+        if not self._segments:
+            return [True, 0]
+        return list(self._segments[0])
+
+    def skip_handler(self, _stream, length, _):
+        self._consume(length)
+        return 0
+
+    def send_handler(self, _stream, nbytes, _):
+        chunk = bytes(self._data[self._offset:self._offset + nbytes])
+        self._consume(len(chunk))
+        return chunk
+
+    def _consume(self, length):
+        self._offset += length
+        while length and self._segments:
+            consumed = min(length, self._segments[0][1])
+            self._segments[0][1] -= consumed
+            length -= consumed
+            if not self._segments[0][1]:
+                self._segments.pop(0)
+
+
+def _start_upload(conn, volume, length, log, log_prefix):
+    """Returns (stream, sparse), with a sparse stream if it is supported"""
+    stream = conn.newStream()
+    try:
+        volume.upload(stream, 0, length,
+                      libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+        return (stream, True)
+    except libvirt.libvirtError as exc:
+        stream.abort()
+        log.info(f'{log_prefix}Sparse upload not supported ({exc}), '
+                 f'uploading all data')
+
+    stream = conn.newStream()
+    volume.upload(stream, 0, length, 0)
+    return (stream, False)
+
+
+def upload_volume(conn, volume, data, log, log_prefix=''):
+    """
+    Upload data (bytes, or any buffer) to a volume, as a sparse stream if
+    the hypervisor supports it. Logs and returns the throughput in MiB/s.
+    """
+    with memoryview(data) as view:
+        start_time = time.monotonic()
+        (stream, sparse) = _start_upload(
+                conn, volume, len(view), log, log_prefix)
+        try:
+            if sparse:
+                upload = _SparseUpload(view)
+                stream.sparseSendAll(upload.send_handler, upload.hole_handler,
+                                     upload.skip_handler, None)
+                data_bytes = upload.data_bytes
+            else:
+                for offset in range(0, len(view), UPLOAD_CHUNK_SIZE):
+                    stream.send(
+                            bytes(view[offset:offset + UPLOAD_CHUNK_SIZE]))
+                data_bytes = len(view)
+            stream.finish()
+        except Exception:
+            stream.abort()
+            raise
+
+        duration = max(time.monotonic() - start_time, 1e-6)
+        throughput = len(view) / duration / (1024 * 1024)
+        log.info(f'{log_prefix}Uploaded {len(view)/(1024*1024):.1f}MiB '
+                 f'({data_bytes/(1024*1024):.1f}MiB data) to volume '
+                 f'{volume.name()} in {duration:.2f}s ({throughput:.1f}MiB/s)')
+        return throughput
+